@@ -2,17 +2,41 @@
 FastAPI server for Google Gemini AI food detection and quality assessment
 """
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
-import re
+from typing import Callable, Dict, Optional, List
+import asyncio
+import hashlib
+import json
+import threading
+import time
 import uvicorn
 import os
+import logging
 import warnings
 from dotenv import load_dotenv
-from pypdf import PdfReader
 from models.gemini_analyzer import GeminiFoodAnalyzer
+from models import fake_gemini
+from models.schemas import PredictionResponse
+from services.worker_pool import WorkerPool, WorkerPoolFull
+from services.job_queue import InvalidCallbackUrl, Job, JobFailed, JobQueue, JobQueueFull
+from services.prediction_cache import PredictionCache, hash_image_bytes
+from services.image_preprocessing import ImagePreprocessor
+from services.image_quality import ImageQualityScreen
+from services.perceptual_index import PerceptualIndex
+from services.hedging import HedgePolicy
+from services.image_downloader import ImageDownloader
+from services.rate_limiter import PRIORITY_CHAT, QuotaScheduler, normalize_model_name, parse_model_limits
+from services.singleflight import SingleFlight
+from services.deadline import DeadlineExceeded, DeadlineMiddleware, remaining_seconds
+from services.model_registry import ModelRegistry
+from services.knowledge_store import KnowledgeBase, KnowledgeStore, discover_knowledge_paths
+from services.chat_cache import ChatAnswerCache
+from services.chat_history import compact_history, estimate_tokens
+from services.instrumentation import ServerTimingMiddleware, metrics, record_tokens, stage
+from services.logging_config import RequestIdMiddleware, configure_logging
 
 # Suppress deprecation warning for google.generativeai
 warnings.filterwarnings("ignore", category=FutureWarning, message=".*google.generativeai.*")
@@ -22,9 +46,34 @@ import google.generativeai as genai
 # Load environment variables from .env file
 load_dotenv()
 
+# Buffered, level-filtered logging with per-request correlation ids
+configure_logging(os.getenv("LOG_LEVEL", "INFO"), os.getenv("LOG_FORMAT", "text"))
+logger = logging.getLogger("app")
+
 # Initialize Gemini AI analyzer and chat model (load once on startup)
 analyzer = None
 chat_model = None
+# Blocking Gemini/download calls run here so the event loop stays responsive
+worker_pool = None
+# Shared RPM/RPD budget for every Gemini call (predictions ahead of chat)
+quota_scheduler = None
+# Asynchronous /jobs/predict analyses (submit now, poll or get a callback later)
+job_queue = None
+# Concurrent identical /predict requests share one analysis
+prediction_flights = SingleFlight()
+# System instruction the chat model was built with (reused when the model is swapped)
+chat_system_instruction = None
+# Loaded knowledge artifact and its BM25 index (retrieval mode)
+knowledge_base = None
+knowledge_index = None
+# Replies to stateless chat turns (None when CHAT_CACHE_ENABLED is false)
+chat_cache = None
+# Cached model discovery, re-resolved once its TTL passes (None with the fake backend or no API key)
+model_registry = None
+# Streaming chat counters (time to first token is what users notice)
+chat_stream_stats = {"streams": 0, "first_tokens": 0, "ttft_ms_total": 0.0, "cancelled": 0, "failed": 0}
+# Seconds from lifespan start until the app was ready to serve
+startup_seconds = None
 
 CHAT_SYSTEM_INSTRUCTION = (
     "You are the FoodLoop assistant. Only answer questions about FoodLoop, "
@@ -40,65 +89,271 @@ CHAT_SYSTEM_INSTRUCTION = (
 
 MAX_KNOWLEDGE_CHARS = 80_000
 
+# "retrieval": inject only the top-k relevant knowledge chunks into each question
+# "full": put the whole (truncated) knowledge text in the system instruction
+CHAT_KNOWLEDGE_MODE = os.getenv("CHAT_KNOWLEDGE_MODE", "retrieval").lower()
+CHAT_KNOWLEDGE_TOP_K = int(os.getenv("CHAT_KNOWLEDGE_TOP_K", 4))
+# Estimated tokens of history sent verbatim; older turns are summarized
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", 2000))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", 300))
+
+# Text chat model: prefer Gemini 3 Flash, then fallbacks
+CHAT_MODEL_CANDIDATES = ["gemini-3-flash-preview", "gemini-3-flash", "gemini-pro"]
+
+# "gemini" (real API) or "fake" (models/fake_gemini.py, for offline load tests)
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "gemini").lower()
 
-def load_knowledge_from_pdf(path: str) -> str:
+
+def load_knowledge_base() -> Optional[KnowledgeBase]:
     """
-    Load text from a PDF file for use as chatbot knowledge.
-    Returns empty string if path is missing, not a file, or on error.
-    Truncates to MAX_KNOWLEDGE_CHARS and appends a note if needed.
+    Load the chatbot knowledge artifact for all PDFs in KNOWLEDGE_DIR (plus KNOWLEDGE_PDF_PATH).
+    The artifact is rebuilt only when a source PDF was added, removed or changed.
+    Returns None if there are no knowledge documents.
     """
-    if not path or not os.path.isfile(path):
-        return ""
+    service_dir = os.path.dirname(__file__)
+    knowledge_dir = os.getenv("KNOWLEDGE_DIR") or os.path.join(service_dir, "knowledge")
+    store = KnowledgeStore(
+        paths=discover_knowledge_paths(knowledge_dir, os.getenv("KNOWLEDGE_PDF_PATH")),
+        artifact_dir=os.getenv("KNOWLEDGE_ARTIFACT_DIR") or os.path.join(service_dir, "cache", "knowledge"),
+        base_dir=knowledge_dir,
+    )
     try:
-        reader = PdfReader(path)
-        parts = []
-        total = 0
-        for page in reader.pages:
-            if total >= MAX_KNOWLEDGE_CHARS:
-                break
-            text = page.extract_text() or ""
-            text = re.sub(r"\s+", " ", text).strip()
-            if text:
-                remaining = MAX_KNOWLEDGE_CHARS - total
-                if len(text) > remaining:
-                    text = text[:remaining]
-                    total = MAX_KNOWLEDGE_CHARS
-                else:
-                    total += len(text)
-                parts.append(text)
-        if not parts:
-            return ""
-        out = " ".join(parts)
-        if total >= MAX_KNOWLEDGE_CHARS:
-            out += " [Document truncated for length.]"
-        return out
+        return store.load()
     except Exception as e:
-        print(f"⚠️  Failed to load knowledge PDF {path}: {e}")
-        return ""
+        logger.warning("⚠️  Failed to load knowledge base: %s", e)
+        return None
+
+
+def truncate_knowledge(text: str, max_chars: int = MAX_KNOWLEDGE_CHARS) -> str:
+    """Truncate knowledge text for the system instruction and append a note if needed"""
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + " [Document truncated for length.]"
+
+
+def create_prediction_cache() -> Optional[PredictionCache]:
+    """
+    Build the /predict result cache from environment settings.
+    Returns None when PREDICTION_CACHE_ENABLED is false.
+    """
+    if os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        logger.info("ℹ️  Prediction cache disabled")
+        return None
+    db_path = os.getenv("PREDICTION_CACHE_DB_PATH") or None
+    cache = PredictionCache(
+        ttl_seconds=float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", 86400)),
+        max_entries=int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", 1024)),
+        db_path=db_path,
+    )
+    logger.info("✅ Prediction cache enabled (%s)", "sqlite: " + db_path if db_path else "in-memory")
+    return cache
+
+
+def create_perceptual_index() -> Optional[PerceptualIndex]:
+    """
+    Build the near-duplicate image index from environment settings.
+    Returns None when PERCEPTUAL_INDEX_ENABLED is false.
+    """
+    if os.getenv("PERCEPTUAL_INDEX_ENABLED", "true").lower() in ("0", "false", "no"):
+        logger.info("ℹ️  Perceptual duplicate index disabled")
+        return None
+    db_path = os.getenv("PERCEPTUAL_INDEX_DB_PATH") or None
+    index = PerceptualIndex(
+        threshold=int(os.getenv("PERCEPTUAL_INDEX_THRESHOLD", 4)),
+        max_entries=int(os.getenv("PERCEPTUAL_INDEX_MAX_ENTRIES", 1_000_000)),
+        db_path=db_path,
+    )
+    logger.info(
+        "✅ Perceptual duplicate index enabled (%s entries, %s, threshold %s)",
+        index.stats()["entries"], "sqlite: " + db_path if db_path else "in-memory", index.threshold,
+    )
+    return index
+
+
+def create_hedge_policy() -> Optional[HedgePolicy]:
+    """
+    Build the hedged-call policy for analysis calls from environment settings.
+    Returns None unless GEMINI_HEDGE_ENABLED is true.
+    """
+    if os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        logger.info("ℹ️  Hedged Gemini calls disabled")
+        return None
+    policy = HedgePolicy(
+        percentile=float(os.getenv("GEMINI_HEDGE_PERCENTILE", 95)),
+        max_rate=float(os.getenv("GEMINI_HEDGE_MAX_RATE", 0.05)),
+        min_samples=int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", 20)),
+        max_threads=2 * int(os.getenv("AI_WORKER_THREADS", 8)),
+    )
+    logger.info("✅ Hedged Gemini calls enabled (after p%g, at most %.0f%% extra calls)",
+                policy.percentile, policy.max_rate * 100)
+    return policy
+
+
+def create_chat_cache() -> Optional[ChatAnswerCache]:
+    """
+    Build the stateless chat answer cache from environment settings.
+    Returns None when CHAT_CACHE_ENABLED is false.
+    """
+    if os.getenv("CHAT_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        logger.info("ℹ️  Chat answer cache disabled")
+        return None
+    cache = ChatAnswerCache(
+        ttl_seconds=float(os.getenv("CHAT_CACHE_TTL_SECONDS", 3600)),
+        max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", 256)),
+        similarity_threshold=float(os.getenv("CHAT_CACHE_SIMILARITY", 0.9)),
+    )
+    logger.info("✅ Chat answer cache enabled (similarity threshold %s)", cache.similarity_threshold)
+    return cache
+
+
+def create_image_preprocessor() -> Optional[ImagePreprocessor]:
+    """
+    Build the downscale/re-encode stage from environment settings.
+    Returns None when IMAGE_PREPROCESS_ENABLED is false (full-resolution images are sent).
+    """
+    if os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() in ("0", "false", "no"):
+        logger.info("ℹ️  Image preprocessing disabled")
+        return None
+    preprocessor = ImagePreprocessor(
+        max_edge=int(os.getenv("IMAGE_MAX_EDGE", 1024)),
+        output_format=os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG"),
+        quality=int(os.getenv("IMAGE_QUALITY", 85)),
+    )
+    logger.info(
+        "✅ Image preprocessing enabled (max edge %spx, %s q%s)",
+        preprocessor.max_edge, preprocessor.output_format, preprocessor.quality,
+    )
+    return preprocessor
+
+
+def create_image_quality_screen() -> Optional[ImageQualityScreen]:
+    """
+    Build the local quality pre-screen from environment settings.
+    Returns None when IMAGE_PRESCREEN_POLICY is "off".
+    """
+    policy = os.getenv("IMAGE_PRESCREEN_POLICY", "flag").lower()
+    if policy == "off":
+        logger.info("ℹ️  Image quality pre-screen disabled")
+        return None
+    screen = ImageQualityScreen(
+        policy=policy,
+        min_edge=int(os.getenv("IMAGE_PRESCREEN_MIN_EDGE", 200)),
+        min_brightness=float(os.getenv("IMAGE_PRESCREEN_MIN_BRIGHTNESS", 20)),
+        max_brightness=float(os.getenv("IMAGE_PRESCREEN_MAX_BRIGHTNESS", 240)),
+        min_contrast=float(os.getenv("IMAGE_PRESCREEN_MIN_CONTRAST", 8)),
+        min_sharpness=float(os.getenv("IMAGE_PRESCREEN_MIN_SHARPNESS", 15)),
+    )
+    logger.info("✅ Image quality pre-screen enabled (policy: %s)", screen.policy)
+    return screen
+
+
+def build_chat_model(model_id: str):
+    """Create the chat model with the current system instruction"""
+    return genai.GenerativeModel(model_id, system_instruction=chat_system_instruction)
+
+
+def apply_model_discovery(entry: Dict) -> None:
+    """Switch to freshly discovered models (called from the background refresh thread)"""
+    global chat_model
+    if analyzer and entry["vision_model"] != analyzer.model.model_name.split("/")[-1]:
+        analyzer.set_model(entry["vision_model"])
+    chat_id = entry.get("chat_model")
+    if chat_id and chat_model is not None and chat_id != chat_model.model_name.split("/")[-1]:
+        chat_model = build_chat_model(chat_id)
+        logger.info("✅ Gemini chat model switched to: %s", chat_id)
+
+
+def refresh_models_if_stale() -> None:
+    """Re-resolve the model ids in the background once the discovery cache has expired"""
+    if model_registry:
+        model_registry.refresh_if_stale(
+            GeminiFoodAnalyzer.select_vision_model, CHAT_MODEL_CANDIDATES, apply_model_discovery
+        )
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler for startup and shutdown"""
     # Startup
-    global analyzer, chat_model
+    global analyzer, chat_model, worker_pool, quota_scheduler, chat_system_instruction, startup_seconds
+    global knowledge_base, knowledge_index, chat_cache, job_queue, model_registry
+    startup_start = time.time()
+    worker_pool = WorkerPool(
+        max_workers=int(os.getenv("AI_WORKER_THREADS", 8)),
+        max_pending=int(os.getenv("AI_MAX_PENDING", 32)),
+    )
+    logger.info("✅ Worker pool started (%s threads, %s max pending)", worker_pool.max_workers, worker_pool.max_pending)
+    job_queue = JobQueue(
+        run_prediction_job,
+        workers=int(os.getenv("JOB_WORKERS", 4)),
+        max_queued=int(os.getenv("JOB_MAX_QUEUED", 100)),
+        result_ttl_seconds=float(os.getenv("JOB_RESULT_TTL_SECONDS", 3600)),
+        default_callback_url=os.getenv("JOB_CALLBACK_URL") or None,
+        callback_timeout=float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", 5)),
+        callback_allowed_hosts=[h.strip() for h in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if h.strip()],
+    )
+    job_queue.start()
+    if os.getenv("GEMINI_QUOTA_ENABLED", "true").lower() not in ("0", "false", "no"):
+        quota_scheduler = QuotaScheduler(
+            max_wait_seconds=float(os.getenv("GEMINI_QUOTA_MAX_WAIT_SECONDS", 10)),
+            limits=parse_model_limits(os.getenv("GEMINI_MODEL_LIMITS", "")),
+        )
     try:
         api_key = os.getenv("GEMINI_API_KEY")
+        if GEMINI_BACKEND == "fake":
+            # Offline stand-in for load tests: no network calls, no quota
+            fake_gemini.install()
+            api_key = api_key or "fake"
+            logger.warning("⚠️  GEMINI_BACKEND=fake: Gemini calls are simulated")
         if not api_key:
-            print("⚠️  Warning: GEMINI_API_KEY not found in environment variables")
-            print("⚠️  Service will return mock predictions")
+            logger.warning("⚠️  Warning: GEMINI_API_KEY not found in environment variables")
+            logger.warning("⚠️  Service will return mock predictions")
             analyzer = None
             chat_model = None
         else:
             genai.configure(api_key=api_key)
-            analyzer = GeminiFoodAnalyzer(api_key=api_key)
-            print("✅ Gemini AI analyzer initialized successfully")
-            # Load optional knowledge PDF (proposal document) for chatbot
-            knowledge_path = os.getenv("KNOWLEDGE_PDF_PATH") or os.path.join(
-                os.path.dirname(__file__), "knowledge", "proposal.pdf"
+            registry = ModelRegistry(
+                cache_path=os.getenv("MODEL_CACHE_PATH") or os.path.join(
+                    os.path.dirname(__file__), "cache", "models.json"
+                ),
+                ttl_seconds=float(os.getenv("MODEL_CACHE_TTL_SECONDS", 86400)),
             )
-            knowledge_text = load_knowledge_from_pdf(knowledge_path)
-            if knowledge_text:
+            cached_models = registry.load()
+            if cached_models:
+                logger.info("✅ Using cached model discovery: vision=%s, chat=%s",
+                            cached_models["vision_model"], cached_models["chat_model"])
+            else:
+                logger.info("ℹ️  No cached model discovery, starting with %s", GeminiFoodAnalyzer.DEFAULT_MODEL)
+            analyzer = GeminiFoodAnalyzer(
+                api_key=api_key,
+                model_name=cached_models["vision_model"] if cached_models else GeminiFoodAnalyzer.DEFAULT_MODEL,
+                cache=create_prediction_cache(),
+                preprocessor=create_image_preprocessor(),
+                quality_screen=create_image_quality_screen(),
+                perceptual_index=create_perceptual_index(),
+                hedging=create_hedge_policy(),
+                downloader=ImageDownloader(
+                    max_bytes=int(os.getenv("IMAGE_DOWNLOAD_MAX_BYTES", 15 * 1024 * 1024)),
+                    connect_timeout=float(os.getenv("IMAGE_DOWNLOAD_CONNECT_TIMEOUT", 5)),
+                    read_timeout=float(os.getenv("IMAGE_DOWNLOAD_READ_TIMEOUT", 15)),
+                    pool_size=int(os.getenv("IMAGE_DOWNLOAD_POOL_SIZE", os.getenv("AI_WORKER_THREADS", 8))),
+                ),
+                scheduler=quota_scheduler,
+            )
+            logger.info("✅ Gemini AI analyzer initialized successfully")
+            # Load optional knowledge PDFs (proposal and reference documents) for chatbot
+            knowledge_base = load_knowledge_base()
+            full_system_instruction = CHAT_SYSTEM_INSTRUCTION
+            if knowledge_base and CHAT_KNOWLEDGE_MODE == "retrieval":
+                knowledge_index = knowledge_base.index
+                logger.info(
+                    "✅ Chatbot knowledge base loaded (%s documents, %s chunks)",
+                    knowledge_base.document_count, knowledge_index.stats()["chunks"],
+                )
+            elif knowledge_base:
+                knowledge_text = truncate_knowledge(
+                    " ".join(doc["text"] for doc in knowledge_base.documents())
+                )
                 full_system_instruction = (
                     "Use the following knowledge base when answering. "
                     "Base your answers on it when relevant.\n\n"
@@ -106,37 +361,53 @@ async def lifespan(app: FastAPI):
                     + "\n\n---\n\n"
                     + CHAT_SYSTEM_INSTRUCTION
                 )
-                print("✅ Chatbot knowledge base loaded from PDF")
-            else:
-                full_system_instruction = CHAT_SYSTEM_INSTRUCTION
-            # Text chat model: prefer Gemini 3 Flash, then fallbacks
+                logger.info("✅ Chatbot knowledge base loaded (%s documents)", knowledge_base.document_count)
+            chat_system_instruction = full_system_instruction
+            chat_cache = create_chat_cache()
+            chat_candidates = list(CHAT_MODEL_CANDIDATES)
+            if cached_models and cached_models.get("chat_model"):
+                chat_candidates.insert(0, cached_models["chat_model"])
             chat_model = None
-            for model_id, label in [
-                ("gemini-3-flash-preview", "Gemini 3 Flash"),
-                ("gemini-3-flash", "Gemini 3 Flash (alt)"),
-                ("gemini-pro", "Gemini Pro"),
-            ]:
+            for model_id in dict.fromkeys(chat_candidates):
                 try:
-                    chat_model = genai.GenerativeModel(
-                        model_id,
-                        system_instruction=full_system_instruction,
-                    )
-                    print(f"✅ Gemini chat model initialized: {label}")
+                    chat_model = build_chat_model(model_id)
+                    logger.info("✅ Gemini chat model initialized: %s", model_id)
                     break
                 except Exception as chat_err:
-                    print(f"⚠️  {model_id} failed: {chat_err}, trying next fallback")
+                    logger.warning("⚠️  %s failed: %s, trying next fallback", model_id, chat_err)
             if chat_model is None:
-                print("⚠️  Chat will be unavailable")
+                logger.warning("⚠️  Chat will be unavailable")
+            if GEMINI_BACKEND != "fake":
+                # Resolve the real model ids without holding up startup, and again whenever they expire
+                model_registry = registry
+                refresh_models_if_stale()
     except Exception as e:
-        print(f"⚠️  Warning: Could not initialize Gemini AI: {e}")
-        print("⚠️  Service will return mock predictions")
+        logger.warning("⚠️  Warning: Could not initialize Gemini AI: %s", e)
+        logger.warning("⚠️  Service will return mock predictions")
         analyzer = None
         chat_model = None
     
+    startup_seconds = time.time() - startup_start
+    startup_budget = float(os.getenv("STARTUP_BUDGET_SECONDS", 2))
+    if startup_seconds > startup_budget:
+        logger.warning("⚠️  Startup took %.2fs (budget %.2fs)", startup_seconds, startup_budget)
+    else:
+        logger.info("✅ Startup completed in %.2fs (budget %.2fs)", startup_seconds, startup_budget)
+    
     yield  # App runs here
     
     # Shutdown (cleanup if needed)
     # analyzer cleanup happens automatically
+    await job_queue.stop()
+    worker_pool.shutdown()
+    if analyzer:
+        analyzer.downloader.close()
+        if analyzer.cache:
+            analyzer.cache.close()
+        if analyzer.perceptual_index:
+            analyzer.perceptual_index.close()
+        if analyzer.hedging:
+            analyzer.hedging.shutdown()
 
 app = FastAPI(
     title="FoodLoop AI Service",
@@ -152,19 +423,49 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Request deadline from X-Request-Timeout-Ms / X-Request-Deadline; cancels the request on client disconnect
+app.add_middleware(
+    DeadlineMiddleware,
+    default_timeout_seconds=float(os.getenv("REQUEST_DEFAULT_TIMEOUT_MS", 0)) / 1000 or None,
+    margin_seconds=float(os.getenv("REQUEST_DEADLINE_MARGIN_MS", 250)) / 1000,
+)
+# Per-stage Server-Timing header and request duration histogram
+app.add_middleware(ServerTimingMiddleware)
+# X-Request-ID correlation id on every log record of the request
+app.add_middleware(RequestIdMiddleware)
+
 
 class ImageRequest(BaseModel):
     imageUrl: str
 
-class PredictionResponse(BaseModel):
-    foodCategory: str
-    itemName: str
-    quantity: int
-    qualityScore: float
-    freshness: str
-    storageRecommendation: str
-    confidence: float
-    detectedItems: List[str]
+
+class JobRequest(BaseModel):
+    imageUrl: str
+    # Where to POST the finished job (defaults to JOB_CALLBACK_URL, if set); must be
+    # https on a JOB_CALLBACK_ALLOWED_HOSTS host
+    callbackUrl: Optional[str] = None
+
+
+class BatchImageRequest(BaseModel):
+    imageUrls: List[str]
+
+
+class BatchPredictionItem(BaseModel):
+    index: int
+    imageUrl: str
+    prediction: Optional[PredictionResponse] = None
+    error: Optional[Dict[str, str]] = None
+
+
+class BatchPredictionResponse(BaseModel):
+    results: List[BatchPredictionItem]
+
+
+# Times a job is retried (1s apart) when the worker pool is full before it fails
+JOB_BUSY_RETRIES = 30
+
+# Upper bound on images accepted by /predict/batch in one request
+MAX_BATCH_IMAGES = int(os.getenv("PREDICT_BATCH_MAX_ITEMS", 10))
 
 
 class ChatHistoryItem(BaseModel):
@@ -179,6 +480,8 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     reply: str
+    # Token counts for this turn (local estimates plus Gemini's usage metadata)
+    usage: Optional[Dict] = None
 
 
 @app.get("/")
@@ -193,12 +496,44 @@ async def root():
 @app.get("/health")
 async def health():
     """Health check with analyzer status"""
+    refresh_models_if_stale()
     return {
         "status": "healthy",
         "analyzer_loaded": analyzer is not None,
-        "ai_provider": "Google Gemini"
+        "vision_model": analyzer.model.model_name if analyzer else None,
+        "chat_model": chat_model.model_name if chat_model else None,
+        "response_format": analyzer.output_mode if analyzer else None,
+        "startup_seconds": round(startup_seconds, 3) if startup_seconds is not None else None,
+        "ai_provider": "Google Gemini",
+        "worker_pool": worker_pool.stats() if worker_pool else None,
+        "jobs": job_queue.stats() if job_queue else None,
+        "prediction_cache": analyzer.cache.stats() if analyzer and analyzer.cache else None,
+        "image_preprocessing": analyzer.preprocessor.stats() if analyzer and analyzer.preprocessor else None,
+        "image_quality": analyzer.quality_screen.stats() if analyzer and analyzer.quality_screen else None,
+        "perceptual_index": analyzer.perceptual_index.stats() if analyzer and analyzer.perceptual_index else None,
+        "hedging": analyzer.hedging.stats() if analyzer and analyzer.hedging else None,
+        "image_downloads": analyzer.downloader.stats() if analyzer else None,
+        "quota": quota_scheduler.stats() if quota_scheduler else None,
+        "model_pool": analyzer.pool.stats() if analyzer else None,
+        "request_coalescing": prediction_flights.stats(),
+        "knowledge_index": knowledge_index.stats() if knowledge_index else None,
+        "knowledge_documents": [os.path.basename(s["path"]) for s in knowledge_base.sources if s.get("chars")] if knowledge_base else None,
+        "chat_cache": chat_cache.stats() if chat_cache else None,
+        "chat_streaming": {
+            "streams": chat_stream_stats["streams"],
+            "cancelled": chat_stream_stats["cancelled"],
+            "failed": chat_stream_stats["failed"],
+            "avg_ttft_ms": round(chat_stream_stats["ttft_ms_total"] / chat_stream_stats["first_tokens"])
+            if chat_stream_stats["first_tokens"] else None,
+        },
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage latency histograms, request durations and Gemini token/retry counters (Prometheus text format)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/predict", response_model=PredictionResponse)
 async def predict_food(request: ImageRequest):
     """
@@ -213,42 +548,276 @@ async def predict_food(request: ImageRequest):
     Raises:
         HTTPException: If non-food items are detected or other validation errors occur
     """
-    import time
-    start_time = time.time()
+    logger.info("📥 Received prediction request for image: %s", request.imageUrl)
+    return await run_prediction(lambda a: a.analyze_image(request.imageUrl), key=f"url:{request.imageUrl}")
+
+
+@app.post("/predict/upload", response_model=PredictionResponse)
+async def predict_food_upload(request: Request):
+    """
+    Analyze an uploaded food image (no download hop)
+    
+    Accepts either multipart/form-data with the file in an "image" (or "file")
+    field, or the raw image bytes as the request body
+    (application/octet-stream or image/*).
     
+    Returns:
+        PredictionResponse with food detection results
+        
+    Raises:
+        HTTPException: On missing/oversized uploads and the same validation errors as /predict
+    """
+    max_bytes = analyzer.downloader.max_bytes if analyzer else None
+    content_length = request.headers.get("content-length", "")
+    if max_bytes and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail={
+                "error": "Image too large",
+                "message": f"Uploaded image exceeds the {max_bytes // (1024 * 1024)}MB limit.",
+            },
+        )
+    
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("image") or form.get("file")
+        image_bytes = await upload.read() if hasattr(upload, "read") else b""
+        filename = getattr(upload, "filename", None) or "upload"
+    else:
+        image_bytes = await request.body()
+        filename = "request body"
+    
+    if not image_bytes:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "image is required",
+                "message": "Send the image as multipart field \"image\" or as the raw request body.",
+            },
+        )
+    if max_bytes and len(image_bytes) > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail={
+                "error": "Image too large",
+                "message": f"Uploaded image exceeds the {max_bytes // (1024 * 1024)}MB limit.",
+            },
+        )
+    
+    logger.info("📥 Received prediction upload: %s (%.0fKB)", filename, len(image_bytes) / 1024)
+    return await run_prediction(
+        lambda a: a.analyze_image_bytes(image_bytes), key=f"sha256:{hash_image_bytes(image_bytes)}"
+    )
+
+
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_food_batch(request: BatchImageRequest):
+    """
+    Analyze several food images, packing them into multi-image Gemini calls
+    
+    Each image gets its own result; a rejected or failed image carries an
+    error instead of failing the whole batch.
+    
+    Args:
+        request: BatchImageRequest with imageUrls
+        
+    Returns:
+        BatchPredictionResponse with one entry per image, in request order
+    """
+    if not request.imageUrls:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "imageUrls is required", "message": "Provide at least one image URL."},
+        )
+    if len(request.imageUrls) > MAX_BATCH_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Too many images",
+                "message": f"A batch may contain at most {MAX_BATCH_IMAGES} images.",
+            },
+        )
+    
+    logger.info("📥 Received batch prediction request for %d images", len(request.imageUrls))
+    refresh_models_if_stale()
+    if not analyzer:
+        logger.warning("⚠️  Gemini AI analyzer not initialized, returning mock predictions")
+        return BatchPredictionResponse(results=[
+            BatchPredictionItem(index=i, imageUrl=url, prediction=get_mock_predictions())
+            for i, url in enumerate(request.imageUrls)
+        ])
+    
+    try:
+        items = await asyncio.wait_for(worker_pool.run(analyzer.analyze_images_batch, request.imageUrls),
+                                       remaining_seconds())
+    except WorkerPoolFull as e:
+        logger.warning("❌ %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Service busy",
+                "message": "The AI service is handling too many requests. Please try again shortly.",
+                "suggestion": "Retry the request in a few seconds."
+            }
+        )
+    except asyncio.TimeoutError:
+        raise deadline_error("batch analysis did not finish in time")
+    
+    results = []
+    for item in items:
+        if "analysis" in item:
+            results.append(BatchPredictionItem(index=item["index"], imageUrl=item["imageUrl"], prediction=item["analysis"]))
+            continue
+        error_message = item["error"]
+        if item["errorType"] == "validation":
+            user_message, suggestion = describe_validation_error(error_message)
+            error = {"error": "Invalid image content", "message": user_message, "suggestion": suggestion}
+        elif item["errorType"] == "deadline":
+            error = {"error": "Deadline exceeded", "message": "The image could not be analyzed within the request timeout."}
+        elif "quota" in error_message.lower() or "rate limit" in error_message.lower() or "429" in error_message:
+            error = {"error": "API quota exceeded", "message": "Gemini API rate limit exceeded. Please try again later."}
+        else:
+            error = {"error": "Analysis failed", "message": error_message}
+        results.append(BatchPredictionItem(index=item["index"], imageUrl=item["imageUrl"], error=error))
+    
+    logger.info("✅ Batch analysis completed: %d/%d succeeded", sum(r.prediction is not None for r in results), len(results))
+    return BatchPredictionResponse(results=results)
+
+
+@app.post("/jobs/predict", status_code=202)
+async def submit_prediction_job(request: JobRequest):
+    """
+    Queue a food image analysis and return at once
+    
+    The result can be polled at GET /jobs/{jobId}; if a callback URL is given
+    (or JOB_CALLBACK_URL is set) the finished job is also POSTed there.
+    
+    Returns:
+        {"jobId", "status", "statusUrl"}
+        
+    Raises:
+        HTTPException: 400 if the callback URL is not allowed, 503 if the job queue is full
+    """
     try:
-        print(f"📥 Received prediction request for image: {request.imageUrl}")
+        job = job_queue.submit(request.imageUrl, request.callbackUrl)
+    except InvalidCallbackUrl as e:
+        logger.warning("❌ Rejected job callback URL: %s", e)
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid callback URL",
+                "message": str(e),
+                "suggestion": "Omit callbackUrl to use the configured callback, or use an https URL on an allowed host."
+            }
+        )
+    except JobQueueFull as e:
+        logger.warning("❌ %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Service busy",
+                "message": "Too many analysis jobs are waiting. Please try again shortly.",
+                "suggestion": "Retry the request in a few seconds."
+            }
+        )
+    logger.info("📥 Queued prediction job %s for image: %s", job.id, request.imageUrl)
+    return {"jobId": job.id, "status": job.status, "statusUrl": f"/jobs/{job.id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_prediction_job(job_id: str):
+    """
+    Status of an analysis job; "prediction" or "error" is set once it has finished
+    
+    Raises:
+        HTTPException: 404 if the job is unknown or its result has expired
+    """
+    job = job_queue.get(job_id) if job_queue else None
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Job not found",
+                "message": "Unknown job id, or the job result has expired.",
+                "suggestion": "Submit the image again."
+            }
+        )
+    return job.to_dict()
+
+
+async def run_prediction_job(job: Job) -> Dict:
+    """
+    Job queue runner: the /predict pipeline for one queued image
+    
+    Raises:
+        JobFailed: With the error detail /predict would have returned
+    """
+    for attempt in range(JOB_BUSY_RETRIES + 1):
+        try:
+            prediction = await run_prediction(lambda a: a.analyze_image(job.image_url), key=f"url:{job.image_url}")
+            return PredictionResponse.model_validate(prediction).model_dump()
+        except HTTPException as e:
+            if e.detail.get("error") == "Service busy" and attempt < JOB_BUSY_RETRIES:
+                # The worker pool is full of synchronous requests: the job can wait its turn
+                await asyncio.sleep(1)
+                continue
+            raise JobFailed(e.detail, e.status_code)
+
+
+async def run_prediction(analyze: Callable[[GeminiFoodAnalyzer], Dict], key: Optional[str] = None):
+    """
+    Run an analyzer call in the worker pool and map its errors to HTTP responses
+    
+    Args:
+        analyze: Blocking function taking the analyzer and returning the analysis dict
+        key: Identity of the request (image URL or content hash); concurrent
+             calls with the same key share one execution and its result or error
         
+    Returns:
+        Analysis dict (or mock predictions when the analyzer is unavailable)
+    """
+    start_time = time.time()
+    
+    try:
         if not analyzer:
             # Return mock predictions if analyzer is not initialized
-            print("⚠️  Gemini AI analyzer not initialized, returning mock predictions")
+            logger.warning("⚠️  Gemini AI analyzer not initialized, returning mock predictions")
             return get_mock_predictions()
         
-        print("🔄 Starting image analysis...")
-        # Analyze image using Gemini AI
-        predictions = analyzer.analyze_image(request.imageUrl)
+        refresh_models_if_stale()
+        logger.debug("🔄 Starting image analysis...")
+        # Analyze image using Gemini AI; answer with a 504 rather than outlive the caller's deadline
+        if key:
+            work = prediction_flights.do(key, lambda: worker_pool.run(analyze, analyzer))
+        else:
+            work = worker_pool.run(analyze, analyzer)
+        predictions = await asyncio.wait_for(work, remaining_seconds())
         
         elapsed_time = time.time() - start_time
-        print(f"✅ Analysis completed in {elapsed_time:.2f} seconds")
+        logger.info("✅ Analysis completed in %.2f seconds", elapsed_time)
         
         return predictions
         
+    except WorkerPoolFull as e:
+        logger.warning("❌ %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Service busy",
+                "message": "The AI service is handling too many requests. Please try again shortly.",
+                "suggestion": "Retry the request in a few seconds."
+            }
+        )
+    except DeadlineExceeded as e:
+        raise deadline_error(str(e))
+    except asyncio.TimeoutError:
+        raise deadline_error("analysis did not finish in time")
     except ValueError as e:
         # Validation error - non-food items or AI-generated images detected
         error_message = str(e)
-        print(f"❌ Validation error: {error_message}")
-        
-        # Check if it's an AI-generated image error
-        if "ai-generated" in error_message.lower() or "synthetic" in error_message.lower() or "fake" in error_message.lower():
-            user_message = "AI-generated images are not allowed. Please upload a real photo of food."
-            suggestion = "Please upload a real photograph of food. AI-generated, synthetic, or computer-generated images are not accepted."
-        # Check if it's a non-food item error
-        elif "does not contain food" in error_message.lower() or "non-food" in error_message.lower():
-            user_message = "This image does not contain food items. Please upload an image of food only."
-            suggestion = "Accepted items: cooked meals, raw ingredients, beverages, snacks, desserts. Not allowed: cleaning products, medicines, electronics, or other non-food items."
-        else:
-            user_message = error_message
-            suggestion = "Please upload an image containing only food items."
+        logger.info("❌ Validation error: %s", error_message)
+        user_message, suggestion = describe_validation_error(error_message)
         
         raise HTTPException(
             status_code=400,
@@ -263,7 +832,7 @@ async def predict_food(request: ImageRequest):
         
         # Check if it's a rate limit/quota error
         if "quota" in error_message.lower() or "rate limit" in error_message.lower() or "429" in error_message:
-            print(f"❌ Rate limit error: {error_message}")
+            logger.warning("❌ Rate limit error: %s", error_message)
             raise HTTPException(
                 status_code=503,
                 detail={
@@ -274,12 +843,50 @@ async def predict_food(request: ImageRequest):
             )
         
         # Other errors - return mock predictions for graceful degradation
-        print(f"⚠️  Error in prediction: {e}")
-        print("⚠️  Returning mock predictions as fallback")
-        import traceback
-        traceback.print_exc()
+        logger.exception("⚠️  Error in prediction, returning mock predictions as fallback: %s", e)
         return get_mock_predictions()
 
+def deadline_error(reason: str) -> HTTPException:
+    """504 for an analysis skipped or abandoned because the request deadline passed"""
+    logger.warning("⏱️  Request deadline exceeded: %s", reason)
+    return HTTPException(
+        status_code=504,
+        detail={
+            "error": "Deadline exceeded",
+            "message": "The image could not be analyzed within the request timeout.",
+            "suggestion": "Please try again; analysis is usually faster once the service is less busy."
+        }
+    )
+
+
+def describe_validation_error(error_message: str):
+    """
+    Map an analyzer validation error to a user-facing message and suggestion
+    
+    Returns:
+        (user_message, suggestion)
+    """
+    # Check if it's an AI-generated image error
+    if "ai-generated" in error_message.lower() or "synthetic" in error_message.lower() or "fake" in error_message.lower():
+        user_message = "AI-generated images are not allowed. Please upload a real photo of food."
+        suggestion = "Please upload a real photograph of food. AI-generated, synthetic, or computer-generated images are not accepted."
+    # Check if it's a non-food item error
+    elif "does not contain food" in error_message.lower() or "non-food" in error_message.lower():
+        user_message = "This image does not contain food items. Please upload an image of food only."
+        suggestion = "Accepted items: cooked meals, raw ingredients, beverages, snacks, desserts. Not allowed: cleaning products, medicines, electronics, or other non-food items."
+    # Rejected by the local quality pre-screen (blank, dark, blurry, tiny or corrupt)
+    elif "quality check" in error_message.lower():
+        user_message = error_message.replace("Image failed the quality check: ", "This image could not be analyzed: ") + "."
+        if "readable image" in error_message:
+            suggestion = "Please upload the photo again as a JPEG, PNG or WebP file."
+        else:
+            suggestion = "Please retake the photo in good light, hold the camera steady, and make sure the food fills the frame."
+    else:
+        user_message = error_message
+        suggestion = "Please upload an image containing only food items."
+    return user_message, suggestion
+
+
 def get_mock_predictions() -> PredictionResponse:
     """Return mock predictions for development/testing"""
     return PredictionResponse(
@@ -294,14 +901,100 @@ def get_mock_predictions() -> PredictionResponse:
     )
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+def build_knowledge_prompt(message: str, history: List[ChatHistoryItem]) -> str:
     """
-    Chat with FoodLoop assistant using Gemini.
-    Request: message (required), history (optional list of {role, text}).
-    Response: { reply: "..." }.
+    Prepend the knowledge chunks most relevant to the question (retrieval mode)
+    
+    The previous user turn is included in the search query so short
+    follow-ups ("and for drivers?") still retrieve the right section.
     """
-    global chat_model
+    if not knowledge_index:
+        return message
+    previous = next((item.text for item in reversed(history) if item.role == "user"), "")
+    matches = knowledge_index.search(f"{previous} {message}", top_k=CHAT_KNOWLEDGE_TOP_K)
+    if not matches:
+        return message
+    excerpts = "\n\n".join(f"[{i + 1}] {chunk}" for i, (_, chunk) in enumerate(matches))
+    return (
+        "Relevant excerpts from the FoodLoop knowledge base. "
+        "Base your answer on them when relevant:\n\n"
+        + excerpts
+        + "\n\n---\n\nUser question: "
+        + message
+    )
+
+
+def _generate_chat_reply(gemini_history: list, message: str):
+    """Blocking Gemini chat call (runs in the worker pool)"""
+    if quota_scheduler:
+        with stage("quota_wait"):
+            quota_scheduler.acquire(chat_model.model_name, PRIORITY_CHAT)
+    with stage("gemini"):
+        if gemini_history:
+            chat_session = chat_model.start_chat(history=gemini_history)
+            return chat_session.send_message(message)
+        return chat_model.generate_content(message)
+
+
+def _stream_chat_reply(gemini_history: list, message: str, emit: Callable[[str], None],
+                       cancelled: threading.Event) -> Optional[Dict]:
+    """
+    Blocking streaming Gemini chat call (runs in the worker pool)
+
+    Each text chunk is passed to emit() as it arrives. Stops reading (which
+    closes the stream) as soon as cancelled is set.
+
+    Returns:
+        Token usage of the reply (see gemini_usage) if the stream was read to the end,
+        None if it was cancelled
+    """
+    if quota_scheduler:
+        with stage("quota_wait"):
+            quota_scheduler.acquire(chat_model.model_name, PRIORITY_CHAT)
+    if gemini_history:
+        chat_session = chat_model.start_chat(history=gemini_history)
+        response = chat_session.send_message(message, stream=True)
+    else:
+        response = chat_model.generate_content(message, stream=True)
+    usage = {}
+    for chunk in response:
+        if cancelled.is_set():
+            return None
+        # Usage metadata is complete on the final chunk
+        usage = gemini_usage(chunk) or usage
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunk without text parts (e.g. only safety ratings or a finish reason)
+            continue
+        if text:
+            emit(text)
+    return usage
+
+
+def gemini_usage(response) -> Dict:
+    """Token counts reported by Gemini for a response ({} if unavailable)"""
+    metadata = getattr(response, "usage_metadata", None)
+    if not metadata:
+        return {}
+    return {
+        "prompt_tokens": metadata.prompt_token_count,
+        "reply_tokens": metadata.candidates_token_count,
+        "total_tokens": metadata.total_token_count,
+    }
+
+
+def prepare_chat_turn(request: ChatRequest):
+    """
+    Validate a chat request and build the Gemini history and prompt for it
+
+    Returns:
+        (gemini_history, prompt, usage) where usage holds the local token estimates
+
+    Raises:
+        HTTPException: 503 if chat is not configured, 400 if the message is empty
+    """
+    refresh_models_if_stale()
     if not chat_model:
         raise HTTPException(
             status_code=503,
@@ -316,36 +1009,194 @@ async def chat(request: ChatRequest):
             status_code=400,
             detail={"error": "message is required", "message": "Message cannot be empty."},
         )
+    history = request.history or []
+    # Keep the newest turns within the token budget and summarize the rest
+    compacted = compact_history(
+        [(item.role if item.role in ("user", "model") else "user", item.text) for item in history],
+        budget_tokens=CHAT_HISTORY_TOKEN_BUDGET,
+        summary_tokens=CHAT_SUMMARY_TOKEN_BUDGET,
+    )
+    prompt = build_knowledge_prompt(message, history)
+    if compacted.summary:
+        prompt = "Summary of the earlier conversation:\n" + compacted.summary + "\n\n---\n\n" + prompt
+    usage = dict(compacted.stats)
+    usage["prompt_tokens_estimate"] = compacted.stats["history_tokens"] + estimate_tokens(prompt)
+    return compacted.turns, prompt, usage
+
+
+def log_chat_usage(usage: Dict) -> None:
+    """Per-turn token report (log line and token counters)"""
+    record_tokens(normalize_model_name(chat_model.model_name), usage.get("prompt_tokens"), usage.get("reply_tokens"))
+    logger.info(
+        "🧮 Chat turn: %d/%d history messages kept (%d summarized), ~%d prompt tokens estimated, "
+        "%s prompt / %s reply tokens billed",
+        usage["kept_turns"], usage["history_turns"], usage["summarized_turns"], usage["prompt_tokens_estimate"],
+        usage.get("prompt_tokens", "?"), usage.get("reply_tokens", "?"),
+        extra={"usage": usage},
+    )
+
+
+def chat_error(e: Exception) -> HTTPException:
+    """Map a chat generation failure to an HTTPException"""
+    if isinstance(e, WorkerPoolFull):
+        return HTTPException(
+            status_code=503,
+            detail={
+                "error": "Service busy",
+                "message": "The AI service is handling too many requests. Please try again shortly.",
+            },
+        )
+    err_msg = str(e)
+    if "quota" in err_msg.lower() or "rate limit" in err_msg.lower() or "429" in err_msg:
+        return HTTPException(
+            status_code=503,
+            detail={
+                "error": "API quota exceeded",
+                "message": "Gemini API rate limit exceeded. Please try again later.",
+            },
+        )
+    return HTTPException(
+        status_code=500,
+        detail={"error": "Chat failed", "message": err_msg or "An error occurred while generating a response."},
+    )
+
+
+def chat_cache_fingerprint() -> str:
+    """Identity of everything a cached reply depends on besides the message"""
+    parts = [
+        chat_model.model_name if chat_model else "",
+        chat_system_instruction or "",
+        knowledge_base.fingerprint if knowledge_base else "",
+        CHAT_KNOWLEDGE_MODE,
+        str(CHAT_KNOWLEDGE_TOP_K),
+    ]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def get_cached_chat_reply(request: ChatRequest) -> Optional[str]:
+    """Cached reply for a turn without history, if any"""
+    if not chat_cache or request.history:
+        return None
+    return chat_cache.get(request.message.strip(), chat_cache_fingerprint())
+
+
+def store_chat_reply(request: ChatRequest, reply: str) -> None:
+    """Cache the reply to a turn without history"""
+    if chat_cache and not request.history:
+        chat_cache.put(request.message.strip(), reply, chat_cache_fingerprint())
+
+
+def sse_event(data: Dict, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """
+    Chat with FoodLoop assistant using Gemini.
+    Request: message (required), history (optional list of {role, text}).
+    Response: { reply: "...", usage: {...token counts} }.
+    """
+    gemini_history, prompt, usage = prepare_chat_turn(request)
+    cached = get_cached_chat_reply(request)
+    if cached is not None:
+        return ChatResponse(reply=cached)
     try:
-        history = request.history or []
-        # Limit history to last 10 messages to avoid token limits
-        history = history[-10:]
-        # Convert to Gemini format: list of {role, parts: [text]}
-        gemini_history = []
-        for item in history:
-            role = item.role if item.role in ("user", "model") else "user"
-            gemini_history.append({"role": role, "parts": [item.text]})
-        if gemini_history:
-            chat_session = chat_model.start_chat(history=gemini_history)
-            response = chat_session.send_message(message)
-        else:
-            response = chat_model.generate_content(message)
-        reply = response.text if response and response.text else "I couldn't generate a response. Please try again."
-        return ChatResponse(reply=reply)
+        response = await worker_pool.run(_generate_chat_reply, gemini_history, prompt)
+        usage.update(gemini_usage(response))
+        log_chat_usage(usage)
+        if response and response.text:
+            store_chat_reply(request, response.text)
+            return ChatResponse(reply=response.text, usage=usage)
+        return ChatResponse(reply="I couldn't generate a response. Please try again.", usage=usage)
     except Exception as e:
-        err_msg = str(e)
-        if "quota" in err_msg.lower() or "rate limit" in err_msg.lower() or "429" in err_msg:
-            raise HTTPException(
-                status_code=503,
-                detail={
-                    "error": "API quota exceeded",
-                    "message": "Gemini API rate limit exceeded. Please try again later.",
-                },
+        raise chat_error(e)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+    Request: same as /chat.
+    Response (text/event-stream):
+        data: {"text": "..."}                                  partial reply, repeated
+        event: done / data: {"reply", "ttft_ms", "total_ms", "usage"}   full reply, timings, tokens
+        event: error / data: {"error", "message"}              failure after streaming started
+    Generation stops when the client disconnects.
+    """
+    gemini_history, prompt, usage = prepare_chat_turn(request)
+    cached = get_cached_chat_reply(request)
+    if cached is not None:
+        async def cached_events():
+            yield sse_event({"text": cached})
+            yield sse_event({"reply": cached, "ttft_ms": 0, "total_ms": 0, "cached": True}, event="done")
+
+        return StreamingResponse(cached_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+    start = time.perf_counter()
+
+    def emit(text: str) -> None:
+        loop.call_soon_threadsafe(chunks.put_nowait, text)
+
+    producer = asyncio.ensure_future(worker_pool.run(_stream_chat_reply, gemini_history, prompt, emit, cancelled))
+    # Queued after every chunk emitted by the worker thread
+    producer.add_done_callback(lambda _: chunks.put_nowait(None))
+    chat_stream_stats["streams"] += 1
+
+    # Wait for the first chunk so setup failures (busy pool, quota) still get a proper status code
+    first = await chunks.get()
+    if first is None and producer.exception():
+        chat_stream_stats["failed"] += 1
+        raise chat_error(producer.exception())
+    ttft_ms = (time.perf_counter() - start) * 1000
+    if first is not None:
+        chat_stream_stats["first_tokens"] += 1
+        chat_stream_stats["ttft_ms_total"] += ttft_ms
+
+    async def events():
+        parts = []
+        text = first
+        completed = False
+        try:
+            while text is not None:
+                parts.append(text)
+                yield sse_event({"text": text})
+                if await http_request.is_disconnected():
+                    return
+                text = await chunks.get()
+            error = producer.exception()
+            if error:
+                chat_stream_stats["failed"] += 1
+                logger.warning("⚠️  Chat stream failed after %d chunks: %s", len(parts), error)
+                yield sse_event(chat_error(error).detail, event="error")
+                return
+            completed = True
+            total_ms = (time.perf_counter() - start) * 1000
+            if parts:
+                store_chat_reply(request, "".join(parts))
+            usage.update(producer.result() or {})
+            log_chat_usage(usage)
+            reply = "".join(parts) or "I couldn't generate a response. Please try again."
+            logger.info("⏱️  Chat stream: first token %.0fms, total %.0fms, %d chunks", ttft_ms, total_ms, len(parts))
+            yield sse_event(
+                {"reply": reply, "ttft_ms": round(ttft_ms), "total_ms": round(total_ms), "usage": usage}, event="done"
             )
-        raise HTTPException(
-            status_code=500,
-            detail={"error": "Chat failed", "message": err_msg or "An error occurred while generating a response."},
-        )
+        finally:
+            if not completed and not producer.done():
+                # Client went away: stop reading the Gemini stream
+                cancelled.set()
+                chat_stream_stats["cancelled"] += 1
+                logger.info("⏹️  Chat stream cancelled by client after %d chunks", len(parts))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 if __name__ == "__main__":
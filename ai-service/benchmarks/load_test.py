@@ -0,0 +1,270 @@
+"""
+Load test for the AI service.
+
+By default the app is started in-process with the fake Gemini backend
+(GEMINI_BACKEND=fake, see models/fake_gemini.py), test images are served from
+a local HTTP server, and the chosen endpoint is driven at a fixed concurrency.
+Reports throughput, latency percentiles and status codes (plus time to first
+token for chat-stream) so runs can be compared across changes.
+
+Examples (from ai-service/):
+    python benchmarks/load_test.py --endpoint predict --requests 200 --concurrency 16 --no-quota
+    python benchmarks/load_test.py --endpoint chat-stream --requests 100 --concurrency 8 --json chat.json
+    python benchmarks/load_test.py --base-url http://localhost:8000 --endpoint predict --image-url https://...
+
+Fake backend behaviour is set with the GEMINI_FAKE_* environment variables
+(latency, 429 and malformed-JSON rates).
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+import requests
+from PIL import Image
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHAT_QUESTIONS = [
+    "How do I donate food?",
+    "Who can receive food on FoodLoop?",
+    "How do drivers pick up donations?",
+    "What happens when a donation expires?",
+    "How do I earn badges?",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ImageServer:
+    """Serves deterministic JPEG test photos at /img/<n>.jpg"""
+
+    def __init__(self, size=(1600, 1200)):
+        self.size = size
+        self._images: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+        self._base = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                try:
+                    index = int(self.path.rsplit("/", 1)[-1].split(".")[0])
+                except ValueError:
+                    self.send_error(404)
+                    return
+                body = server.image(index)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.port = free_port()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def image(self, index: int) -> bytes:
+        with self._lock:
+            if index not in self._images:
+                if self._base is None:
+                    # Smooth gradient plus noise: compresses like a photo
+                    rng = np.random.default_rng(0)
+                    y, x = np.mgrid[0:self.size[1], 0:self.size[0]]
+                    base = np.stack([x * 255 // self.size[0], y * 255 // self.size[1], np.zeros_like(x)], -1)
+                    self._base = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+                # A coarse light pattern per index keeps images apart for the perceptual
+                # duplicate index; the tint and block position change every byte
+                coarse = np.random.default_rng(index + 1).integers(-60, 61, (8, 9))
+                shading = np.kron(coarse, np.ones((-(-self.size[1] // 8), -(-self.size[0] // 9)), dtype=np.int64))
+                pixels = np.clip(self._base + shading[:self.size[1], :self.size[0], None], 0, 255).astype(np.uint8)
+                pixels[..., 2] = (pixels[..., 2].astype(np.uint16) + index * 37) % 256
+                row, col = (index * 97) % (self.size[1] - 64), (index * 131) % (self.size[0] - 64)
+                pixels[row:row + 64, col:col + 64] = 255 - pixels[row:row + 64, col:col + 64]
+                buffer = io.BytesIO()
+                Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+                self._images[index] = buffer.getvalue()
+            return self._images[index]
+
+    def prepare(self, count: int) -> None:
+        """Render images up front so generation is not measured as download time"""
+        for index in range(count):
+            self.image(index)
+
+    def url(self, index: int) -> str:
+        return f"http://127.0.0.1:{self.port}/img/{index}.jpg"
+
+
+def start_app(real_backend: bool, quota: bool) -> str:
+    """Run the FastAPI app with uvicorn in a background thread; returns its base URL"""
+    if not real_backend:
+        os.environ["GEMINI_BACKEND"] = "fake"
+    if not quota:
+        os.environ["GEMINI_QUOTA_ENABLED"] = "false"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, SERVICE_DIR)
+    import uvicorn
+    import app as service
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(service.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.base_url.rstrip("/") if args.base_url else start_app(args.real, not args.no_quota)
+        self.images = None if args.image_url else ImageServer()
+        self._local = threading.local()
+
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def image_url(self, i: int) -> str:
+        if self.args.image_url:
+            return self.args.image_url[i % len(self.args.image_url)]
+        return self.images.url(i % self.args.unique_images)
+
+    def one_request(self, i: int) -> Dict:
+        endpoint = self.args.endpoint
+        session = self.session()
+        start = time.perf_counter()
+        ttft = None
+        if endpoint == "predict":
+            response = session.post(f"{self.base_url}/predict", json={"imageUrl": self.image_url(i)})
+        elif endpoint == "upload":
+            data = self.images.image(i % self.args.unique_images) if self.images else requests.get(self.image_url(i)).content
+            start = time.perf_counter()
+            response = session.post(f"{self.base_url}/predict/upload", data=data,
+                                    headers={"Content-Type": "image/jpeg"})
+        elif endpoint == "batch":
+            urls = [self.image_url(i * self.args.batch_size + k) for k in range(self.args.batch_size)]
+            response = session.post(f"{self.base_url}/predict/batch", json={"imageUrls": urls})
+        elif endpoint == "chat":
+            response = session.post(f"{self.base_url}/chat", json={"message": self.question(i)})
+        else:
+            response = session.post(f"{self.base_url}/chat/stream", json={"message": self.question(i)}, stream=True)
+            for line in response.iter_lines():
+                if line and ttft is None:
+                    ttft = time.perf_counter() - start
+            response.close()
+        if endpoint != "chat-stream":
+            response.content  # read the whole body
+        return {"latency": time.perf_counter() - start, "status": response.status_code, "ttft": ttft}
+
+    def question(self, i: int) -> str:
+        question = CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)]
+        # Unique suffix defeats the chat answer cache unless --repeat-questions is set
+        return question if self.args.repeat_questions else f"{question} (#{i})"
+
+    def run(self) -> Dict:
+        if self.images:
+            per_request = self.args.batch_size if self.args.endpoint == "batch" else 1
+            self.images.prepare(min(self.args.unique_images, self.args.requests * per_request))
+        for i in range(self.args.warmup):
+            self.one_request(-1 - i)
+        results: List[Dict] = []
+        errors = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for future in [pool.submit(self.one_request, i) for i in range(self.args.requests)]:
+                try:
+                    results.append(future.result())
+                except requests.RequestException:
+                    errors += 1
+        elapsed = time.perf_counter() - start
+        return summarize(self.args, results, errors, elapsed)
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    ms = np.array(values) * 1000
+    return {
+        "mean": round(float(ms.mean()), 1),
+        "p50": round(float(np.percentile(ms, 50)), 1),
+        "p90": round(float(np.percentile(ms, 90)), 1),
+        "p95": round(float(np.percentile(ms, 95)), 1),
+        "p99": round(float(np.percentile(ms, 99)), 1),
+        "max": round(float(ms.max()), 1),
+    }
+
+
+def summarize(args, results: List[Dict], errors: int, elapsed: float) -> Dict:
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    return {
+        "endpoint": args.endpoint,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "duration_seconds": round(elapsed, 2),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "statuses": statuses,
+        "connection_errors": errors,
+        "latency_ms": percentiles([r["latency"] for r in results]),
+        "ttft_ms": percentiles([r["ttft"] for r in results if r["ttft"] is not None]),
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(f"\n{report['endpoint']}: {report['requests']} requests at concurrency {report['concurrency']}")
+    print(f"  duration    {report['duration_seconds']}s")
+    print(f"  throughput  {report['throughput_rps']} req/s")
+    print(f"  statuses    {report['statuses']}  connection errors: {report['connection_errors']}")
+    for key in ("latency_ms", "ttft_ms"):
+        if report[key]:
+            values = "  ".join(f"{name} {value}" for name, value in report[key].items())
+            print(f"  {key:<11} {values}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the FoodLoop AI service")
+    parser.add_argument("--endpoint", choices=["predict", "upload", "batch", "chat", "chat-stream"], default="predict")
+    parser.add_argument("--requests", type=int, default=100, help="Total requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before the run")
+    parser.add_argument("--base-url", help="Test a running service instead of starting one in-process")
+    parser.add_argument("--real", action="store_true", help="In-process app uses the real Gemini API (costs quota)")
+    parser.add_argument("--no-quota", action="store_true",
+                        help="In-process app skips the local RPM/RPD limiter (measures the service, not the free tier)")
+    parser.add_argument("--image-url", action="append", help="Image URL(s) to use instead of the local image server")
+    parser.add_argument("--unique-images", type=int, default=200,
+                        help="Distinct local images to cycle through (lower values exercise the caches)")
+    parser.add_argument("--batch-size", type=int, default=4, help="Images per /predict/batch request")
+    parser.add_argument("--repeat-questions", action="store_true", help="Reuse chat questions (exercises the answer cache)")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    report = LoadTest(args).run()
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
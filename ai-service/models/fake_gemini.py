@@ -0,0 +1,230 @@
+"""
+Offline stand-in for google.generativeai.GenerativeModel.
+
+Selected with GEMINI_BACKEND=fake. It answers the analyzer's prompts
+(single-pass, two-pass detection, batch) and chat messages with plausible
+responses, without network access or quota, so the whole pipeline can be
+load-tested. Latency follows a log-normal distribution, and a configurable
+share of calls fails with a 429 ("Please retry in Xs") or returns malformed
+JSON, to exercise the retry and fallback paths.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+import google.generativeai as genai
+
+SAMPLE_ANALYSES = [
+    {"foodCategory": "Cooked Meals", "itemName": "Rice and Curry", "quantity": 3, "qualityScore": 0.86,
+     "freshness": "Fresh", "storageRecommendation": "Hot", "confidence": 0.91,
+     "detectedItems": ["rice", "chicken curry", "dhal"], "productType": "cooked"},
+    {"foodCategory": "Snacks", "itemName": "Bread Loaves", "quantity": 5, "qualityScore": 0.78,
+     "freshness": "Good", "storageRecommendation": "Dry", "confidence": 0.88,
+     "detectedItems": ["bread"], "productType": "packed"},
+    {"foodCategory": "Raw Food", "itemName": "Bananas", "quantity": 12, "qualityScore": 0.7,
+     "freshness": "Good", "storageRecommendation": "Dry", "confidence": 0.93,
+     "detectedItems": ["banana"], "productType": "cooked"},
+]
+
+CHAT_REPLY = (
+    "FoodLoop connects donors who have surplus food with receivers and volunteer drivers. "
+    "To donate, sign in as a donor, add a photo of the food and choose a pickup time. "
+    "Nearby receivers are notified and a driver collects the donation."
+)
+
+
+class FakeGeminiConfig:
+    """Behaviour of the fake backend"""
+
+    def __init__(self, latency_ms: float = 800, latency_sigma: float = 0.5, rate_limit_rate: float = 0.0,
+                 retry_after_seconds: float = 2.0, malformed_rate: float = 0.0,
+                 stream_chunk_ms: float = 40, seed: Optional[int] = None,
+                 unavailable_models: Optional[List[str]] = None):
+        """
+        Args:
+            latency_ms: Median latency of a call
+            latency_sigma: Log-normal spread (0 = constant latency)
+            rate_limit_rate: Share of calls failing with a 429
+            retry_after_seconds: Delay suggested in the 429 message
+            malformed_rate: Share of calls returning unparseable JSON
+            stream_chunk_ms: Delay between streamed chunks
+            seed: Random seed for reproducible runs
+            unavailable_models: Models whose calls all fail with a 503 (to exercise failover)
+        """
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.malformed_rate = malformed_rate
+        self.stream_chunk_ms = stream_chunk_ms
+        self.random = random.Random(seed)
+        self.unavailable_models = set(unavailable_models or [])
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FakeGeminiConfig":
+        seed = os.getenv("GEMINI_FAKE_SEED")
+        return cls(
+            latency_ms=float(os.getenv("GEMINI_FAKE_LATENCY_MS", 800)),
+            latency_sigma=float(os.getenv("GEMINI_FAKE_LATENCY_SIGMA", 0.5)),
+            rate_limit_rate=float(os.getenv("GEMINI_FAKE_429_RATE", 0)),
+            retry_after_seconds=float(os.getenv("GEMINI_FAKE_RETRY_AFTER_SECONDS", 2)),
+            malformed_rate=float(os.getenv("GEMINI_FAKE_MALFORMED_RATE", 0)),
+            stream_chunk_ms=float(os.getenv("GEMINI_FAKE_STREAM_CHUNK_MS", 40)),
+            seed=int(seed) if seed else None,
+            unavailable_models=[m.strip() for m in os.getenv("GEMINI_FAKE_UNAVAILABLE_MODELS", "").split(",") if m.strip()],
+        )
+
+    def draw(self) -> float:
+        with self._lock:
+            return self.random.random()
+
+    def choice(self, options: List):
+        with self._lock:
+            return self.random.choice(options)
+
+    def latency_seconds(self) -> float:
+        with self._lock:
+            factor = math.exp(self.random.gauss(0, self.latency_sigma)) if self.latency_sigma > 0 else 1.0
+        return self.latency_ms * factor / 1000
+
+
+# Shared by every fake model so injection rates apply process-wide
+config = FakeGeminiConfig.from_env()
+
+
+class _UsageMetadata:
+    def __init__(self, prompt_tokens: int, reply_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = reply_tokens
+        self.total_token_count = prompt_tokens + reply_tokens
+
+
+class FakeResponse:
+    """Subset of GenerateContentResponse used by the service"""
+
+    def __init__(self, text: str, prompt_tokens: int = 0):
+        self.text = text
+        self.usage_metadata = _UsageMetadata(prompt_tokens, max(1, len(text) // 4))
+
+
+def _estimate_prompt_tokens(contents) -> int:
+    parts = contents if isinstance(contents, list) else [contents]
+    # Images count as ~258 tokens each, like Gemini's fixed per-image cost
+    return sum(len(p) // 4 if isinstance(p, str) else 258 for p in parts)
+
+
+class FakeGenerativeModel:
+    """Drop-in replacement for genai.GenerativeModel"""
+
+    def __init__(self, model_name: str = "gemini-2.5-flash-lite", system_instruction: Optional[str] = None, **kwargs):
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self.system_instruction = system_instruction
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        prompt_tokens = _estimate_prompt_tokens(contents)
+        self._simulate_call()
+        schema = (generation_config or {}).get("response_schema")
+        if schema:
+            # Structured output: bare JSON that always matches the schema
+            text = self._structured_reply(contents, schema)
+            return self._stream(text, prompt_tokens) if stream else FakeResponse(text, prompt_tokens)
+        text = self._reply_text(contents)
+        if text.startswith(("{", "```")) and config.draw() < config.malformed_rate:
+            # Cut the answer off mid-object, like a truncated or chatty model reply
+            text = "Here is the analysis: " + text[: max(1, len(text) // 2)]
+        if stream:
+            return self._stream(text, prompt_tokens)
+        return FakeResponse(text, prompt_tokens)
+
+    def start_chat(self, history: Optional[List[Dict]] = None) -> "FakeChatSession":
+        return FakeChatSession(self, history or [])
+
+    def _simulate_call(self) -> None:
+        time.sleep(config.latency_seconds())
+        if self.model_name.split("/")[-1] in config.unavailable_models:
+            raise google_exceptions.ServiceUnavailable("The model is overloaded. Please try again later.")
+        if config.draw() < config.rate_limit_rate:
+            raise google_exceptions.ResourceExhausted(
+                f"You exceeded your current quota. Please retry in {config.retry_after_seconds:.1f}s."
+            )
+
+    def _stream(self, text: str, prompt_tokens: int) -> Iterator[FakeResponse]:
+        words = text.split(" ")
+        for i in range(0, len(words), 4):
+            if i:
+                time.sleep(config.stream_chunk_ms / 1000)
+            yield FakeResponse(" ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else ""), prompt_tokens)
+
+    @staticmethod
+    def _structured_reply(contents, schema: Dict) -> str:
+        properties = schema.get("properties", {})
+        detection = {"isAiGenerated": False, "confidence": 0.05, "reason": ""}
+        if "isAiGenerated" in properties:
+            return json.dumps(detection)
+        if "results" in properties:
+            parts = contents if isinstance(contents, list) else [contents]
+            count = sum(1 for p in parts[1:] if isinstance(p, str) and p.startswith("Image "))
+            return json.dumps({"results": [
+                {"index": i, **config.choice(SAMPLE_ANALYSES), "expiryDateFromPackage": None, "error": None,
+                 "aiDetection": detection} for i in range(count)
+            ]})
+        analysis = {**config.choice(SAMPLE_ANALYSES), "expiryDateFromPackage": None, "error": None}
+        if "aiDetection" in properties:
+            analysis["aiDetection"] = detection
+        return json.dumps(analysis)
+
+    @staticmethod
+    def _reply_text(contents) -> str:
+        parts = contents if isinstance(contents, list) else [contents]
+        prompt = parts[0] if parts and isinstance(parts[0], str) else ""
+        if "foodCategory" not in prompt:
+            if "isAiGenerated" in prompt:
+                # Two-pass AI detection call
+                return json.dumps({"isAiGenerated": False, "confidence": 0.05, "reason": ""})
+            return CHAT_REPLY
+        detection = {"isAiGenerated": False, "confidence": 0.05, "reason": ""}
+        if "BATCH MODE" in prompt:
+            count = sum(1 for p in parts[1:] if isinstance(p, str) and p.startswith("Image "))
+            results = [
+                {"index": i, **config.choice(SAMPLE_ANALYSES), "aiDetection": detection} for i in range(count)
+            ]
+            return json.dumps({"results": results})
+        analysis = dict(config.choice(SAMPLE_ANALYSES))
+        if "aiDetection" in prompt:
+            analysis["aiDetection"] = detection
+        return "```json\n" + json.dumps(analysis) + "\n```"
+
+
+class FakeChatSession:
+    """Subset of genai.ChatSession used by /chat"""
+
+    def __init__(self, model: FakeGenerativeModel, history: List[Dict]):
+        self.model = model
+        self.history = history
+
+    def send_message(self, message, stream: bool = False, **kwargs):
+        return self.model.generate_content(message, stream=stream)
+
+
+class _FakeModelInfo:
+    def __init__(self, name: str):
+        self.name = f"models/{name}"
+        self.supported_generation_methods = ["generateContent"]
+
+
+def list_models() -> List[_FakeModelInfo]:
+    """Stand-in for genai.list_models()"""
+    return [_FakeModelInfo(name) for name in ("gemini-2.5-flash-lite", "gemini-2.5-flash", "gemini-3-flash-preview")]
+
+
+def install() -> None:
+    """Route every google.generativeai model call in the process to the fake backend"""
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.list_models = list_models
+    genai.configure = lambda **kwargs: None
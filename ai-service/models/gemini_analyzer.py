@@ -4,14 +4,30 @@ Food detection and quality assessment using Gemini AI.
 """
 import os
 import json
+import logging
 import time
-import requests
 import re
+import contextvars
 from PIL import Image
 from io import BytesIO
-from typing import Dict, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple, Union
 import warnings
 
+from services.prediction_cache import PredictionCache, hash_image_bytes
+from services.image_preprocessing import DecodedImage, ImagePreprocessor
+from services.image_quality import ImageQualityScreen
+from services.perceptual_index import PerceptualIndex, perceptual_hash_image
+from services.image_downloader import ImageDownloader
+from services.deadline import DeadlineExceeded, check_deadline, current_deadline, remaining_seconds
+from services.rate_limiter import PRIORITY_PREDICT, QuotaExceeded, QuotaScheduler
+from services.model_pool import OPEN, REQUEST_ERRORS, ModelPool, PoolMember, is_rate_limit_error
+from services.hedging import OUTCOME_BOTH_FAILED, OUTCOME_HEDGE_WON, OUTCOME_PRIMARY_WON, HedgeLeg, HedgePolicy
+from services.instrumentation import record_calls_saved, record_parse, record_retry, record_stage, record_tokens, stage
+from models.schemas import (
+    AiDetection, GeminiBatchAnalysis, GeminiCombinedAnalysis, GeminiFoodAnalysis, gemini_response_schema,
+)
+
 # Suppress deprecation warning for google.generativeai BEFORE importing
 # Note: google.genai has a different API structure, so we continue using google.generativeai
 # The package still works, just shows a deprecation warning
@@ -20,6 +36,8 @@ warnings.filterwarnings("ignore", category=FutureWarning, module="google.generat
 
 import google.generativeai as genai
 
+logger = logging.getLogger(__name__)
+
 
 class GeminiFoodAnalyzer:
     """Food analyzer using Google Gemini Vision API"""
@@ -33,14 +51,132 @@ class GeminiFoodAnalyzer:
         'desserts': 'Cold',
     }
     
-    def __init__(self, api_key: Optional[str] = None):
+    # Prioritize Gemini 2.5 Flash-Lite (best free tier limits: 15 RPM, 1000 RPD)
+    # Order: 2.5-flash-lite > 2.5-flash > 2.5-pro > 1.5 models (fallback)
+    PREFERRED_MODEL_ORDER = ['2.5-flash-lite', '2.5-flash', '2.5-pro', '1.5-flash-lite', '1.5-flash', '1.5-pro', 'pro']
+    
+    # Used without listing models when no cached discovery result exists yet
+    DEFAULT_MODEL = 'gemini-2.5-flash-lite'
+    
+    # Models that take over (in order) when the selected model's circuit breaker is open
+    DEFAULT_FAILOVER_MODELS = ['gemini-2.5-flash', 'gemini-2.5-pro']
+    
+    # Images flagged as AI-generated at or above this confidence are rejected
+    AI_GENERATED_THRESHOLD = 0.7
+    
+    # "single": one Gemini call returns AI detection + food analysis
+    # "two_pass": separate AI detection call followed by the analysis call
+    ANALYSIS_MODES = ("single", "two_pass")
+    
+    # Set generation config for more accurate food identification
+    # Lower temperature for more consistent and accurate results
+    ANALYSIS_GENERATION_CONFIG = {
+        "temperature": 0.2,  # Lower temperature for more accurate food name identification
+        "max_output_tokens": 2048,
+        "top_p": 0.8,  # Focus on most likely food names
+        "top_k": 40,  # Limit to top 40 most relevant tokens
+    }
+    
+    AI_DETECTION_GENERATION_CONFIG = {
+        "temperature": 0.3,  # Lower temperature for more consistent detection
+        "max_output_tokens": 512,
+    }
+    
+    # Structured output: Gemini returns bare JSON matching these schemas
+    RESPONSE_SCHEMAS = {
+        "ai_detection": gemini_response_schema(AiDetection),
+        "analysis": gemini_response_schema(GeminiFoodAnalysis),
+        "combined": gemini_response_schema(GeminiCombinedAnalysis),
+        "batch": gemini_response_schema(GeminiBatchAnalysis),
+    }
+    
+    @classmethod
+    def select_vision_model(cls, model_names: List[str]) -> Optional[str]:
+        """
+        Pick the preferred vision model from a list_models() result
+        
+        Args:
+            model_names: Names of models supporting generateContent
+            
+        Returns:
+            Model name without the 'models/' prefix, or None if no Gemini model is listed
+        """
+        # Filter for vision-capable models (usually contain 'vision' or are gemini models)
+        vision_models = [name for name in model_names if 'gemini' in name.lower() or 'vision' in name.lower()]
+        if not vision_models:
+            return None
+        
+        selected_model = None
+        for preferred in cls.PREFERRED_MODEL_ORDER:
+            for model in vision_models:
+                if preferred in model.lower():
+                    selected_model = model
+                    break
+            if selected_model:
+                break
+        
+        # If no preferred model found, use first available
+        if not selected_model:
+            selected_model = vision_models[0]
+        
+        # Extract model name (remove 'models/' prefix if present)
+        return selected_model.split('/')[-1] if '/' in selected_model else selected_model
+    
+    def __init__(self, api_key: Optional[str] = None, cache: Optional[PredictionCache] = None,
+                 analysis_mode: Optional[str] = None, preprocessor: Optional[ImagePreprocessor] = None,
+                 downloader: Optional[ImageDownloader] = None, scheduler: Optional[QuotaScheduler] = None,
+                 model_name: Optional[str] = None, structured_output: Optional[bool] = None,
+                 failover_models: Optional[List[str]] = None, quality_screen: Optional[ImageQualityScreen] = None,
+                 perceptual_index: Optional[PerceptualIndex] = None, hedging: Optional[HedgePolicy] = None):
         """
         Initialize Gemini client
         
         Args:
             api_key: Google Gemini API key (or from GEMINI_API_KEY env var)
+            cache: Optional prediction cache; hits skip the download and both Gemini calls
+            analysis_mode: "single" or "two_pass" (or from GEMINI_ANALYSIS_MODE env var, default "single")
+            preprocessor: Optional downscale/re-encode stage applied before images are sent to Gemini
+            downloader: Pooled image downloader (a default one is created if omitted)
+            scheduler: Optional process-wide quota scheduler gating every Gemini call
+            model_name: Use this model directly instead of listing available models
+            structured_output: Request JSON with a response schema instead of parsing free text
+                (or from GEMINI_STRUCTURED_OUTPUT env var, default true)
+            failover_models: Fallback models behind the selected one, in order
+                (or from GEMINI_FAILOVER_MODELS env var, comma-separated; empty disables failover)
+            quality_screen: Optional local quality check that flags or rejects images before any Gemini call
+            perceptual_index: Optional near-duplicate index; matches reuse the cached prediction of
+                the earlier image and are flagged as possible duplicate donations
+            hedging: Optional policy for racing slow analysis calls against the next model in the pool
         """
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self.cache = cache
+        self.preprocessor = preprocessor
+        self.quality_screen = quality_screen
+        self.perceptual_index = perceptual_index
+        self.hedging = hedging
+        self.downloader = downloader or ImageDownloader()
+        self.scheduler = scheduler
+        # Multi-image requests: images per Gemini call and total inline payload per call
+        self.batch_max_images = max(1, int(os.getenv("GEMINI_BATCH_MAX_IMAGES", 4)))
+        self.batch_max_bytes = int(os.getenv("GEMINI_BATCH_MAX_BYTES", 12 * 1024 * 1024))
+        self.analysis_mode = (analysis_mode or os.getenv("GEMINI_ANALYSIS_MODE") or "single").lower()
+        if self.analysis_mode not in self.ANALYSIS_MODES:
+            raise ValueError(f"Invalid GEMINI_ANALYSIS_MODE '{self.analysis_mode}', expected one of {self.ANALYSIS_MODES}")
+        if structured_output is None:
+            structured_output = os.getenv("GEMINI_STRUCTURED_OUTPUT", "true").lower() not in ("0", "false", "no")
+        self.structured_output = structured_output
+        self.output_mode = "structured" if structured_output else "text"
+        if failover_models is None:
+            spec = os.getenv("GEMINI_FAILOVER_MODELS")
+            failover_models = self.DEFAULT_FAILOVER_MODELS if spec is None else [m.strip() for m in spec.split(",") if m.strip()]
+        self.failover_models = failover_models
+        self.breaker_settings = {
+            "window": int(os.getenv("GEMINI_BREAKER_WINDOW", 20)),
+            "min_calls": int(os.getenv("GEMINI_BREAKER_MIN_CALLS", 5)),
+            "failure_rate": float(os.getenv("GEMINI_BREAKER_FAILURE_RATE", 0.5)),
+            "slow_call_seconds": float(os.getenv("GEMINI_BREAKER_SLOW_CALL_SECONDS", 15)),
+            "open_seconds": float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", 30)),
+        }
         
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY environment variable is required")
@@ -51,42 +187,25 @@ class GeminiFoodAnalyzer:
             # Note: google.genai has different API, migration would require code rewrite
             genai.configure(api_key=self.api_key)
             
+            if model_name:
+                # Already resolved (e.g. from the model discovery cache): no network call
+                self.set_model(model_name)
+                return
+            
             # List available models to find the correct one
-            print("🔍 Listing available Gemini models...")
+            logger.info("🔍 Listing available Gemini models...")
             try:
                 available_models = genai.list_models()
                 model_names = [model.name for model in available_models if 'generateContent' in model.supported_generation_methods]
-                print(f"📋 Available models with generateContent: {model_names}")
-                
-                # Filter for vision-capable models (usually contain 'vision' or are gemini models)
-                vision_models = [name for name in model_names if 'gemini' in name.lower() or 'vision' in name.lower()]
+                logger.info("📋 Available models with generateContent: %s", model_names)
                 
-                if vision_models:
-                    # Prioritize Gemini 2.5 Flash-Lite (best free tier limits: 15 RPM, 1000 RPD)
-                    # Order: 2.5-flash-lite > 2.5-flash > 2.5-pro > 1.5 models (fallback)
-                    preferred_order = ['2.5-flash-lite', '2.5-flash', '2.5-pro', '1.5-flash-lite', '1.5-flash', '1.5-pro', 'pro']
-                    
-                    selected_model = None
-                    for preferred in preferred_order:
-                        for model in vision_models:
-                            if preferred in model.lower():
-                                selected_model = model
-                                break
-                        if selected_model:
-                            break
-                    
-                    # If no preferred model found, use first available
-                    if not selected_model:
-                        selected_model = vision_models[0]
-                    
-                    # Extract model name (remove 'models/' prefix if present)
-                    model_name = selected_model.split('/')[-1] if '/' in selected_model else selected_model
-                    print(f"✅ Using model: {model_name}")
-                    self.model = genai.GenerativeModel(model_name)
-                    print(f"✅ Gemini AI model initialized successfully: {model_name}")
+                model_name = self.select_vision_model(model_names)
+                if model_name:
+                    logger.info("✅ Using model: %s", model_name)
+                    self.set_model(model_name)
                 else:
                     # Fallback: try common model names (Gemini 2.5 Flash-Lite first - best free tier limits)
-                    print("⚠️  No vision models found in list, trying Gemini 2.5 Flash-Lite model names...")
+                    logger.warning("⚠️  No vision models found in list, trying Gemini 2.5 Flash-Lite model names...")
                     model_names_to_try = [
                         'models/gemini-2.5-flash-lite', # Primary: Gemini 2.5 Flash-Lite (15 RPM, 1000 RPD)
                         'gemini-2.5-flash-lite',
@@ -107,21 +226,20 @@ class GeminiFoodAnalyzer:
                     model_initialized = False
                     for model_name in model_names_to_try:
                         try:
-                            print(f"🔄 Trying: {model_name}")
-                            self.model = genai.GenerativeModel(model_name)
-                            print(f"✅ Gemini AI model initialized: {model_name}")
+                            logger.info("🔄 Trying: %s", model_name)
+                            self.set_model(model_name)
                             model_initialized = True
                             break
                         except Exception as e:
-                            print(f"⚠️  {model_name} failed: {str(e)[:80]}")
+                            logger.warning("⚠️  %s failed: %s", model_name, str(e)[:80])
                             continue
                     
                     if not model_initialized:
                         raise Exception("Could not initialize any Gemini model. Available models: " + str(model_names))
                         
             except Exception as list_error:
-                print(f"⚠️  Could not list models: {list_error}")
-                print("🔄 Trying direct model initialization with Gemini 2.5 Flash-Lite...")
+                logger.warning("⚠️  Could not list models: %s", list_error)
+                logger.info("🔄 Trying direct model initialization with Gemini 2.5 Flash-Lite...")
                 
                 # Fallback: try Gemini 2.5 Flash-Lite model names directly (best free tier limits)
                 model_names_to_try = [
@@ -144,48 +262,190 @@ class GeminiFoodAnalyzer:
                 model_initialized = False
                 for model_name in model_names_to_try:
                     try:
-                        print(f"🔄 Trying: {model_name}")
-                        self.model = genai.GenerativeModel(model_name)
-                        print(f"✅ Gemini AI model initialized: {model_name}")
+                        logger.info("🔄 Trying: %s", model_name)
+                        self.set_model(model_name)
                         model_initialized = True
                         break
                     except Exception as e:
-                        print(f"⚠️  {model_name} failed: {str(e)[:80]}")
+                        logger.warning("⚠️  %s failed: %s", model_name, str(e)[:80])
                         continue
                 
                 if not model_initialized:
                     raise Exception(f"Could not initialize any Gemini model. Last error: {list_error}")
                 
         except Exception as e:
-            print(f"❌ Error initializing Gemini model: {e}")
+            logger.error("❌ Error initializing Gemini model: %s", e)
             raise
     
-    def download_image(self, image_url: str) -> Image.Image:
+    def set_model(self, model_name: str) -> None:
         """
-        Download image from URL
+        Switch the vision model used for analysis
+        
+        Rebuilds the model pool with this model first and the failover models
+        behind it. Models already in the pool keep their breaker state and
+        latency history; nothing changes if the order stays the same.
+        
+        Args:
+            model_name: Gemini model id
+        """
+        model_names = [model_name] + self.failover_models
+        previous = getattr(self, "pool", None)
+        if previous and previous.holds(model_names):
+            return
+        self.pool = ModelPool(
+            model_names,
+            # Looked up per call so a patched GenerativeModel (fake backend) is honored
+            model_factory=lambda name: genai.GenerativeModel(name),
+            scheduler=self.scheduler,
+            breaker_settings=self.breaker_settings,
+            previous=previous,
+        )
+        self.model = self.pool.primary.model
+        logger.info("✅ Gemini AI model initialized: %s", model_name)
+    
+    def download_image_bytes(self, image_url: str) -> bytes:
+        """
+        Download raw image bytes from URL
         
         Args:
             image_url: URL of the image
             
         Returns:
-            PIL Image object
+            Image file contents
+            
+        Raises:
+            DeadlineExceeded: If the request deadline passed before or during the download
         """
+        check_deadline("download")
         try:
-            print(f"⬇️  Downloading image (timeout: 15s)...")
-            download_start = time.time()
-            response = requests.get(image_url, timeout=15)
-            response.raise_for_status()
-            download_elapsed = time.time() - download_start
-            print(f"✅ Image download completed in {download_elapsed:.2f} seconds")
+            logger.debug("⬇️  Downloading image (timeout: %.0fs)...", self.downloader.read_timeout)
+            data, timings = self.downloader.download(image_url, max_seconds=remaining_seconds())
+            record_stage("download", timings["total_ms"] / 1000)
+            logger.info(
+                "✅ Image download completed in %.2f seconds (%.0fKB; dns %.0fms, connect %.0fms, "
+                "ttfb %.0fms, body %.0fms%s)",
+                timings["total_ms"] / 1000, timings["bytes"] / 1024, timings["dns_ms"], timings["connect_ms"],
+                timings["ttfb_ms"], timings["body_ms"], ", new connection" if timings["new_connection"] else "",
+                extra={"download": timings},
+            )
+            return data
+        except Exception as e:
+            # A timeout cut short by the request deadline is reported as such
+            check_deadline("download")
+            raise Exception(f"Failed to download image: {str(e)}")
+    
+    def decode_image(self, data: bytes) -> Image.Image:
+        """
+        Decode image bytes into an RGB PIL image
+        
+        Args:
+            data: Image file contents
             
-            # Convert to PIL Image
-            image = Image.open(BytesIO(response.content))
+        Returns:
+            PIL Image object
+        """
+        image = Image.open(BytesIO(data))
+        
+        # Convert to RGB if needed
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        return image
+    
+    def prepare_image(self, data: bytes) -> Union[Image.Image, Dict]:
+        """
+        Turn downloaded bytes into the image part sent to Gemini
+        
+        With a preprocessor this is a downscaled, re-encoded inline blob;
+        otherwise the full-resolution decoded PIL image.
+        
+        Args:
+            data: Image file contents
             
-            # Convert to RGB if needed
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+        Returns:
+            PIL Image or {"mime_type", "data"} blob accepted by generate_content
+        """
+        return self._decode_for_upload(data)[0]
+    
+    def decode_upload(self, data: bytes) -> DecodedImage:
+        """
+        Decode image bytes once for the duplicate lookup, the pre-screen and the upload
+        
+        Args:
+            data: Image file contents
             
-            return image
+        Returns:
+            DecodedImage (downscaled with a preprocessor, full resolution otherwise)
+        """
+        with stage("decode"):
+            if self.preprocessor:
+                return self.preprocessor.decode(data)
+            image = self.decode_image(data)
+            return DecodedImage(image, None, image.size)
+    
+    def _decode_for_upload(self, data: bytes, decoded: Optional[DecodedImage] = None
+                           ) -> Tuple[Union[Image.Image, Dict], Image.Image, Tuple[int, int]]:
+        """prepare_image() plus the decoded image and its original size, reusing an earlier decode_upload()"""
+        if decoded is None:
+            decoded = self.decode_upload(data)
+        if not self.preprocessor:
+            return decoded.image, decoded.image, decoded.original_size
+        with stage("encode"):
+            prepared = self.preprocessor.process(data, decoded)
+        stats = prepared.stats
+        logger.debug(
+            "🗜️  Image preprocessed in %.0fms: %sx%s %.0fKB -> %sx%s %.0fKB (saved %.0fKB)",
+            stats["elapsed_ms"], stats["original_size"][0], stats["original_size"][1], stats["original_bytes"] / 1024,
+            stats["sent_size"][0], stats["sent_size"][1], stats["sent_bytes"] / 1024, stats["bytes_saved"] / 1024,
+        )
+        return prepared.as_part(), prepared.image, stats["original_size"]
+    
+    def prepare_and_screen(self, data: bytes, decoded: Optional[DecodedImage] = None
+                           ) -> Tuple[Union[Image.Image, Dict], Optional[Dict]]:
+        """
+        Prepare the image part and run the local quality pre-screen on the decoded image
+        
+        The screen reuses the decode done for the upload, and runs before any
+        Gemini call.
+        
+        Args:
+            data: Image file contents
+            decoded: decode_upload() of the same bytes, if already done
+            
+        Returns:
+            (image part for generate_content, imageQuality dict when the image was flagged or None)
+            
+        Raises:
+            ValueError: If the image is corrupt or rejected by the screen policy
+        """
+        if not self.quality_screen or not self.quality_screen.enabled:
+            return self._decode_for_upload(data, decoded)[0], None
+        try:
+            part, image, original_size = self._decode_for_upload(data, decoded)
+        except Exception as e:
+            raise self.quality_screen.unreadable(e)
+        # Rejecting an image saves the AI detection call too in two-pass mode
+        calls = 1 if self.analysis_mode == "single" else 2
+        with stage("prescreen"):
+            report = self.quality_screen.screen(image, original_size, calls_per_image=calls)
+        if report is None:
+            return part, None
+        logger.info("⚠️  Image flagged by quality pre-screen: %s", report.describe())
+        return part, report.as_dict()
+    
+    def download_image(self, image_url: str) -> Image.Image:
+        """
+        Download image from URL
+        
+        Args:
+            image_url: URL of the image
+            
+        Returns:
+            PIL Image object
+        """
+        data = self.download_image_bytes(image_url)
+        try:
+            return self.decode_image(data)
         except Exception as e:
             raise Exception(f"Failed to download image: {str(e)}")
     
@@ -196,7 +456,7 @@ class GeminiFoodAnalyzer:
         Returns:
             Prompt string for AI detection
         """
-        return """Analyze this image and determine if it is AI-generated, synthetic, or computer-generated.
+        prompt = """Analyze this image and determine if it is AI-generated, synthetic, or computer-generated.
 
 Look for signs of:
 - Unrealistic textures, patterns, or artifacts typical of AI image generation
@@ -206,7 +466,13 @@ Look for signs of:
 - Repetitive patterns or inconsistencies typical of AI generation
 - Overly perfect or unrealistic food presentation
 
-Respond with ONLY a JSON object:
+"""
+        if self.structured_output:
+            # The response schema defines the fields; only their meaning is needed
+            return prompt + """If the image appears to be a real photograph of food, set isAiGenerated to false.
+If the image appears to be AI-generated, synthetic, or fake, set isAiGenerated to true.
+Set confidence from 0.0 to 1.0 and give a brief reason if AI-generated."""
+        return prompt + """Respond with ONLY a JSON object:
 {
     "isAiGenerated": true or false,
     "confidence": <0.0 to 1.0>,
@@ -218,12 +484,12 @@ If the image appears to be AI-generated, synthetic, or fake, set isAiGenerated t
 
 Respond ONLY with valid JSON, no additional text."""
     
-    def detect_ai_generated_image(self, image: Image.Image) -> Dict:
+    def detect_ai_generated_image(self, image: Union[Image.Image, Dict]) -> Dict:
         """
         Detect if an image is AI-generated or synthetic
         
         Args:
-            image: PIL Image object to analyze
+            image: PIL Image object (or inline image blob) to analyze
             
         Returns:
             Dictionary with isAiGenerated (bool) and confidence (float)
@@ -232,7 +498,7 @@ Respond ONLY with valid JSON, no additional text."""
             ValueError: If image is detected as AI-generated
         """
         try:
-            print("🔍 Checking if image is AI-generated...")
+            logger.debug("🔍 Checking if image is AI-generated...")
             
             # Create detection prompt
             prompt = self.create_ai_detection_prompt()
@@ -244,29 +510,25 @@ Respond ONLY with valid JSON, no additional text."""
             
             for attempt in range(max_retries + 1):
                 try:
-                    print(f"🔄 AI detection attempt {attempt + 1}/{max_retries + 1}...")
+                    logger.debug("🔄 AI detection attempt %d/%d...", attempt + 1, max_retries + 1)
                     api_start_time = time.time()
                     
                     # Use google.generativeai API
-                    generation_config = {
-                        "temperature": 0.3,  # Lower temperature for more consistent detection
-                        "max_output_tokens": 512,
-                    }
-                    response = self.model.generate_content(
-                        [prompt, image],
-                        generation_config=generation_config
-                    )
+                    generation_config = self.generation_config("ai_detection", self.AI_DETECTION_GENERATION_CONFIG)
+                    response = self.call_model([prompt, image], generation_config)
                     
                     api_elapsed = time.time() - api_start_time
-                    print(f"⏱️  AI detection API call took {api_elapsed:.2f} seconds")
+                    logger.debug("⏱️  AI detection API call took %.2f seconds", api_elapsed)
                     
                     if not response.text:
                         raise Exception("Empty response from Gemini AI")
                     
                     response_text = response.text
-                    print(f"📝 AI detection response: {response_text[:200]}...")
+                    logger.debug("📝 AI detection response: %.200s...", response_text)
                     break  # Success, exit retry loop
                     
+                except DeadlineExceeded:
+                    raise
                 except Exception as e:
                     error_msg = str(e)
                     
@@ -278,49 +540,40 @@ Respond ONLY with valid JSON, no additional text."""
                     elif attempt == max_retries:
                         raise Exception(f"AI detection failed after {max_retries + 1} attempts: {error_msg}")
                     else:
-                        print(f"⚠️  Error occurred, retrying... (attempt {attempt + 1}/{max_retries + 1})")
-                        time.sleep(retry_delay)
+                        logger.warning("⚠️  Error occurred, retrying... (attempt %d/%d): %s", attempt + 1, max_retries + 1, error_msg)
+                        check_deadline("retry_sleep", retry_delay + self._expected_call_seconds())
+                        record_retry("ai_detection", "error")
+                        with stage("retry_sleep"):
+                            time.sleep(retry_delay)
                         retry_delay *= 2
                         continue
             
             if not response_text:
                 raise Exception("Failed to get AI detection response from Gemini AI")
             
-            # Parse response
-            text = response_text.strip()
-            
-            # Remove markdown code blocks if present
-            if text.startswith("```json"):
-                text = text[7:]
-            elif text.startswith("```"):
-                text = text[3:]
-            
-            if text.endswith("```"):
-                text = text[:-3]
-            
-            text = text.strip()
-            
-            # Parse JSON
-            data = json.loads(text)
+            # Parse response (structured output is bare JSON; text mode may be fenced)
+            try:
+                data = json.loads(self.strip_code_fences(response_text))
+            except json.JSONDecodeError:
+                record_parse("ai_detection", self.output_mode, "invalid_json")
+                raise
             
             # Validate response
             if "isAiGenerated" not in data:
+                record_parse("ai_detection", self.output_mode, "missing_field")
                 raise ValueError("Invalid AI detection response: missing isAiGenerated field")
+            record_parse("ai_detection", self.output_mode, "ok")
             
             is_ai_generated = bool(data["isAiGenerated"])
             confidence = float(data.get("confidence", 0.5))
             reason = data.get("reason", "")
             
-            print(f"🔍 AI Detection Result: isAiGenerated={is_ai_generated}, confidence={confidence:.2f}")
+            logger.info("🔍 AI Detection Result: isAiGenerated=%s, confidence=%.2f", is_ai_generated, confidence)
             if reason:
-                print(f"   Reason: {reason}")
+                logger.debug("   Reason: %s", reason)
             
             # If AI-generated with high confidence, raise error
-            if is_ai_generated and confidence >= 0.7:
-                error_msg = "This image appears to be AI-generated or synthetic. Please upload a real photograph of food."
-                if reason:
-                    error_msg += f" ({reason})"
-                raise ValueError(error_msg)
+            self.enforce_ai_detection(is_ai_generated, confidence, reason)
             
             return {
                 "isAiGenerated": is_ai_generated,
@@ -328,20 +581,56 @@ Respond ONLY with valid JSON, no additional text."""
                 "reason": reason
             }
             
-        except ValueError:
-            # Re-raise validation errors (AI-generated detected)
+        except (ValueError, DeadlineExceeded):
+            # Re-raise validation errors (AI-generated detected) and abandoned requests
             raise
         except Exception as e:
-            print(f"⚠️  Error in AI detection: {e}")
+            logger.warning("⚠️  Error in AI detection: %s", e)
             # If detection fails, log but don't block (fail open for now)
             # In production, you might want to fail closed
-            print("⚠️  AI detection failed, proceeding with food analysis...")
+            logger.warning("⚠️  AI detection failed, proceeding with food analysis...")
             return {
                 "isAiGenerated": False,
                 "confidence": 0.0,
                 "reason": "Detection failed"
             }
     
+    def enforce_ai_detection(self, is_ai_generated: bool, confidence: float, reason: str = "") -> None:
+        """
+        Reject images flagged as AI-generated with high confidence
+        
+        Raises:
+            ValueError: If confidence reaches AI_GENERATED_THRESHOLD
+        """
+        if is_ai_generated and confidence >= self.AI_GENERATED_THRESHOLD:
+            error_msg = "This image appears to be AI-generated or synthetic. Please upload a real photograph of food."
+            if reason:
+                error_msg += f" ({reason})"
+            raise ValueError(error_msg)
+    
+    def create_combined_prompt(self) -> str:
+        """
+        Create single-pass prompt: AI-generated detection and food analysis in one call
+        
+        Returns:
+            Prompt string
+        """
+        authenticity_check = """AUTHENTICITY CHECK (always do this first):
+Determine if this image is AI-generated, synthetic, or computer-generated. Look for unrealistic textures or artifacts, characteristics of AI art generators (DALL-E, Midjourney, Stable Diffusion, etc.), unnatural lighting, shadows or reflections, repetitive patterns, or overly perfect food presentation.
+"""
+        if self.structured_output:
+            return authenticity_check + """Report the result in aiDetection, with a brief reason if AI-generated.
+If the image appears to be a real photograph, set isAiGenerated to false.
+
+""" + self.create_analysis_prompt()
+        return authenticity_check + """Report the result in an "aiDetection" object that MUST be present in every response, including error responses:
+"aiDetection": {"isAiGenerated": true or false, "confidence": <0.0 to 1.0>, "reason": "brief explanation if AI-generated"}
+If the image appears to be a real photograph, set isAiGenerated to false.
+
+""" + self.create_analysis_prompt() + """
+
+The JSON object MUST also contain the "aiDetection" object described above."""
+    
     def create_analysis_prompt(self) -> str:
         """
         Create structured prompt for Gemini to analyze food images
@@ -349,7 +638,7 @@ Respond ONLY with valid JSON, no additional text."""
         Returns:
             Prompt string
         """
-        return """You are an expert food recognition system. Analyze this food image carefully and provide accurate, specific food identification.
+        instructions = """You are an expert food recognition system. Analyze this food image carefully and provide accurate, specific food identification.
 
 CRITICAL INSTRUCTIONS FOR FOOD NAME IDENTIFICATION:
 1. Look at the image VERY CAREFULLY and identify EXACTLY what food items are visible
@@ -375,7 +664,33 @@ EXPIRY DATE DETECTION (for packed products only):
 - If you can clearly read the expiry date, return it as ISO date string (YYYY-MM-DD format)
 - If expiry date is not visible or unclear, set expiryDateFromPackage to null
 
-VALIDATION RULES:
+"""
+        examples = """EXAMPLES OF CORRECT itemName:
+- ✅ "Chappati" (if you see round flatbread)
+- ✅ "Rice and Dal Curry" (if you see rice with dal)
+- ✅ "Vegetable Biryani" (if you see biryani with vegetables)
+- ✅ "Dosa with Sambar" (if you see dosa and sambar)
+- ✅ "Samosa" (if you see samosa)
+- ❌ "Food Item" (WRONG - too generic)
+- ❌ "Cooked Meal" (WRONG - too generic)
+- ❌ "Indian Food" (WRONG - too generic)
+
+Remember: itemName MUST be the specific, actual name of the food you see. Look carefully at the image and identify the exact food item(s)."""
+        if self.structured_output:
+            # Field names, types and allowed values come from the response schema
+            return instructions + """VALIDATION RULES:
+- If the image contains ANY NON-FOOD items (cleaning products, medicines, electronics, etc.), set error to "This image does not contain food items. Please upload an image of food only." (other fields may hold placeholders)
+- Otherwise leave error null and analyze the FOOD items
+
+FIELDS:
+- itemName: EXACT SPECIFIC FOOD NAME, e.g. 'Chappati', 'Rice and Dal Curry', 'Vegetable Biryani', 'Dosa with Sambar'
+- quantity: number of servings/plates/items you can count
+- qualityScore: 0.0 to 1.0 - assess visual quality
+- confidence: 0.0 to 1.0 - your confidence in the identification
+- detectedItems: specific food items you can see, e.g. "chappati", "dal", "rice"
+
+""" + examples
+        return instructions + """VALIDATION RULES:
 - If the image contains ANY NON-FOOD items (cleaning products, medicines, electronics, etc.), respond with: {"error": "This image does not contain food items. Please upload an image of food only."}
 - ONLY proceed with analysis if the image contains FOOD items
 
@@ -393,50 +708,58 @@ Return a JSON object with this EXACT structure:
     "expiryDateFromPackage": <ISO date string or null - only if productType is "packed" and you can clearly read expiry date from package label>
 }
 
-EXAMPLES OF CORRECT itemName:
-- ✅ "Chappati" (if you see round flatbread)
-- ✅ "Rice and Dal Curry" (if you see rice with dal)
-- ✅ "Vegetable Biryani" (if you see biryani with vegetables)
-- ✅ "Dosa with Sambar" (if you see dosa and sambar)
-- ✅ "Samosa" (if you see samosa)
-- ❌ "Food Item" (WRONG - too generic)
-- ❌ "Cooked Meal" (WRONG - too generic)
-- ❌ "Indian Food" (WRONG - too generic)
-
-Remember: itemName MUST be the specific, actual name of the food you see. Look carefully at the image and identify the exact food item(s).
+""" + examples + """
 
 Respond ONLY with valid JSON, no additional text or explanations."""
     
-    def parse_gemini_response(self, response_text: str) -> Dict:
+    @staticmethod
+    def strip_code_fences(response_text: str) -> str:
+        """Remove ```json / ``` markdown fences around a JSON response"""
+        text = response_text.strip()
+        
+        # Remove ```json and ``` if present
+        if text.startswith("```json"):
+            text = text[7:]
+        elif text.startswith("```"):
+            text = text[3:]
+        
+        if text.endswith("```"):
+            text = text[:-3]
+        
+        return text.strip()
+    
+    def parse_gemini_response(self, response_text: str, check_ai_detection: bool = False,
+                              call: str = "analysis") -> Dict:
         """
         Parse Gemini's response and extract food analysis
         
         Args:
             response_text: Raw response from Gemini
+            check_ai_detection: Enforce the "aiDetection" result of a single-pass response
+            call: Label for the parse outcome metric ("analysis" or "batch_item")
             
         Returns:
             Dictionary with food analysis
         """
         try:
             # Clean the response - remove markdown code blocks if present
-            text = response_text.strip()
-            
-            # Remove ```json and ``` if present
-            if text.startswith("```json"):
-                text = text[7:]
-            elif text.startswith("```"):
-                text = text[3:]
-            
-            if text.endswith("```"):
-                text = text[:-3]
-            
-            text = text.strip()
+            text = self.strip_code_fences(response_text)
             
             # Parse JSON
             data = json.loads(text)
             
-            # Check for error (non-food items detected)
-            if "error" in data:
+            required_fields = ["foodCategory", "itemName", "quantity", "qualityScore", 
+                            "freshness", "storageRecommendation", "confidence", "detectedItems", "productType"]
+            # Error replies (non-food) legitimately carry no analysis fields
+            incomplete = not data.get("error") and any(field not in data for field in required_fields)
+            record_parse(call, self.output_mode, "missing_field" if incomplete else "ok")
+            
+            # Single-pass mode: AI-generated rejection takes precedence over other errors
+            if check_ai_detection:
+                self._check_combined_ai_detection(data.pop("aiDetection", None))
+            
+            # Check for error (non-food items detected); the response schema always has the key, null when fine
+            if data.get("error"):
                 error_msg = data["error"]
                 # Make error message more user-friendly
                 if "non-food" in error_msg.lower() or "does not contain food" in error_msg.lower():
@@ -445,12 +768,10 @@ Respond ONLY with valid JSON, no additional text or explanations."""
                     raise ValueError(error_msg)
             
             # Validate required fields
-            required_fields = ["foodCategory", "itemName", "quantity", "qualityScore", 
-                            "freshness", "storageRecommendation", "confidence", "detectedItems", "productType"]
-            
             for field in required_fields:
                 if field not in data:
                     raise ValueError(f"Missing required field: {field}")
+            data.pop("error", None)
             
             # Validate productType
             if data.get("productType") not in ["cooked", "packed"]:
@@ -471,22 +792,363 @@ Respond ONLY with valid JSON, no additional text or explanations."""
                         pass  # None is valid
                     else:
                         # Invalid type, set to None
-                        print(f"⚠️  expiryDateFromPackage has invalid type: {type(data['expiryDateFromPackage'])}")
+                        logger.warning("⚠️  expiryDateFromPackage has invalid type: %s", type(data["expiryDateFromPackage"]))
                         data["expiryDateFromPackage"] = None
                 except Exception as e:
-                    print(f"⚠️  Could not validate expiryDateFromPackage: {e}")
+                    logger.warning("⚠️  Could not validate expiryDateFromPackage: %s", e)
                     data["expiryDateFromPackage"] = None
             
             return data
             
         except json.JSONDecodeError as e:
-            print(f"⚠️  Error parsing Gemini response as JSON: {e}")
-            print(f"Response text: {response_text[:500]}")
+            record_parse(call, self.output_mode, "invalid_json")
+            logger.warning("⚠️  Error parsing Gemini response as JSON: %s", e)
+            logger.debug("Response text: %.500s", response_text)
             raise ValueError("Invalid JSON response from Gemini AI")
         except Exception as e:
-            print(f"⚠️  Error processing Gemini response: {e}")
+            logger.warning("⚠️  Error processing Gemini response: %s", e)
             raise
     
+    def _check_combined_ai_detection(self, detection) -> None:
+        """Validate and enforce the aiDetection object from a single-pass response"""
+        if not isinstance(detection, dict) or "isAiGenerated" not in detection:
+            # Same fail-open behavior as a failed two-pass detection call
+            logger.warning("⚠️  Response has no aiDetection result, proceeding with food analysis...")
+            return
+        is_ai_generated = bool(detection["isAiGenerated"])
+        try:
+            confidence = float(detection.get("confidence", 0.5))
+        except (TypeError, ValueError):
+            confidence = 0.5
+        reason = detection.get("reason") or ""
+        logger.info("🔍 AI Detection Result: isAiGenerated=%s, confidence=%.2f", is_ai_generated, confidence)
+        if reason:
+            logger.debug("   Reason: %s", reason)
+        self.enforce_ai_detection(is_ai_generated, confidence, reason)
+    
+    def _run_ai_detection(self, image: Union[Image.Image, Dict]) -> None:
+        """Two-pass mode: separate AI-generated check before food analysis"""
+        # Check if image is AI-generated (before food analysis)
+        # Skip if rate limited to save API quota for food analysis
+        try:
+            with stage("ai_detection"):
+                ai_detection_result = self.detect_ai_generated_image(image)
+            if ai_detection_result.get("isAiGenerated", False) and ai_detection_result.get("confidence", 0) >= self.AI_GENERATED_THRESHOLD:
+                # This should have raised ValueError, but handle it just in case
+                raise ValueError("This image appears to be AI-generated or synthetic. Please upload a real photograph of food.")
+        except ValueError as ve:
+            # Re-raise AI-generated image errors
+            raise ve
+        except DeadlineExceeded:
+            # No time left for the analysis either
+            raise
+        except Exception as e:
+            error_msg = str(e)
+            # If it's a rate limit/quota error, skip AI detection to save API calls
+            if "quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg:
+                logger.warning("⚠️  Rate limit detected during AI detection, skipping to save API quota for food analysis...")
+            else:
+                # If detection fails for other reasons, log but continue (fail open)
+                logger.warning("⚠️  AI detection encountered an error, proceeding with food analysis: %s", e)
+    
+    def generation_config(self, schema: str, base: Optional[Dict] = None) -> Dict:
+        """
+        Generation config for one call, with the response schema in structured mode
+        
+        Args:
+            schema: Key of RESPONSE_SCHEMAS describing the expected JSON
+            base: Sampling settings (default ANALYSIS_GENERATION_CONFIG)
+        """
+        config = dict(base or self.ANALYSIS_GENERATION_CONFIG)
+        if self.structured_output:
+            config["response_mime_type"] = "application/json"
+            config["response_schema"] = self.RESPONSE_SCHEMAS[schema]
+        return config
+    
+    def call_model(self, contents: list, generation_config: Dict, hedge: bool = False):
+        """
+        Single generate_content call, routed through the model pool
+        
+        Models are tried in preference order, skipping those whose circuit
+        breaker is open or whose daily quota is spent. Rate limits and server
+        errors fail over to the next model within the same call; only the
+        last model waits in the quota scheduler's queue.
+        
+        With a request deadline, a model is only called if its average latency
+        fits in the time left, the quota wait is capped so the call can still
+        finish, and the API request itself times out at the deadline.
+        
+        Args:
+            contents: Prompt and image parts for generate_content
+            generation_config: Generation settings (and response schema)
+            hedge: Race a slow call against the next model when hedging is enabled
+        
+        Raises:
+            QuotaExceeded: If no model could take the call (shed by the scheduler or all breakers open)
+            DeadlineExceeded: If the call cannot finish before the request deadline
+        """
+        if hedge and self.hedging:
+            return self._call_hedged(contents, generation_config)
+        return self._call_pool(contents, generation_config, self.pool.candidates())
+    
+    def _call_pool(self, contents: list, generation_config: Dict, candidates: List[PoolMember],
+                   leg: Optional[HedgeLeg] = None):
+        """call_model() over the given members, or as one leg of a hedged call (a hedge never queues for quota)"""
+        last_error = None
+        deadline = current_deadline()
+        hedge = leg is not None and leg.is_hedge
+        for position, member in enumerate(candidates):
+            expected = member.avg_latency or 0.0
+            if deadline:
+                # Also stops a hedged call's losing leg before its next attempt
+                deadline.check("gemini_call", expected)
+            if leg is not None and member in leg.excluded:
+                continue
+            permit = member.breaker.try_acquire()
+            if permit is None:
+                continue
+            if self.scheduler:
+                # Fall through to the next model instead of queueing behind this one
+                max_wait = None if position == len(candidates) - 1 and not hedge else 0
+                remaining = deadline.remaining() if deadline else None
+                # Queue only as long as the call can still finish afterwards
+                capped = (max_wait is None and remaining is not None
+                          and remaining - expected < self.scheduler.max_wait_seconds)
+                if capped:
+                    max_wait = max(0.0, remaining - expected)
+                try:
+                    with stage("quota_wait"):
+                        self.scheduler.acquire(member.name, PRIORITY_PREDICT, max_wait=max_wait)
+                except QuotaExceeded as e:
+                    member.breaker.release(permit)
+                    if capped:
+                        raise deadline.exceeded("quota_wait", f"Request deadline would be missed waiting for "
+                                                              f"{member.name} quota: {e}") from e
+                    last_error = e
+                    continue
+                if deadline and deadline.cancel_reason is not None:
+                    member.breaker.release(permit)
+                    deadline.check("gemini_call")
+            if member is not self.pool.primary and not hedge:
+                logger.info("🔀 Failing over to %s", member.name)
+            request_options = {}
+            remaining = deadline.remaining() if deadline else None
+            if remaining is not None:
+                request_options["timeout"] = max(0.1, remaining)
+            if leg is not None and not leg.mark_sent():
+                # Cancelled since the last check: send nothing, so an unsent hedge is refunded
+                member.breaker.release(permit)
+                deadline.check("gemini_call")
+            start = time.perf_counter()
+            try:
+                # Use google.generativeai API (deprecated but still functional)
+                with stage("gemini"):
+                    response = member.model.generate_content(contents, generation_config=generation_config,
+                                                             request_options=request_options)
+            except Exception as e:
+                remaining = deadline.remaining() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    # Timed out by our own deadline: not a sign of an unhealthy model
+                    member.breaker.release(permit)
+                    raise deadline.exceeded("gemini_call", f"Request deadline passed during the {member.name} call") from e
+                retry_after = self._record_rate_limited(member.name, e) if is_rate_limit_error(e) else None
+                self.pool.record_failure(member, permit, e, time.perf_counter() - start, retry_after)
+                if isinstance(e, REQUEST_ERRORS):
+                    raise
+                logger.warning("⚠️  %s call failed: %.200s", member.name, e)
+                last_error = e
+                continue
+            self.pool.record_success(member, permit, time.perf_counter() - start)
+            usage = getattr(response, "usage_metadata", None)
+            if usage:
+                record_tokens(member.name, usage.prompt_token_count, usage.candidates_token_count)
+            return response
+        raise last_error or self.pool.unavailable_error()
+    
+    def _call_hedged(self, contents: list, generation_config: Dict):
+        """
+        call_model() racing a second model when the first is slower than usual
+        
+        The pool call runs as the primary leg in a hedge thread. If it has not
+        returned after the hedge delay (a percentile of the preferred model's
+        recent latencies, counted from when the call started) and the hedge
+        budget allows, the next available model gets the same request as the
+        hedge leg, without queueing for quota, and the primary leg stops
+        failing over to that model. The first response that parses as JSON
+        wins and the other leg is cancelled.
+        """
+        candidates = self.pool.candidates()
+        self.hedging.record_call()
+        delay = self.hedging.delay(self.pool.latencies(candidates[0])) if len(candidates) > 1 else None
+        if delay is None:
+            return self._call_pool(contents, generation_config, candidates)
+        
+        primary = self.hedging.start(lambda leg: self._call_pool(contents, generation_config, candidates, leg))
+        if primary.finished_within(delay):
+            return primary.result()
+        remaining = remaining_seconds()
+        alternate = next((m for m in candidates[1:] if m.breaker.state != OPEN
+                          and (remaining is None or remaining > (m.avg_latency or 0.0))), None)
+        if alternate is None or not self.hedging.try_spend():
+            return primary.result()
+        logger.info("🏁 No answer from %s after %.1fs (p%g), hedging with %s",
+                    candidates[0].name, delay, self.hedging.percentile, alternate.name)
+        primary.excluded.add(alternate)
+        hedged = self.hedging.start(
+            lambda leg: self._call_pool(contents, generation_config, [alternate], leg), is_hedge=True
+        )
+        
+        legs = {primary.future: (primary, OUTCOME_PRIMARY_WON), hedged.future: (hedged, OUTCOME_HEDGE_WON)}
+        errors = {}
+        fallback = None
+        while legs:
+            done, _ = wait(legs, return_when=FIRST_COMPLETED)
+            for future in done:
+                leg, outcome = legs.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    if leg is hedged and not hedged.sent:
+                        # The alternate could not take the call (breaker, quota or deadline): no hedge was sent
+                        self.hedging.refund()
+                        primary.excluded.discard(alternate)
+                        return primary.result()
+                    errors[outcome] = e
+                    continue
+                if self._is_valid_response(response):
+                    for other, _ in legs.values():
+                        if other.cancel() and other is hedged:
+                            # The primary answered before the hedge went out
+                            self.hedging.refund()
+                    self.hedging.record(outcome)
+                    if outcome == OUTCOME_HEDGE_WON:
+                        logger.info("🏁 Hedged call to %s answered first", alternate.name)
+                    return response
+                if fallback is None:
+                    fallback = response
+        self.hedging.record(OUTCOME_BOTH_FAILED)
+        if fallback is not None:
+            # Neither answer parses: let the caller's parser report the first one
+            return fallback
+        raise errors.get(OUTCOME_PRIMARY_WON) or errors[OUTCOME_HEDGE_WON]
+    
+    def _is_valid_response(self, response) -> bool:
+        """True when the response text parses as a JSON object"""
+        try:
+            return isinstance(json.loads(self.strip_code_fences(response.text or "")), dict)
+        except (ValueError, AttributeError):
+            return False
+    
+    def _record_rate_limited(self, model_name: str, error: Exception) -> Optional[float]:
+        """
+        Tell the scheduler about a 429 so queued calls back off instead of hitting it too
+        
+        Returns:
+            Retry delay suggested by the API, if any
+        """
+        match = re.search(r'retry in ([\d.]+)s', str(error), re.IGNORECASE)
+        retry_after = float(match.group(1)) if match else None
+        if self.scheduler:
+            self.scheduler.record_rate_limited(model_name, retry_after)
+        return retry_after
+    
+    def _expected_call_seconds(self) -> float:
+        """Average latency of the preferred model (0 before its first call)"""
+        return self.pool.primary.avg_latency or 0.0
+    
+    def generate_with_retry(self, contents: list, generation_config: Optional[Dict] = None,
+                            hedge: bool = False) -> str:
+        """
+        Call Gemini with the analysis retry policy
+        
+        Retries transient errors with exponential backoff and waits out rate
+        limits using the delay suggested by the API. A retry whose wait plus
+        expected call time would overrun the request deadline is not attempted.
+        
+        Args:
+            contents: Prompt and image parts for generate_content
+            generation_config: Overrides ANALYSIS_GENERATION_CONFIG
+            hedge: Hedge slow calls (see call_model)
+        
+        Returns:
+            Response text
+        """
+        max_retries = 2
+        retry_delay = 1
+        response_text = None
+        
+        for attempt in range(max_retries + 1):
+            try:
+                logger.debug("🔄 Attempt %d/%d: Calling Gemini API...", attempt + 1, max_retries + 1)
+                api_start_time = time.time()
+                
+                response = self.call_model(contents, generation_config or self.ANALYSIS_GENERATION_CONFIG, hedge=hedge)
+                
+                api_elapsed = time.time() - api_start_time
+                logger.debug("⏱️  Gemini API call took %.2f seconds", api_elapsed)
+                
+                # Get response text
+                if not response.text:
+                    raise Exception("Empty response from Gemini AI")
+                
+                response_text = response.text
+                logger.debug("📝 Gemini response received: %.200s...", response_text)
+                break  # Success, exit retry loop
+            
+            except (QuotaExceeded, DeadlineExceeded):
+                # Shed locally by the scheduler, or out of time: waiting and retrying would not help
+                raise
+            except Exception as e:
+                error_msg = str(e)
+                
+                # Handle specific Gemini API errors
+                if "API_KEY" in error_msg or "api key" in error_msg.lower():
+                    raise Exception("Invalid or missing Gemini API key. Please check your GEMINI_API_KEY environment variable.")
+                elif "safety" in error_msg.lower() or "blocked" in error_msg.lower():
+                    raise ValueError("Image was blocked by safety filters. Please ensure the image contains appropriate content.")
+                elif ("quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg) and attempt < max_retries:
+                    # Parse retry delay from error message if available
+                    retry_delay_seconds = retry_delay
+                    retry_delay_match = re.search(r'retry in ([\d.]+)s', error_msg, re.IGNORECASE)
+                    if retry_delay_match:
+                        try:
+                            retry_delay_seconds = float(retry_delay_match.group(1))
+                            # Add a small buffer (10% extra)
+                            retry_delay_seconds = retry_delay_seconds * 1.1
+                            logger.warning("⚠️  Rate limit hit. API suggests retry in %.1f seconds...", retry_delay_seconds)
+                        except ValueError:
+                            pass
+                    
+                    # Use exponential backoff with minimum delay
+                    actual_delay = max(retry_delay_seconds, retry_delay)
+                    check_deadline("retry_sleep", actual_delay + self._expected_call_seconds())
+                    logger.warning("⚠️  Waiting %.1f seconds before retry (attempt %d/%d)...", actual_delay, attempt + 1, max_retries + 1)
+                    record_retry("analysis", "rate_limit")
+                    with stage("retry_sleep"):
+                        time.sleep(actual_delay)
+                    retry_delay *= 2  # Exponential backoff for next attempt
+                    continue
+                elif attempt == max_retries:
+                    # Final attempt failed - provide user-friendly error message
+                    if "quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg:
+                        raise Exception("Gemini API rate limit exceeded. You have reached your daily quota. Please try again later or upgrade your API plan. For more information, visit: https://ai.google.dev/gemini-api/docs/rate-limits")
+                    else:
+                        raise Exception(f"Gemini API error after {max_retries + 1} attempts: {error_msg}")
+                else:
+                    # Other errors, retry
+                    logger.warning("⚠️  Error occurred, retrying... (attempt %d/%d): %s", attempt + 1, max_retries + 1, error_msg)
+                    check_deadline("retry_sleep", retry_delay + self._expected_call_seconds())
+                    record_retry("analysis", "error")
+                    with stage("retry_sleep"):
+                        time.sleep(retry_delay)
+                    retry_delay *= 2
+                    continue
+        
+        if not response_text:
+            raise Exception("Failed to get response from Gemini AI after retries")
+        
+        return response_text
+    
     def analyze_image(self, image_url: str) -> Dict:
         """
         Analyze food image using Gemini Vision API
@@ -497,134 +1159,368 @@ Respond ONLY with valid JSON, no additional text or explanations."""
         Returns:
             Dictionary with food analysis results
         """
+        if self.cache:
+            cached = self.cache.get_by_url(image_url)
+            if cached is not None:
+                logger.info("⚡ Prediction cache hit (url): %s", image_url)
+                return cached
+        
         try:
-            print(f"🔍 Downloading image from: {image_url}")
+            logger.debug("🔍 Downloading image from: %s", image_url)
             
             # Download image
-            image = self.download_image(image_url)
-            print("✅ Image downloaded successfully")
-            
-            # First, check if image is AI-generated (before food analysis)
-            # Skip if rate limited to save API quota for food analysis
-            try:
-                ai_detection_result = self.detect_ai_generated_image(image)
-                if ai_detection_result.get("isAiGenerated", False) and ai_detection_result.get("confidence", 0) >= 0.7:
-                    # This should have raised ValueError, but handle it just in case
-                    raise ValueError("This image appears to be AI-generated or synthetic. Please upload a real photograph of food.")
-            except ValueError as ve:
-                # Re-raise AI-generated image errors
-                raise ve
-            except Exception as e:
-                error_msg = str(e)
-                # If it's a rate limit/quota error, skip AI detection to save API calls
-                if "quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg:
-                    print("⚠️  Rate limit detected during AI detection, skipping to save API quota for food analysis...")
-                else:
-                    # If detection fails for other reasons, log but continue (fail open)
-                    print(f"⚠️  AI detection encountered an error, proceeding with food analysis: {e}")
-            
-            # Create prompt
-            prompt = self.create_analysis_prompt()
-            
-            print("🤖 Sending image to Gemini AI for analysis...")
+            image_bytes = self.download_image_bytes(image_url)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.error("❌ Error analyzing image with Gemini: %s", e)
+            raise Exception(f"Failed to analyze image: {str(e)}")
+        
+        return self.analyze_image_bytes(image_bytes, image_url=image_url)
+    
+    def analyze_image_bytes(self, image_bytes: bytes, image_url: Optional[str] = None) -> Dict:
+        """
+        Analyze already-downloaded image bytes using Gemini Vision API
+        
+        Args:
+            image_bytes: Image file contents
+            image_url: Source URL, if any (linked to the content hash in the cache)
             
-            # Call Gemini Vision API with retry logic
-            max_retries = 2
-            retry_delay = 1
-            response_text = None
+        Returns:
+            Dictionary with food analysis results
+        """
+        image_hash = hash_image_bytes(image_bytes) if self.cache or self.perceptual_index else None
+        decoded = self._decode_for_lookup(image_bytes)
+        previous, phash, duplicate = self.find_previous_analysis(decoded, image_hash, image_url)
+        if previous is not None:
+            return previous
+        
+        try:
+            image, image_quality = self.prepare_and_screen(image_bytes, decoded)
+        except ValueError as e:
+            logger.info("❌ Validation error: %s", e)
+            raise
+        except Exception as e:
+            logger.exception("❌ Error analyzing image with Gemini: %s", e)
+            raise Exception(f"Failed to analyze image: {str(e)}")
+        return self.analyze_prepared_image(image, image_hash, image_url, phash, duplicate, image_quality)
+    
+    def analyze_prepared_image(self, image: Union[Image.Image, Dict], image_hash: Optional[str],
+                               image_url: Optional[str], phash: Optional[int], duplicate: Optional[Dict],
+                               image_quality: Optional[Dict]) -> Dict:
+        """
+        Analyze an image that was already looked up, prepared and pre-screened
+        
+        Args:
+            image: Image part from prepare_and_screen()
+            image_hash: hash_image_bytes() of the contents (None without cache and index)
+            image_url: Source URL, if any
+            phash: Perceptual hash to index after the analysis, or None
+            duplicate: duplicateOf flag for the result, or None
+            image_quality: imageQuality flags from the pre-screen, or None
             
-            for attempt in range(max_retries + 1):
-                try:
-                    print(f"🔄 Attempt {attempt + 1}/{max_retries + 1}: Calling Gemini API...")
-                    api_start_time = time.time()
-                    
-                    # Use google.generativeai API (deprecated but still functional)
-                    # Set generation config for more accurate food identification
-                    # Lower temperature for more consistent and accurate results
-                    generation_config = {
-                        "temperature": 0.2,  # Lower temperature for more accurate food name identification
-                        "max_output_tokens": 2048,
-                        "top_p": 0.8,  # Focus on most likely food names
-                        "top_k": 40,  # Limit to top 40 most relevant tokens
-                    }
-                    response = self.model.generate_content(
-                        [prompt, image],
-                        generation_config=generation_config
-                    )
-                    
-                    api_elapsed = time.time() - api_start_time
-                    print(f"⏱️  Gemini API call took {api_elapsed:.2f} seconds")
-                    
-                    # Get response text
-                    if not response.text:
-                        raise Exception("Empty response from Gemini AI")
-                    
-                    response_text = response.text
-                    print(f"📝 Gemini response received: {response_text[:200]}...")
-                    break  # Success, exit retry loop
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    
-                    # Handle specific Gemini API errors
-                    if "API_KEY" in error_msg or "api key" in error_msg.lower():
-                        raise Exception("Invalid or missing Gemini API key. Please check your GEMINI_API_KEY environment variable.")
-                    elif "safety" in error_msg.lower() or "blocked" in error_msg.lower():
-                        raise ValueError("Image was blocked by safety filters. Please ensure the image contains appropriate content.")
-                    elif ("quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg) and attempt < max_retries:
-                        # Parse retry delay from error message if available
-                        retry_delay_seconds = retry_delay
-                        retry_delay_match = re.search(r'retry in ([\d.]+)s', error_msg, re.IGNORECASE)
-                        if retry_delay_match:
-                            try:
-                                retry_delay_seconds = float(retry_delay_match.group(1))
-                                # Add a small buffer (10% extra)
-                                retry_delay_seconds = retry_delay_seconds * 1.1
-                                print(f"⚠️  Rate limit hit. API suggests retry in {retry_delay_seconds:.1f} seconds...")
-                            except ValueError:
-                                pass
-                        
-                        # Use exponential backoff with minimum delay
-                        actual_delay = max(retry_delay_seconds, retry_delay)
-                        print(f"⚠️  Waiting {actual_delay:.1f} seconds before retry (attempt {attempt + 1}/{max_retries + 1})...")
-                        time.sleep(actual_delay)
-                        retry_delay *= 2  # Exponential backoff for next attempt
-                        continue
-                    elif attempt == max_retries:
-                        # Final attempt failed - provide user-friendly error message
-                        if "quota" in error_msg.lower() or "rate limit" in error_msg.lower() or "429" in error_msg:
-                            raise Exception("Gemini API rate limit exceeded. You have reached your daily quota. Please try again later or upgrade your API plan. For more information, visit: https://ai.google.dev/gemini-api/docs/rate-limits")
-                        else:
-                            raise Exception(f"Gemini API error after {max_retries + 1} attempts: {error_msg}")
-                    else:
-                        # Other errors, retry
-                        print(f"⚠️  Error occurred, retrying... (attempt {attempt + 1}/{max_retries + 1})")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                        continue
+        Returns:
+            Dictionary with food analysis results
+        """
+        try:
+            single_pass = self.analysis_mode == "single"
+            if single_pass:
+                # One round trip: AI detection is part of the analysis response
+                prompt = self.create_combined_prompt()
+            else:
+                self._run_ai_detection(image)
+                prompt = self.create_analysis_prompt()
             
-            if not response_text:
-                raise Exception("Failed to get response from Gemini AI after retries")
+            logger.debug("🤖 Sending image to Gemini AI for analysis...")
+            with stage("analysis"):
+                response_text = self.generate_with_retry(
+                    [prompt, image], self.generation_config("combined" if single_pass else "analysis"), hedge=True
+                )
             
             # Parse response
-            analysis = self.parse_gemini_response(response_text)
+            with stage("parse"):
+                analysis = self.parse_gemini_response(response_text, check_ai_detection=single_pass)
             
-            print(f"✅ Analysis complete:")
-            print(f"   - Item: {analysis['itemName']}")
-            print(f"   - Category: {analysis['foodCategory']}")
-            print(f"   - Quantity: {analysis['quantity']}")
-            print(f"   - Freshness: {analysis['freshness']}")
-            print(f"   - Confidence: {analysis['confidence']}")
+            logger.info(
+                "✅ Analysis complete: item=%s, category=%s, quantity=%s, freshness=%s, confidence=%s",
+                analysis["itemName"], analysis["foodCategory"], analysis["quantity"],
+                analysis["freshness"], analysis["confidence"],
+            )
+            if image_quality:
+                analysis["imageQuality"] = image_quality
             
-            return analysis
+            return self.remember_analysis(image_hash, analysis, image_url, phash, duplicate)
             
         except ValueError as e:
             # Re-raise validation errors (non-food items, etc.)
             error_msg = str(e)
-            print(f"❌ Validation error: {error_msg}")
+            logger.info("❌ Validation error: %s", error_msg)
             raise ValueError(error_msg)
+        except DeadlineExceeded as e:
+            logger.debug("⏱️  Analysis abandoned: %s", e)
+            raise
         except Exception as e:
-            print(f"❌ Error analyzing image with Gemini: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Error analyzing image with Gemini: %s", e)
             raise Exception(f"Failed to analyze image: {str(e)}")
+    
+    def _decode_for_lookup(self, data: bytes) -> Optional[DecodedImage]:
+        """decode_upload() ahead of the duplicate lookup when the perceptual index needs the pixels"""
+        if not self.perceptual_index:
+            return None
+        try:
+            return self.decode_upload(data)
+        except Exception:
+            # Left to prepare_and_screen(), which reports undecodable images
+            return None
+    
+    def find_previous_analysis(self, decoded: Optional[DecodedImage], image_hash: Optional[str],
+                               image_url: Optional[str]) -> Tuple[Optional[Dict], Optional[int], Optional[Dict]]:
+        """
+        Look for an earlier analysis of this image: same bytes first, then perceptual near-duplicates
+        
+        An image matching an earlier one from a different URL (or an upload)
+        is flagged with duplicateOf, whether or not its prediction is reused.
+        
+        Args:
+            decoded: decode_upload() of the image, hashed for the perceptual index (None without one)
+            image_hash: hash_image_bytes() of the contents (None without cache and index)
+            image_url: Source URL, if any
+            
+        Returns:
+            (prediction to return instead of calling Gemini, or None;
+             perceptual hash to index after a fresh analysis, or None;
+             duplicateOf flag for the result, or None)
+        """
+        phash, match = None, None
+        if self.perceptual_index and decoded is not None:
+            with stage("phash"):
+                phash = perceptual_hash_image(decoded.image)
+                match = self.perceptual_index.lookup(phash) if phash is not None else None
+        duplicate = None
+        if match is not None and not (image_url and match.image_url == image_url):
+            duplicate = match.as_flag()
+        
+        if self.cache:
+            cached = self.cache.get(image_hash, image_url=image_url)
+            if cached is not None:
+                logger.info("⚡ Prediction cache hit (content hash %.12s)", image_hash)
+                return self._flag_duplicate(cached, duplicate), None, duplicate
+            if match is not None and match.image_hash != image_hash:
+                cached = self.cache.get(match.image_hash)
+                if cached is not None:
+                    logger.info("♻️  Near-duplicate of an analyzed image (distance %d), reusing its prediction",
+                                match.distance)
+                    self.perceptual_index.record_reuse()
+                    record_calls_saved("duplicate", 1 if self.analysis_mode == "single" else 2)
+                    self.cache.put(image_hash, cached, image_url=image_url)
+                    return self._flag_duplicate(cached, duplicate), None, duplicate
+        # Only images unlike anything indexed are added, so matches point at the first sighting
+        return None, phash if match is None else None, duplicate
+    
+    def remember_analysis(self, image_hash: Optional[str], analysis: Dict, image_url: Optional[str],
+                          phash: Optional[int], duplicate: Optional[Dict]) -> Dict:
+        """Store a fresh analysis in the cache and perceptual index, then attach the duplicate flag"""
+        if self.cache:
+            self.cache.put(image_hash, analysis, image_url=image_url)
+        if self.perceptual_index and phash is not None:
+            self.perceptual_index.add(phash, image_hash, image_url)
+        return self._flag_duplicate(analysis, duplicate)
+    
+    @staticmethod
+    def _flag_duplicate(analysis: Dict, duplicate: Optional[Dict]) -> Dict:
+        if duplicate:
+            logger.warning("🔁 Possible duplicate donation: image matches %s (distance %d, first seen %s)",
+                           duplicate["imageUrl"] or "an earlier upload", duplicate["distance"], duplicate["firstSeenAt"])
+            analysis["duplicateOf"] = duplicate
+        return analysis
+    
+    def create_batch_prompt(self, image_count: int) -> str:
+        """
+        Create prompt for analyzing several images in one Gemini call
+        
+        Args:
+            image_count: Number of images in the request
+            
+        Returns:
+            Prompt string
+        """
+        if self.structured_output:
+            return self.create_combined_prompt() + f"""
+
+BATCH MODE: You are given {image_count} separate images, each preceded by a label "Image <index>:" (index 0 to {image_count - 1}).
+Analyze EACH image independently using all of the rules above, including aiDetection and the error field for non-food images.
+Return exactly one entry per image in results, with index set to the image's label."""
+        return self.create_combined_prompt() + f"""
+
+BATCH MODE: You are given {image_count} separate images, each preceded by a label "Image <index>:" (index 0 to {image_count - 1}).
+Analyze EACH image independently using all of the rules above, including the aiDetection object and the error response for non-food images.
+Respond with ONLY a JSON object of this form, with exactly one entry per image:
+{{"results": [{{"index": 0, <JSON object described above for image 0>}}, {{"index": 1, <JSON object for image 1>}}]}}"""
+    
+    def analyze_images_batch(self, image_urls: List[str]) -> List[Dict]:
+        """
+        Analyze several images, packing up to batch_max_images into each Gemini call
+        
+        Images are downloaded in parallel; cached results are reused and images
+        rejected by the quality pre-screen are never sent. Groups
+        whose inline payload exceeds batch_max_bytes, images missing from a
+        batch response, and failed batch calls fall back to per-image calls.
+        Multi-image calls use the single-pass (combined) prompt; in two_pass
+        mode every image gets the per-image two-pass analysis instead, so
+        results match /predict.
+        
+        Args:
+            image_urls: Image URLs to analyze
+            
+        Returns:
+            One entry per URL, in order: {"index", "imageUrl", "analysis"} on success,
+            or {"index", "imageUrl", "error", "errorType"} where errorType is
+            "validation" (image rejected), "deadline" (request deadline exceeded) or "error"
+        """
+        results: List[Optional[Dict]] = [None] * len(image_urls)
+        if not image_urls:
+            return []
+        
+        # Downloads run with the request's context (deadline, timings, request id)
+        contexts = [contextvars.copy_context() for _ in image_urls]
+        with ThreadPoolExecutor(max_workers=min(4, len(image_urls)), thread_name_prefix="batch-download") as pool:
+            fetched = list(pool.map(lambda context, url: context.run(self._fetch_batch_item, url), contexts, image_urls))
+        
+        pending = []
+        for index, (image_url, item) in enumerate(zip(image_urls, fetched)):
+            if "analysis" in item or "error" in item:
+                results[index] = {"index": index, "imageUrl": image_url, **item}
+                continue
+            try:
+                item["part"], item["quality"] = self.prepare_and_screen(item["image_bytes"], item.pop("decoded"))
+            except ValueError as e:
+                results[index] = self._batch_error(index, image_url, e)
+                continue
+            except Exception as e:
+                results[index] = self._batch_error(index, image_url, Exception(f"Failed to decode image: {e}"))
+                continue
+            item.update(index=index, imageUrl=image_url)
+            pending.append(item)
+        
+        if self.analysis_mode != "single":
+            for item in pending:
+                self._analyze_batch_item_alone(item, results)
+            return results
+        
+        for group in self._group_batch_items(pending):
+            if len(group) == 1:
+                self._analyze_batch_item_alone(group[0], results)
+            else:
+                self._analyze_batch_group(group, results)
+        
+        return results
+    
+    def _fetch_batch_item(self, image_url: str) -> Dict:
+        """Cache lookup + download + duplicate lookup for one batch entry (never raises)"""
+        try:
+            if self.cache:
+                cached = self.cache.get_by_url(image_url)
+                if cached is not None:
+                    return {"analysis": cached}
+            image_bytes = self.download_image_bytes(image_url)
+            image_hash = hash_image_bytes(image_bytes)
+            decoded = self._decode_for_lookup(image_bytes)
+            previous, phash, duplicate = self.find_previous_analysis(decoded, image_hash, image_url)
+            if previous is not None:
+                return {"analysis": previous}
+            return {"image_bytes": image_bytes, "decoded": decoded, "image_hash": image_hash, "phash": phash,
+                    "duplicate": duplicate}
+        except Exception as e:
+            return {"error": str(e), "errorType": self._error_type(e)}
+    
+    def _group_batch_items(self, items: List[Dict]) -> List[List[Dict]]:
+        """Split pending items into groups bounded by image count and payload size"""
+        groups, current, current_bytes = [], [], 0
+        for item in items:
+            size = self._part_size(item["part"])
+            if current and (len(current) >= self.batch_max_images or current_bytes + size > self.batch_max_bytes):
+                groups.append(current)
+                current, current_bytes = [], 0
+            current.append(item)
+            current_bytes += size
+        if current:
+            groups.append(current)
+        return groups
+    
+    @staticmethod
+    def _part_size(part: Union[Image.Image, Dict]) -> int:
+        if isinstance(part, dict):
+            return len(part["data"])
+        # Full-resolution PIL image (preprocessing disabled): estimate as raw RGB
+        return part.width * part.height * 3
+    
+    def _analyze_batch_group(self, group: List[Dict], results: List[Optional[Dict]]) -> None:
+        """One multi-image Gemini call for a group; per-image fallback for anything it misses"""
+        logger.debug("🤖 Sending %d images to Gemini AI in one batch request...", len(group))
+        contents = [self.create_batch_prompt(len(group))]
+        for position, item in enumerate(group):
+            contents.extend([f"Image {position}:", item["part"]])
+        generation_config = self.generation_config("batch")
+        generation_config["max_output_tokens"] = generation_config["max_output_tokens"] * len(group)
+        
+        try:
+            response_text = self.generate_with_retry(contents, generation_config=generation_config)
+            try:
+                entries = json.loads(self.strip_code_fences(response_text)).get("results", [])
+            except json.JSONDecodeError:
+                record_parse("batch", self.output_mode, "invalid_json")
+                raise
+            record_parse("batch", self.output_mode, "ok")
+            by_position = {}
+            for entry in entries:
+                if isinstance(entry, dict) and str(entry.get("index", "")).isdigit():
+                    by_position[int(entry.pop("index"))] = entry
+        except Exception as e:
+            error_msg = str(e)
+            if (isinstance(e, DeadlineExceeded) or "quota" in error_msg.lower() or "rate limit" in error_msg.lower()
+                    or "429" in error_msg):
+                # Per-image retries would only spend more of the exhausted quota (or time)
+                for item in group:
+                    results[item["index"]] = self._batch_error(item["index"], item["imageUrl"], e)
+                return
+            logger.warning("⚠️  Batch request failed (%s), falling back to per-image requests", e)
+            by_position = {}
+        
+        for position, item in enumerate(group):
+            entry = by_position.get(position)
+            if entry is None:
+                self._analyze_batch_item_alone(item, results)
+                continue
+            try:
+                analysis = self.parse_gemini_response(json.dumps(entry), check_ai_detection=True, call="batch_item")
+                if item["quality"]:
+                    analysis["imageQuality"] = item["quality"]
+                analysis = self.remember_analysis(item["image_hash"], analysis, item["imageUrl"],
+                                                  item["phash"], item["duplicate"])
+                results[item["index"]] = {"index": item["index"], "imageUrl": item["imageUrl"], "analysis": analysis}
+            except Exception as e:
+                results[item["index"]] = self._batch_error(item["index"], item["imageUrl"], e)
+    
+    def _analyze_batch_item_alone(self, item: Dict, results: List[Optional[Dict]]) -> None:
+        try:
+            # Reuse the lookup, decode and pre-screen the batch path already did
+            analysis = self.analyze_prepared_image(item["part"], item["image_hash"], item["imageUrl"],
+                                                   item["phash"], item["duplicate"], item["quality"])
+            results[item["index"]] = {"index": item["index"], "imageUrl": item["imageUrl"], "analysis": analysis}
+        except Exception as e:
+            results[item["index"]] = self._batch_error(item["index"], item["imageUrl"], e)
+    
+    @classmethod
+    def _batch_error(cls, index: int, image_url: str, error: Exception) -> Dict:
+        return {
+            "index": index,
+            "imageUrl": image_url,
+            "error": str(error),
+            "errorType": cls._error_type(error),
+        }
+    
+    @staticmethod
+    def _error_type(error: Exception) -> str:
+        if isinstance(error, ValueError):
+            return "validation"
+        return "deadline" if isinstance(error, DeadlineExceeded) else "error"
@@ -0,0 +1,118 @@
+"""
+Prediction response models and the Gemini response schemas derived from them.
+
+With structured output the analyzer sends response_mime_type
+"application/json" plus a response_schema, so Gemini returns bare JSON with
+every required field instead of free text that has to be de-fenced and
+validated. The schemas are generated from the pydantic models here, so the
+API response model and what Gemini is asked to produce cannot drift apart.
+"""
+from typing import Any, Dict, List, Literal, Optional, Type
+
+from pydantic import BaseModel
+
+
+class FoodAnalysis(BaseModel):
+    """Analysis fields shared by the API response and Gemini's answer"""
+    foodCategory: str
+    itemName: str
+    quantity: int
+    qualityScore: float
+    freshness: str
+    storageRecommendation: str
+    confidence: float
+    detectedItems: List[str]
+
+
+class ImageQuality(BaseModel):
+    """Local pre-screen result, attached when an image was flagged"""
+    issues: List[str]
+    width: int
+    height: int
+    brightness: float
+    contrast: float
+    sharpness: float
+
+
+class DuplicateMatch(BaseModel):
+    """Earlier image this one is a (near-)duplicate of"""
+    imageUrl: Optional[str] = None
+    distance: int
+    firstSeenAt: str
+
+
+class PredictionResponse(FoodAnalysis):
+    imageQuality: Optional[ImageQuality] = None
+    duplicateOf: Optional[DuplicateMatch] = None
+
+
+class AiDetection(BaseModel):
+    isAiGenerated: bool
+    confidence: float
+    reason: str
+
+
+class GeminiFoodAnalysis(FoodAnalysis):
+    """What Gemini returns for one image: the API fields plus analyzer-only fields"""
+    foodCategory: Literal["Cooked Meals", "Raw Food", "Beverages", "Snacks", "Desserts"]
+    freshness: Literal["Fresh", "Good", "Fair"]
+    storageRecommendation: Literal["Hot", "Cold", "Dry"]
+    productType: Literal["cooked", "packed"]
+    expiryDateFromPackage: Optional[str] = None
+    # Set (with placeholder analysis fields) when the image shows no food
+    error: Optional[str] = None
+
+
+class GeminiCombinedAnalysis(GeminiFoodAnalysis):
+    """Single-pass response: food analysis plus the AI-generated check"""
+    aiDetection: AiDetection
+
+
+class GeminiBatchEntry(GeminiCombinedAnalysis):
+    index: int
+
+
+class GeminiBatchAnalysis(BaseModel):
+    results: List[GeminiBatchEntry]
+
+
+def _convert(node: Dict[str, Any], definitions: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate one JSON Schema node into Gemini's OpenAPI schema subset"""
+    if "$ref" in node:
+        return _convert(definitions[node["$ref"].split("/")[-1]], definitions)
+    if "anyOf" in node:
+        # Optional[X] is anyOf [X, null]; Gemini expresses it as nullable
+        options = [option for option in node["anyOf"] if option.get("type") != "null"]
+        converted = _convert(options[0], definitions)
+        if len(options) < len(node["anyOf"]):
+            converted["nullable"] = True
+        return converted
+    if "const" in node:
+        return {"type": "string", "enum": [node["const"]]}
+    schema: Dict[str, Any] = {"type": node["type"]}
+    if "enum" in node:
+        schema["enum"] = list(node["enum"])
+    if node["type"] == "array":
+        schema["items"] = _convert(node["items"], definitions)
+    elif node["type"] == "object":
+        schema["properties"] = {
+            name: _convert(child, definitions) for name, child in node.get("properties", {}).items()
+        }
+        if node.get("required"):
+            schema["required"] = list(node["required"])
+    return schema
+
+
+def gemini_response_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    Build a generation_config response_schema from a pydantic model
+
+    Args:
+        model: Pydantic model describing the expected JSON
+
+    Returns:
+        Schema dict (type/properties/required/enum/items/nullable only; titles,
+        defaults and $defs are not accepted by the API)
+    """
+    json_schema = model.model_json_schema()
+    return _convert(json_schema, json_schema.get("$defs", {}))
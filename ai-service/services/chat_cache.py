@@ -0,0 +1,170 @@
+"""
+Answer cache for stateless /chat turns.
+
+Most chat traffic is the same few questions asked without history. Replies
+are keyed on the normalized message text; on an exact miss, an optional
+similarity lookup compares hashed character-trigram vectors of the message's
+words (cosine similarity), so "How do I donate food?" and "how can i donate
+food" share an answer. Unlike the knowledge index, the cache keeps question
+words and negations, and a near-duplicate must ask the same kind of question:
+"Where do I donate food?" or "Why can't I donate food?" never reuse the
+answer to "How do I donate food?". Entries expire after a TTL, the store is a
+size-bounded LRU, and everything is dropped when the fingerprint of the chat
+setup (system instruction, knowledge base, model) changes.
+"""
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional
+
+import numpy as np
+
+VECTOR_DIM = 512
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'t)?")
+
+# Words that change what is being asked; they take part in matching
+QUESTION_WORDS = frozenset("how what when where which who whom whose why".split())
+NEGATIONS = frozenset("""
+no not never nor none nothing nobody without cannot cant dont doesnt didnt isnt
+arent wasnt werent wont wouldnt shouldnt couldnt
+""".split())
+
+# Filler that does not change the question
+FILLER_WORDS = frozenset("""
+a an and are be can could do does for i is it me my of on or please should the to
+would you your
+""".split())
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def message_tokens(text: str) -> List[str]:
+    """Word tokens without filler, with every negation mapped to 'not'"""
+    tokens = []
+    for word in TOKEN_PATTERN.findall(text.lower().replace("\u2019", "'")):
+        if word.endswith("n't") or word in NEGATIONS:
+            word = "not"
+        elif word in FILLER_WORDS or len(word) < 2:
+            continue
+        tokens.append(word)
+    return tokens
+
+
+def message_intent(tokens: List[str]) -> FrozenSet[str]:
+    """Question words and negation of a message; near-duplicates must share them"""
+    return frozenset(t for t in tokens if t in QUESTION_WORDS or t == "not")
+
+
+def message_vector(text: str) -> np.ndarray:
+    """L2-normalized hashed character-trigram vector of the message's words"""
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for word in message_tokens(text):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vector[zlib.crc32(padded[i:i + 3].encode()) % VECTOR_DIM] += 1.0
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class ChatAnswerCache:
+    """TTL + LRU cache of chat replies with optional near-duplicate lookup"""
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 256, similarity_threshold: float = 0.9):
+        """
+        Create the cache
+
+        Args:
+            ttl_seconds: How long a reply stays valid
+            max_entries: Maximum replies kept
+            similarity_threshold: Minimum cosine similarity for a near-duplicate hit (0 disables)
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        # normalized message -> (expires_at, reply, vector, intent)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._fingerprint: Optional[str] = None
+        self.stats_counters = {
+            "exact_hits": 0, "similar_hits": 0, "misses": 0,
+            "stores": 0, "evictions": 0, "invalidations": 0,
+        }
+
+    def get(self, message: str, fingerprint: str) -> Optional[str]:
+        """
+        Look up a cached reply
+
+        Args:
+            message: User message of a turn without history
+            fingerprint: Identity of the current chat setup; a change clears the cache
+        """
+        key = normalize_message(message)
+        now = time.time()
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.stats_counters["exact_hits"] += 1
+                return entry[1]
+            reply = self._lookup_similar(message, now) if self.similarity_threshold > 0 else None
+            if reply is None:
+                self.stats_counters["misses"] += 1
+                return None
+            self.stats_counters["similar_hits"] += 1
+            return reply
+
+    def put(self, message: str, reply: str, fingerprint: str) -> None:
+        """Store the reply to a turn without history"""
+        key = normalize_message(message)
+        if not key:
+            return
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._entries[key] = (time.time() + self.ttl_seconds, reply, message_vector(message),
+                                  message_intent(message_tokens(message)))
+            self._entries.move_to_end(key)
+            self.stats_counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats_counters["evictions"] += 1
+
+    def _check_fingerprint(self, fingerprint: str) -> None:
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                self.stats_counters["invalidations"] += 1
+            self._entries.clear()
+            self._fingerprint = fingerprint
+
+    def _lookup_similar(self, message: str, now: float) -> Optional[str]:
+        for key in [k for k, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[key]
+        intent = message_intent(message_tokens(message))
+        keys = [k for k, entry in self._entries.items() if entry[3] == intent]
+        if not keys:
+            return None
+        query = message_vector(message)
+        if not query.any():
+            return None
+        scores = np.stack([self._entries[k][2] for k in keys]) @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        self._entries.move_to_end(keys[best])
+        return self._entries[keys[best]][1]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.stats_counters["exact_hits"] + self.stats_counters["similar_hits"] + self.stats_counters["misses"]
+            hits = lookups - self.stats_counters["misses"]
+            return {
+                **self.stats_counters,
+                "entries": len(self._entries),
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+            }
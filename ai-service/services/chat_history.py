@@ -0,0 +1,110 @@
+"""
+Token-budgeted chat history.
+
+The client sends the whole conversation with every /chat request. Instead of
+keeping the last N messages, the newest turns are kept verbatim while they
+fit a token budget, and everything older is folded into a short extractive
+summary (first sentence of each turn) that is sent ahead of the question.
+Token counts are estimated locally (~4 characters per token) so no extra
+API call is needed to size the prompt.
+"""
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+CHARS_PER_TOKEN = 4
+# Role markers and separators Gemini adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_LINE_CHARS = 160
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini token count for a piece of text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def clip_text(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, marking the cut"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + " […]"
+
+
+def summarize_turn(role: str, text: str) -> str:
+    """One summary line: the first sentence of a turn"""
+    first = SENTENCE_END.split(" ".join(text.split()), maxsplit=1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS].rstrip() + "…"
+    return f"{'User' if role == 'user' else 'Assistant'}: {first}"
+
+
+class CompactedHistory:
+    """History that fits the budget plus a summary of what was dropped"""
+
+    def __init__(self, turns: List[Dict], summary: Optional[str], stats: Dict):
+        self.turns = turns
+        self.summary = summary
+        self.stats = stats
+
+
+def compact_history(history: List[Tuple[str, str]], budget_tokens: int = 2000,
+                    summary_tokens: int = 300) -> CompactedHistory:
+    """
+    Fit a conversation into a token budget
+
+    Args:
+        history: (role, text) pairs, oldest first; role is "user" or "model"
+        budget_tokens: Token budget for the turns kept verbatim
+        summary_tokens: Token budget for the summary of older turns
+
+    Returns:
+        CompactedHistory with Gemini-format turns ({"role", "parts"}), the summary
+        text (None if nothing was folded) and token statistics
+    """
+    # A single long message may use at most half the budget
+    max_turn_tokens = max(1, budget_tokens // 2)
+    kept: List[Dict] = []
+    used = 0
+    split = len(history)
+    for role, text in reversed(history):
+        text = clip_text(text, max_turn_tokens)
+        cost = estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget_tokens:
+            break
+        kept.insert(0, {"role": role, "parts": [text]})
+        used += cost
+        split -= 1
+    # Gemini expects the history to open with a user turn
+    while kept and kept[0]["role"] != "user":
+        used -= estimate_tokens(kept[0]["parts"][0]) + MESSAGE_OVERHEAD_TOKENS
+        kept.pop(0)
+        split += 1
+
+    summary = None
+    summary_used = 0
+    folded = history[:split]
+    if folded:
+        # Keep the most recent summary lines that fit; the oldest go first
+        lines: List[str] = []
+        for role, text in reversed(folded):
+            line = summarize_turn(role, text)
+            cost = estimate_tokens(line) + 1
+            if summary_used + cost > summary_tokens:
+                break
+            lines.insert(0, line)
+            summary_used += cost
+        omitted = len(folded) - len(lines)
+        if omitted:
+            lines.insert(0, f"({omitted} earlier messages omitted)")
+        summary = "\n".join(lines)
+
+    return CompactedHistory(kept, summary, {
+        "history_turns": len(history),
+        "kept_turns": len(kept),
+        "summarized_turns": len(folded),
+        "history_tokens": used,
+        "summary_tokens": summary_used,
+    })
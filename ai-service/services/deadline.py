@@ -0,0 +1,291 @@
+"""
+Request deadlines and client-disconnect cancellation.
+
+The backend aborts its call after AI_SERVICE_TIMEOUT, but the service used to
+keep downloading, queueing for quota, retrying and calling Gemini long after
+nobody was waiting for the answer, spending quota on results that were
+thrown away. Each request now carries a Deadline in a contextvar (the worker
+pool copies contextvars into its threads), taken from the caller's
+X-Request-Timeout-Ms (relative, in milliseconds) or X-Request-Deadline
+(absolute: epoch milliseconds or an ISO 8601 timestamp) header, or a
+configured default. The analyzer checks it before every download, Gemini call
+and retry sleep, and skips work whose expected duration no longer fits. When
+the client disconnects, the deadline is cancelled, so worker threads stop at
+their next check, and the request handler is cancelled.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from services.instrumentation import record_deadline_exceeded
+
+logger = logging.getLogger(__name__)
+
+REASON_EXPIRED = "expired"
+REASON_CANCELLED = "cancelled"
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of starting work that cannot finish before the request deadline"""
+
+    def __init__(self, message: str, reason: str = REASON_EXPIRED):
+        super().__init__(message)
+        self.reason = reason
+
+
+class Deadline:
+    """Monotonic expiry time of one request, plus a cancellation flag"""
+
+    def __init__(self, expires_at: Optional[float] = None):
+        """
+        Args:
+            expires_at: time.monotonic() value after which the answer is useless (None = no deadline)
+        """
+        self.expires_at = expires_at
+        self._cancel_reason: Optional[str] = None
+
+    @classmethod
+    def after(cls, seconds: Optional[float]) -> "Deadline":
+        return cls(None if seconds is None else time.monotonic() + seconds)
+
+    @property
+    def cancel_reason(self) -> Optional[str]:
+        return self._cancel_reason
+
+    def cancel(self, reason: str) -> None:
+        """Mark the request as abandoned; the next check() raises"""
+        if self._cancel_reason is None:
+            self._cancel_reason = reason
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (negative once expired), or None without a deadline"""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def check(self, what: str, needed: float = 0.0) -> None:
+        """
+        Make sure work expected to take `needed` seconds can still finish in time
+
+        Args:
+            what: Stage about to start ("download", "gemini_call", "retry_sleep", ...)
+            needed: Expected duration of the stage, in seconds
+
+        Raises:
+            DeadlineExceeded: If the request was cancelled or too little time is left
+        """
+        if self.cancel_reason is not None:
+            raise self.exceeded(what, f"Request cancelled ({self.cancel_reason}), skipping {what}",
+                                REASON_CANCELLED)
+        remaining = self.remaining()
+        if remaining is None:
+            return
+        if remaining <= 0:
+            raise self.exceeded(what, f"Request deadline passed before {what}")
+        if remaining < needed:
+            raise self.exceeded(what, f"Request deadline would be missed: {what} needs ~{needed:.1f}s, "
+                                      f"{remaining:.1f}s left")
+
+    def exceeded(self, what: str, message: Optional[str] = None, reason: str = REASON_EXPIRED) -> DeadlineExceeded:
+        """Count a stage skipped (or cut short) by the deadline and build the error to raise for it"""
+        record_deadline_exceeded(what, reason)
+        return DeadlineExceeded(message or f"Request deadline exceeded during {what}", reason)
+
+
+class SharedDeadline(Deadline):
+    """
+    Deadline of work shared by coalesced requests
+
+    The work is worth finishing while any caller still waits for it: the
+    latest deadline among callers that have not gone away applies, and it is
+    only cancelled once every caller has disconnected.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callers: List[Deadline] = []
+
+    def join(self, deadline: Optional[Deadline]) -> None:
+        self._callers.append(deadline or Deadline())
+
+    @property
+    def cancel_reason(self) -> Optional[str]:
+        if self._callers and all(caller.cancel_reason for caller in self._callers):
+            return self._callers[-1].cancel_reason
+        return None
+
+    def remaining(self) -> Optional[float]:
+        waiting = [caller.remaining() for caller in self._callers if caller.cancel_reason is None]
+        if not waiting or None in waiting:
+            return None
+        return max(waiting)
+
+
+class ChildDeadline(Deadline):
+    """
+    Deadline of one part of a request's work that can be cancelled on its own
+
+    It expires with the request and is cancelled with it, and can also be
+    cancelled by itself, e.g. the slower leg of a hedged call once the other
+    one has answered. Stopping work that is no longer needed is not counted
+    as a missed deadline.
+    """
+
+    def __init__(self, parent: Optional[Deadline] = None):
+        super().__init__()
+        self.parent = parent
+
+    @property
+    def cancel_reason(self) -> Optional[str]:
+        if self._cancel_reason is None and self.parent is not None:
+            return self.parent.cancel_reason
+        return self._cancel_reason
+
+    def remaining(self) -> Optional[float]:
+        return self.parent.remaining() if self.parent is not None else None
+
+    def exceeded(self, what: str, message: Optional[str] = None, reason: str = REASON_EXPIRED) -> DeadlineExceeded:
+        if self._cancel_reason is not None:
+            return DeadlineExceeded(message or f"Cancelled during {what}", REASON_CANCELLED)
+        return super().exceeded(what, message, reason)
+
+
+deadline_var: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Deadline of the request being handled, if any"""
+    return deadline_var.get()
+
+
+def check_deadline(what: str, needed: float = 0.0) -> None:
+    """Deadline.check() for the current request; a no-op outside requests (e.g. queued jobs)"""
+    deadline = deadline_var.get()
+    if deadline is not None:
+        deadline.check(what, needed)
+
+
+def remaining_seconds() -> Optional[float]:
+    """Seconds left for the current request, or None without a deadline"""
+    deadline = deadline_var.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def parse_deadline_headers(timeout_ms: Optional[str], deadline: Optional[str],
+                           now: Optional[float] = None) -> Optional[float]:
+    """
+    Seconds the caller is willing to wait, from the deadline headers
+
+    Args:
+        timeout_ms: X-Request-Timeout-Ms value (relative, milliseconds)
+        deadline: X-Request-Deadline value (epoch milliseconds or ISO 8601 with a timezone)
+        now: Current epoch time (default time.time())
+
+    Returns:
+        Seconds until the deadline (may be negative), or None if neither header is usable
+    """
+    if timeout_ms:
+        try:
+            return float(timeout_ms) / 1000
+        except ValueError:
+            logger.warning("⚠️  Ignoring invalid X-Request-Timeout-Ms header: %.40s", timeout_ms)
+    if deadline:
+        now = time.time() if now is None else now
+        try:
+            return float(deadline) / 1000 - now
+        except ValueError:
+            pass
+        try:
+            parsed = datetime.fromisoformat(deadline.replace("Z", "+00:00"))
+            if parsed.tzinfo is not None:
+                return parsed.timestamp() - now
+        except ValueError:
+            pass
+        logger.warning("⚠️  Ignoring invalid X-Request-Deadline header: %.40s", deadline)
+    return None
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that gives each request its Deadline and cancels the
+    request when the client disconnects
+
+    Disconnects are watched once the request body has been read (the handler
+    owns receive() until then); later receive() calls by the app, e.g. a
+    streaming response listening for the disconnect, are answered by the watcher.
+    """
+
+    def __init__(self, app, default_timeout_seconds: Optional[float] = None, margin_seconds: float = 0.25):
+        """
+        Args:
+            app: ASGI application
+            default_timeout_seconds: Deadline for requests without deadline headers (None = none)
+            margin_seconds: Time reserved for sending the response before the caller gives up
+        """
+        self.app = app
+        self.default_timeout_seconds = default_timeout_seconds
+        self.margin_seconds = margin_seconds
+
+    def _deadline(self, scope) -> Deadline:
+        headers = dict(scope.get("headers") or [])
+        seconds = parse_deadline_headers(
+            headers.get(b"x-request-timeout-ms", b"").decode("latin-1").strip(),
+            headers.get(b"x-request-deadline", b"").decode("latin-1").strip(),
+        )
+        if seconds is None:
+            seconds = self.default_timeout_seconds
+        return Deadline.after(None if seconds is None else seconds - self.margin_seconds)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        deadline = self._deadline(scope)
+        token = deadline_var.set(deadline)
+        disconnected = asyncio.Event()
+        response_sent = False
+        watcher: Optional[asyncio.Task] = None
+        app_task: Optional[asyncio.Task] = None
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            if not response_sent and app_task is not None and not app_task.done():
+                logger.info("🔌 Client disconnected, cancelling request %s %s", scope["method"], scope["path"])
+                deadline.cancel("client disconnected")
+                app_task.cancel()
+
+        async def receive_with_watch():
+            nonlocal watcher
+            if watcher is not None:
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                watcher = asyncio.ensure_future(watch_disconnect())
+            elif message["type"] == "http.disconnect":
+                disconnected.set()
+            return message
+
+        async def send_with_watch(message):
+            nonlocal response_sent
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+            await send(message)
+
+        try:
+            app_task = asyncio.ensure_future(self.app(scope, receive_with_watch, send_with_watch))
+            try:
+                await app_task
+            except asyncio.CancelledError:
+                if not app_task.cancelled() or deadline.cancel_reason is None:
+                    app_task.cancel()
+                    raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            deadline_var.reset(token)
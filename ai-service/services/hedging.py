@@ -0,0 +1,196 @@
+"""
+Hedged Gemini calls for tail latency.
+
+Gemini latency has a long tail: most analyses finish in a second or two, but
+a few take many times longer, and the caller waits on that one call. With
+hedging, if the model has not answered within a percentile of its own recent
+latencies (p95 by default), a second request goes to the next model in the
+pool, and the first valid answer wins.
+
+Each of the two calls (legs) runs with its own cancellable deadline. The
+losing leg is cancelled: it makes no further attempts, and a request it
+already has in flight finishes but its result is discarded (the synchronous
+client cannot abort it). Once a hedge is sent, the primary leg no longer
+fails over to the hedge's model, so each hedge costs at most one extra call.
+Only the slowest few percent of calls are hedged, and a token-bucket budget
+caps hedges at a fixed share of calls (each call earns max_rate of a hedge;
+a hedge that was never sent, because its model could not take the call or
+the primary answered first, is refunded), so hedging can never come close
+to doubling quota use.
+"""
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Set
+
+from services.deadline import ChildDeadline, current_deadline, deadline_var
+from services.instrumentation import record_hedge
+
+OUTCOME_PRIMARY_WON = "primary_won"
+OUTCOME_HEDGE_WON = "hedge_won"
+OUTCOME_BOTH_FAILED = "both_failed"
+OUTCOME_BUDGET_EXHAUSTED = "budget_exhausted"
+
+
+def nearest_rank_percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class HedgeLeg:
+    """One of the racing calls, with its own deadline and the models it must not call"""
+
+    def __init__(self, executor: ThreadPoolExecutor, fn: Callable[["HedgeLeg"], object], is_hedge: bool):
+        self.is_hedge = is_hedge
+        # Pool members this leg skips (the primary leg skips the hedge's model)
+        self.excluded: Set = set()
+        # Set once a request has actually been sent to a model
+        self.sent = False
+        self._cancelled = False
+        # Orders mark_sent() against cancel(), so an unsent leg stays unsent once cancelled
+        self._lock = threading.Lock()
+        self.deadline = ChildDeadline(current_deadline())
+        self._started = threading.Event()
+        self._started_at = 0.0
+        # Run with the caller's contextvars (timings, request id) and the leg's own deadline
+        context = contextvars.copy_context()
+        self.future: Future = executor.submit(context.run, self._run, fn)
+
+    def _run(self, fn: Callable[["HedgeLeg"], object]):
+        self._started_at = time.monotonic()
+        self._started.set()
+        deadline_var.set(self.deadline)
+        return fn(self)
+
+    def mark_sent(self) -> bool:
+        """Record that a request is about to be sent; False (send nothing) if the leg was cancelled"""
+        with self._lock:
+            if self._cancelled:
+                return False
+            self.sent = True
+            return True
+
+    def finished_within(self, seconds: float) -> bool:
+        """Wait until the leg is done or has run for `seconds`, counted from when it started"""
+        while not self._started.wait(0.05):
+            if self.future.done():
+                return True
+        wait([self.future], timeout=max(0.0, seconds - (time.monotonic() - self._started_at)))
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    def cancel(self) -> bool:
+        """
+        Stop the leg: drop it if not started, otherwise no further attempts after its current call
+
+        Returns:
+            True if the leg never sent a request (and now never will)
+        """
+        with self._lock:
+            self._cancelled = True
+            self.future.cancel()
+            self.deadline.cancel("lost the hedge race")
+            return not self.sent
+
+
+class HedgePolicy:
+    """When to send a hedged call, how many may be sent, and the threads racing them"""
+
+    def __init__(self, percentile: float = 95.0, max_rate: float = 0.05, min_samples: int = 20,
+                 burst: float = 5.0, min_delay_seconds: float = 0.25, max_threads: int = 16):
+        """
+        Args:
+            percentile: Latency percentile of the model after which a hedge is sent
+            max_rate: Hedges allowed per call on average (0.05 = at most 5% extra Gemini calls)
+            min_samples: Latency samples a model needs before its calls are hedged
+            burst: Hedges that may be sent back to back after a quiet period
+            min_delay_seconds: Lower bound for the hedge delay
+            max_threads: Threads for primary calls, and as many for hedge calls; enough for
+                every concurrent analysis plus abandoned calls still finishing, so a primary
+                call never waits for a thread
+        """
+        if not 0 < percentile < 100:
+            raise ValueError("Hedge percentile must be between 0 and 100")
+        if not 0 <= max_rate <= 1:
+            raise ValueError("Hedge max rate must be between 0 and 1")
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = max(1, min_samples)
+        self.burst = max(1.0, burst)
+        self.min_delay_seconds = min_delay_seconds
+        self._primary_executor = ThreadPoolExecutor(max_workers=max(1, max_threads), thread_name_prefix="gemini-primary")
+        self._hedge_executor = ThreadPoolExecutor(max_workers=max(1, max_threads), thread_name_prefix="gemini-hedge")
+        self._lock = threading.Lock()
+        # Start with one hedge available; the bucket fills by max_rate per call
+        self._tokens = 1.0
+        self._counts = {"calls": 0, "hedges": 0, OUTCOME_PRIMARY_WON: 0, OUTCOME_HEDGE_WON: 0,
+                        OUTCOME_BOTH_FAILED: 0, OUTCOME_BUDGET_EXHAUSTED: 0}
+
+    def delay(self, latencies: List[float]) -> Optional[float]:
+        """
+        Seconds to wait for the primary call before hedging
+
+        Args:
+            latencies: Recent successful call latencies of the primary model
+
+        Returns:
+            The configured percentile of the latencies, or None with too few samples to hedge
+        """
+        if len(latencies) < self.min_samples:
+            return None
+        return max(self.min_delay_seconds, nearest_rank_percentile(latencies, self.percentile))
+
+    def record_call(self) -> None:
+        """Count a hedge-eligible call; it earns max_rate of a hedge"""
+        with self._lock:
+            self._counts["calls"] += 1
+            self._tokens = min(self.burst, self._tokens + self.max_rate)
+
+    def try_spend(self) -> bool:
+        """Take one hedge from the budget; False (and counted) when the budget is exhausted"""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._counts["hedges"] += 1
+                return True
+            self._counts[OUTCOME_BUDGET_EXHAUSTED] += 1
+        record_hedge(OUTCOME_BUDGET_EXHAUSTED)
+        return False
+
+    def refund(self) -> None:
+        """Give back a hedge that was never sent (its model could not take the call, or it was cancelled first)"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+            self._counts["hedges"] -= 1
+
+    def record(self, outcome: str) -> None:
+        """Count how a hedged call ended (primary_won, hedge_won or both_failed)"""
+        with self._lock:
+            self._counts[outcome] += 1
+        record_hedge(outcome)
+
+    def start(self, fn: Callable[[HedgeLeg], object], is_hedge: bool = False) -> HedgeLeg:
+        """Run fn(leg) as the primary or the hedge leg of a call"""
+        return HedgeLeg(self._hedge_executor if is_hedge else self._primary_executor, fn, is_hedge)
+
+    def stats(self) -> Dict:
+        """Hedge settings, budget and outcome counts since startup"""
+        with self._lock:
+            calls = self._counts["calls"]
+            return {
+                "percentile": self.percentile,
+                "max_rate": self.max_rate,
+                **self._counts,
+                "hedge_rate": round(self._counts["hedges"] / calls, 3) if calls else None,
+                "budget_tokens": round(self._tokens, 2),
+            }
+
+    def shutdown(self) -> None:
+        self._primary_executor.shutdown(wait=False, cancel_futures=True)
+        self._hedge_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,226 @@
+"""
+Pooled, streaming, size-capped image downloader.
+
+Keeps keep-alive connections to the storage host in a shared requests
+Session, streams the body with a hard size cap (aborting early on an
+oversized Content-Length or a non-image Content-Type) and records per-phase
+timings: DNS lookup, connect (TCP + TLS), time to first byte and body.
+"""
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util import connection
+from urllib3.util.connection import allowed_gai_family
+
+# Storage backends do not always label images precisely (S3 defaults to these)
+GENERIC_CONTENT_TYPES = ("application/octet-stream", "binary/octet-stream")
+
+# Phase timings of the download running on the current thread
+_current = threading.local()
+
+
+def _record(phase: str, elapsed: float) -> None:
+    timings = getattr(_current, "timings", None)
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + elapsed * 1000
+
+
+class _TimedConnectionMixin:
+    """Splits connection setup into DNS and connect phases"""
+
+    def _new_conn(self):
+        host = self._dns_host.strip("[]")
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror:
+            # Let urllib3 raise its usual name resolution error
+            return super()._new_conn()
+        _record("dns_ms", time.perf_counter() - start)
+        # Try every resolved address in order, like urllib3 does (a dual-stack host
+        # may have an unreachable IPv6 address first); TLS/SNI still use self.host
+        error: Optional[OSError] = None
+        for _, _, _, _, sockaddr in addresses:
+            try:
+                sock = connection.create_connection((sockaddr[0], self.port), self.timeout,
+                                                    source_address=self.source_address,
+                                                    socket_options=self.socket_options)
+            except OSError as e:
+                error = e
+                continue
+            sys.audit("http.client.connect", self, self.host, self.port)
+            return sock
+        if isinstance(error, socket.timeout):
+            raise ConnectTimeoutError(
+                self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})"
+            ) from error
+        raise NewConnectionError(self, f"Failed to establish a new connection: {error or 'no address'}") from error
+
+    def connect(self):
+        start = time.perf_counter()
+        timings = getattr(_current, "timings", None)
+        dns_before = timings.get("dns_ms", 0.0) if timings is not None else 0.0
+        super().connect()
+        if timings is not None:
+            dns_spent = timings.get("dns_ms", 0.0) - dns_before
+            timings["connect_ms"] = timings.get("connect_ms", 0.0) + (time.perf_counter() - start) * 1000 - dns_spent
+            timings["new_connection"] = True
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools create timed connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class ImageDownloadError(Exception):
+    """Raised when an image cannot be downloaded or is rejected"""
+
+
+class ImageDownloader:
+    """Downloads images over a shared keep-alive connection pool"""
+
+    def __init__(self, max_bytes: int = 15 * 1024 * 1024, connect_timeout: float = 5.0,
+                 read_timeout: float = 15.0, pool_size: int = 16, chunk_size: int = 64 * 1024):
+        """
+        Configure the downloader
+
+        Args:
+            max_bytes: Largest image accepted; bigger downloads are aborted
+            connect_timeout: Seconds allowed to establish a connection
+            read_timeout: Seconds allowed between bytes, and for the whole body
+            pool_size: Keep-alive connections kept per host
+            chunk_size: Streaming read size
+        """
+        self.max_bytes = max_bytes
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = _TimedAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept"] = "image/*"
+        self._lock = threading.Lock()
+        self._totals = {"downloads": 0, "new_connections": 0, "bytes": 0,
+                        "dns_ms": 0.0, "connect_ms": 0.0, "ttfb_ms": 0.0, "body_ms": 0.0}
+
+    def download(self, image_url: str, max_seconds: Optional[float] = None) -> Tuple[bytes, Dict]:
+        """
+        Download an image
+
+        Args:
+            image_url: URL of the image
+            max_seconds: Tighter bound than the configured timeouts (e.g. the time left
+                before the request deadline)
+
+        Returns:
+            (image bytes, phase timings in milliseconds)
+
+        Raises:
+            ImageDownloadError: On HTTP errors, timeouts, non-image content or oversize bodies
+        """
+        read_timeout = self.read_timeout if max_seconds is None else max(0.1, min(self.read_timeout, max_seconds))
+        connect_timeout = min(self.connect_timeout, read_timeout)
+        timings = {"dns_ms": 0.0, "connect_ms": 0.0, "new_connection": False}
+        _current.timings = timings
+        start = time.perf_counter()
+        try:
+            response = self.session.get(
+                image_url, stream=True, timeout=(connect_timeout, read_timeout)
+            )
+            headers_at = time.perf_counter()
+            try:
+                response.raise_for_status()
+                self._check_headers(response)
+                data = self._read_body(response, headers_at, read_timeout)
+            finally:
+                response.close()
+        except ImageDownloadError:
+            raise
+        except requests.RequestException as e:
+            raise ImageDownloadError(str(e)) from e
+        finally:
+            _current.timings = None
+
+        end = time.perf_counter()
+        timings["ttfb_ms"] = max(0.0, (headers_at - start) * 1000 - timings["dns_ms"] - timings["connect_ms"])
+        timings["body_ms"] = (end - headers_at) * 1000
+        timings["total_ms"] = (end - start) * 1000
+        timings["bytes"] = len(data)
+        with self._lock:
+            self._totals["downloads"] += 1
+            self._totals["new_connections"] += int(timings["new_connection"])
+            self._totals["bytes"] += len(data)
+            for phase in ("dns_ms", "connect_ms", "ttfb_ms", "body_ms"):
+                self._totals[phase] += timings[phase]
+        return data, timings
+
+    def _check_headers(self, response: requests.Response) -> None:
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type and not content_type.startswith("image/") and content_type not in GENERIC_CONTENT_TYPES:
+            raise ImageDownloadError(f"URL did not return an image (Content-Type: {content_type})")
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise ImageDownloadError(
+                f"Image is too large ({int(content_length)} bytes, limit {self.max_bytes} bytes)"
+            )
+
+    def _read_body(self, response: requests.Response, started: float, read_timeout: float) -> bytes:
+        chunks = []
+        received = 0
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            received += len(chunk)
+            if received > self.max_bytes:
+                raise ImageDownloadError(f"Image is too large (over {self.max_bytes} bytes)")
+            if time.perf_counter() - started > read_timeout:
+                raise ImageDownloadError(f"Image download exceeded {read_timeout:.1f}s")
+            chunks.append(chunk)
+        # One join into an immutable bytes object: BytesIO and hashlib read it without copying
+        return b"".join(chunks)
+
+    def stats(self) -> Dict:
+        """Download counts and average per-phase timings"""
+        with self._lock:
+            totals = dict(self._totals)
+        count = totals["downloads"] or 1
+        return {
+            "downloads": totals["downloads"],
+            "new_connections": totals["new_connections"],
+            "bytes": totals["bytes"],
+            "avg_ms": {phase: round(totals[phase] / count, 1)
+                       for phase in ("dns_ms", "connect_ms", "ttfb_ms", "body_ms")},
+        }
+
+    def close(self) -> None:
+        """Close pooled connections"""
+        self.session.close()
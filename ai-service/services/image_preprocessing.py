@@ -0,0 +1,157 @@
+"""
+Image preprocessing before sending to Gemini.
+
+Phone photos are often 12+ MP. Food identification does not need that
+resolution, so images are downscaled to a capped longest edge and re-encoded
+as a quality-tuned JPEG or WebP. JPEG sources use draft-mode decoding, which
+lets libjpeg decode directly at a reduced scale instead of decoding the full
+image and resizing afterwards. Decoding and encoding are separate steps, so
+the decoded image can be inspected (duplicate lookup, quality screen) before
+deciding whether it is worth encoding at all. Bytes in and out are reported per request in
+the Server-Timing header and process-wide in /metrics.
+"""
+import threading
+import time
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from services.instrumentation import record_image_bytes
+
+# Formats Gemini accepts as inline image data
+GEMINI_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+
+class DecodedImage:
+    """Upright, downscaled RGB image plus what is known about its source"""
+
+    def __init__(self, image: Image.Image, source_format: Optional[str], original_size: Tuple[int, int],
+                 resized: bool = False, elapsed_ms: float = 0.0):
+        self.image = image
+        self.source_format = source_format
+        self.original_size = original_size
+        self.resized = resized
+        self.elapsed_ms = elapsed_ms
+
+
+class PreparedImage:
+    """Decoded image plus the encoded bytes that will be sent to Gemini"""
+
+    def __init__(self, image: Image.Image, data: bytes, mime_type: str, stats: Dict):
+        self.image = image
+        self.data = data
+        self.mime_type = mime_type
+        self.stats = stats
+
+    def as_part(self) -> Dict:
+        """Inline blob part for model.generate_content"""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+
+class ImagePreprocessor:
+    """Downscale and re-encode images to shrink Gemini upload payloads"""
+
+    def __init__(self, max_edge: int = 1024, output_format: str = "JPEG", quality: int = 85):
+        """
+        Configure preprocessing
+
+        Args:
+            max_edge: Longest edge in pixels after downscaling
+            output_format: "JPEG" or "WEBP"
+            quality: Encoder quality (1-100)
+        """
+        output_format = output_format.upper()
+        if output_format == "JPG":
+            output_format = "JPEG"
+        if output_format not in ("JPEG", "WEBP"):
+            raise ValueError(f"Unsupported image output format: {output_format}")
+        self.max_edge = max(64, max_edge)
+        self.output_format = output_format
+        self.quality = min(100, max(1, quality))
+        self._lock = threading.Lock()
+        self._totals = {"images": 0, "original_bytes": 0, "sent_bytes": 0}
+
+    def decode(self, data: bytes) -> DecodedImage:
+        """
+        Decode and downscale image bytes
+
+        Args:
+            data: Original image file contents
+
+        Returns:
+            DecodedImage with the upright RGB image, at most max_edge on its longest side
+        """
+        start = time.time()
+        image = Image.open(BytesIO(data))
+        source_format = image.format
+        original_size = image.size
+
+        if source_format == "JPEG":
+            # Let the decoder skip detail we will throw away anyway
+            image.draft("RGB", (self.max_edge, self.max_edge))
+
+        # Phone cameras store rotation in EXIF instead of rotating pixels
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+        resized = max(image.size) > self.max_edge
+        if resized:
+            image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+        return DecodedImage(image, source_format, original_size, resized, (time.time() - start) * 1000)
+
+    def process(self, data: bytes, decoded: Optional[DecodedImage] = None) -> PreparedImage:
+        """
+        Decode, downscale and re-encode image bytes
+
+        Args:
+            data: Original image file contents
+            decoded: decode() of the same bytes, if already done
+
+        Returns:
+            PreparedImage with the RGB image and the bytes to send
+        """
+        if decoded is None:
+            decoded = self.decode(data)
+        start = time.time()
+        image = decoded.image
+
+        buffer = BytesIO()
+        image.save(buffer, format=self.output_format, quality=self.quality, optimize=True)
+        encoded = buffer.getvalue()
+        mime_type = GEMINI_MIME_TYPES[self.output_format]
+
+        # A small, already-compressed upload can grow when re-encoded; keep the original then
+        if not decoded.resized and len(encoded) >= len(data) and decoded.source_format in GEMINI_MIME_TYPES:
+            encoded = data
+            mime_type = GEMINI_MIME_TYPES[decoded.source_format]
+
+        stats = {
+            "original_bytes": len(data),
+            "sent_bytes": len(encoded),
+            "bytes_saved": len(data) - len(encoded),
+            "original_size": decoded.original_size,
+            "sent_size": image.size,
+            "elapsed_ms": round(decoded.elapsed_ms + (time.time() - start) * 1000, 1),
+        }
+        with self._lock:
+            self._totals["images"] += 1
+            self._totals["original_bytes"] += len(data)
+            self._totals["sent_bytes"] += len(encoded)
+        record_image_bytes(len(data), len(encoded))
+        return PreparedImage(image, encoded, mime_type, stats)
+
+    def stats(self) -> Dict:
+        """Cumulative bytes in/out since startup"""
+        with self._lock:
+            totals = dict(self._totals)
+        totals["bytes_saved"] = totals["original_bytes"] - totals["sent_bytes"]
+        totals["max_edge"] = self.max_edge
+        totals["output_format"] = self.output_format
+        totals["quality"] = self.quality
+        return totals
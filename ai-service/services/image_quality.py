@@ -0,0 +1,214 @@
+"""
+Local image quality pre-screen run before any Gemini call.
+
+Blank or near-uniform frames, very dark or washed-out shots, heavily blurred
+photos and tiny thumbnails cannot be analyzed usefully, but each still cost
+one or two Gemini calls (AI detection + analysis) from the daily quota. The
+screen takes the image already decoded for upload (so it adds no decode of
+its own), reduces it to a grayscale thumbnail and scores mean brightness,
+contrast (standard deviation), sharpness (variance of the Laplacian) and the
+original resolution with NumPy, in a few milliseconds. Depending on the
+policy, images failing a threshold are only flagged (analyzed as usual, with
+the issues attached to the prediction) or rejected before the API is called.
+Files that cannot be decoded are always rejected unless the screen is off.
+"""
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from services.instrumentation import record_calls_saved, record_prescreen
+
+logger = logging.getLogger(__name__)
+
+POLICY_OFF = "off"
+POLICY_FLAG = "flag"
+POLICY_REJECT = "reject"
+POLICIES = (POLICY_OFF, POLICY_FLAG, POLICY_REJECT)
+
+# User-facing wording for each issue, used in rejection messages
+ISSUE_DESCRIPTIONS = {
+    "too_small": "the image resolution is too low",
+    "too_dark": "the photo is too dark",
+    "too_bright": "the photo is overexposed",
+    "uniform": "the image is blank or nearly uniform",
+    "blurry": "the photo is too blurry",
+}
+
+
+class QualityReport:
+    """Scores and failed checks for one image"""
+
+    def __init__(self, width: int, height: int, brightness: float, contrast: float, sharpness: float,
+                 issues: List[str], elapsed_ms: float):
+        self.width = width
+        self.height = height
+        self.brightness = brightness
+        self.contrast = contrast
+        self.sharpness = sharpness
+        self.issues = issues
+        self.elapsed_ms = elapsed_ms
+
+    def as_dict(self) -> Dict:
+        """imageQuality field of a flagged prediction"""
+        return {
+            "issues": list(self.issues),
+            "width": self.width,
+            "height": self.height,
+            "brightness": round(self.brightness, 1),
+            "contrast": round(self.contrast, 1),
+            "sharpness": round(self.sharpness, 1),
+        }
+
+    def describe(self) -> str:
+        return ", ".join(ISSUE_DESCRIPTIONS.get(issue, issue) for issue in self.issues)
+
+
+class ImageQualityScreen:
+    """Score images locally and decide whether they are worth a Gemini call"""
+
+    def __init__(self, policy: str = POLICY_FLAG, min_edge: int = 200, min_brightness: float = 20,
+                 max_brightness: float = 240, min_contrast: float = 8, min_sharpness: float = 15,
+                 analysis_edge: int = 512):
+        """
+        Configure the screen
+
+        Args:
+            policy: "off" (no screening), "flag" (analyze and report issues) or "reject"
+            min_edge: Shortest edge in pixels below which an image is too small
+            min_brightness: Mean gray level (0-255) below which an image is too dark
+            max_brightness: Mean gray level above which an image is overexposed
+            min_contrast: Gray level standard deviation below which an image is uniform
+            min_sharpness: Laplacian variance below which an image is blurry
+            analysis_edge: Longest edge the image is reduced to before scoring, so
+                sharpness is comparable across resolutions (and upload settings)
+        """
+        policy = policy.lower()
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid image quality policy '{policy}', expected one of {POLICIES}")
+        self.policy = policy
+        self.min_edge = min_edge
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        self.analysis_edge = max(64, analysis_edge)
+        self._lock = threading.Lock()
+        self._counts = {"screened": 0, "passed": 0, "flagged": 0, "rejected": 0, "corrupt": 0,
+                        "gemini_calls_saved": 0}
+        self._issues: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != POLICY_OFF
+
+    def assess(self, image: Image.Image, original_size: Tuple[int, int]) -> QualityReport:
+        """
+        Score a decoded image
+
+        Args:
+            image: Decoded (possibly already downscaled) image
+            original_size: Width and height of the image as uploaded
+
+        Returns:
+            QualityReport (issues is empty when every check passes)
+        """
+        start = time.time()
+        width, height = original_size
+        if image.mode != "L":
+            image = image.convert("L")
+        # Integer box reduction: much cheaper than a resampling thumbnail
+        factor = -(-max(image.size) // self.analysis_edge)
+        if factor > 1:
+            image = image.reduce(factor)
+
+        gray = np.asarray(image, dtype=np.float32)
+        brightness = float(gray.mean())
+        contrast = float(gray.std())
+        if gray.shape[0] >= 3 and gray.shape[1] >= 3:
+            laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                         - 4 * gray[1:-1, 1:-1])
+            sharpness = float(laplacian.var())
+        else:
+            sharpness = 0.0
+
+        issues = []
+        if min(width, height) < self.min_edge:
+            issues.append("too_small")
+        if brightness < self.min_brightness:
+            issues.append("too_dark")
+        elif brightness > self.max_brightness:
+            issues.append("too_bright")
+        if contrast < self.min_contrast:
+            issues.append("uniform")
+        elif sharpness < self.min_sharpness:
+            # A uniform frame has no edges either; only report blur for images with content
+            issues.append("blurry")
+        return QualityReport(width, height, brightness, contrast, sharpness, issues,
+                             round((time.time() - start) * 1000, 1))
+
+    def screen(self, image: Image.Image, original_size: Tuple[int, int],
+               calls_per_image: int = 1) -> Optional[QualityReport]:
+        """
+        Apply the policy to a decoded image
+
+        Args:
+            image: Decoded (possibly already downscaled) image
+            original_size: Width and height of the image as uploaded
+            calls_per_image: Gemini calls the analysis would make, counted as saved on rejection
+
+        Returns:
+            The report when the image was flagged, otherwise None
+
+        Raises:
+            ValueError: If the image fails a check under the "reject" policy
+        """
+        if not self.enabled:
+            return None
+        report = self.assess(image, original_size)
+        if not report.issues:
+            self._count("passed")
+            record_prescreen("passed", [])
+            return None
+        if self.policy == POLICY_REJECT:
+            self._count("rejected", report.issues, calls_saved=calls_per_image)
+            record_prescreen("rejected", report.issues)
+            record_calls_saved("prescreen", calls_per_image)
+            raise ValueError(f"Image failed the quality check: {report.describe()}")
+        self._count("flagged", report.issues)
+        record_prescreen("flagged", report.issues)
+        return report
+
+    def unreadable(self, error: Exception) -> ValueError:
+        """Count an image that could not be decoded and build the validation error to raise for it"""
+        logger.info("❌ Pre-screen could not decode image: %s", error)
+        self._count("corrupt")
+        record_prescreen("corrupt", [])
+        return ValueError("Image failed the quality check: the file is not a readable image")
+
+    def _count(self, result: str, issues: Optional[List[str]] = None, calls_saved: int = 0) -> None:
+        with self._lock:
+            self._counts["screened"] += 1
+            self._counts[result] += 1
+            self._counts["gemini_calls_saved"] += calls_saved
+            for issue in issues or []:
+                self._issues[issue] = self._issues.get(issue, 0) + 1
+
+    def stats(self) -> Dict:
+        """Outcome counts, issue counts and Gemini calls saved since startup"""
+        with self._lock:
+            return {
+                "policy": self.policy,
+                **self._counts,
+                "issues": dict(self._issues),
+                "thresholds": {
+                    "min_edge": self.min_edge,
+                    "min_brightness": self.min_brightness,
+                    "max_brightness": self.max_brightness,
+                    "min_contrast": self.min_contrast,
+                    "min_sharpness": self.min_sharpness,
+                },
+            }
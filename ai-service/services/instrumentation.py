@@ -0,0 +1,348 @@
+"""
+Per-request stage timings and Prometheus metrics.
+
+Each HTTP request gets a RequestTimings object in a contextvar (the worker
+pool copies contextvars into its threads, so analyzer code running there
+records into the right request). Stages are timed with stage()/record_stage(),
+summed per request into a Server-Timing response header, and observed in
+process-wide histograms that /metrics renders in the Prometheus text format.
+Image bytes before and after preprocessing are added to the header as an
+"image" entry and counted in ai_image_bytes_total.
+Gemini token usage, retries, circuit breaker transitions and response parse
+outcomes are exported as counters, as are image pre-screen outcomes, the
+Gemini calls they saved, work skipped because of a request deadline and
+hedged call outcomes; the analysis job queue depth is a gauge.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Seconds; covers cache hits (ms) up to slow multi-retry analyses (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value:.15g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Gauge:
+    """Value that goes up and down, with labels"""
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value:.15g}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric rendered by /metrics"""
+
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+REQUEST_SECONDS = metrics.histogram(
+    "ai_http_request_duration_seconds", "Time until response headers are sent", ("method", "path", "status")
+)
+STAGE_SECONDS = metrics.histogram(
+    "ai_stage_duration_seconds", "Time spent per processing stage", ("stage",)
+)
+GEMINI_TOKENS = metrics.counter(
+    "ai_gemini_tokens_total", "Gemini tokens reported in usage metadata", ("model", "kind")
+)
+GEMINI_RETRIES = metrics.counter(
+    "ai_gemini_retries_total", "Gemini calls retried after an error", ("call", "reason")
+)
+GEMINI_BREAKER_TRANSITIONS = metrics.counter(
+    "ai_gemini_breaker_transitions_total", "Circuit breaker state changes per model", ("model", "state")
+)
+GEMINI_PARSES = metrics.counter(
+    "ai_gemini_responses_parsed_total", "Gemini JSON responses by parse outcome", ("call", "mode", "result")
+)
+JOB_QUEUE_DEPTH = metrics.gauge("ai_job_queue_depth", "Analysis jobs waiting for a job worker")
+JOBS_FINISHED = metrics.counter("ai_jobs_finished_total", "Analysis jobs by final status", ("status",))
+PRESCREEN_RESULTS = metrics.counter(
+    "ai_prescreen_results_total", "Images by local quality pre-screen outcome", ("result",)
+)
+PRESCREEN_ISSUES = metrics.counter(
+    "ai_prescreen_issues_total", "Failed pre-screen checks by issue", ("issue",)
+)
+GEMINI_CALLS_SAVED = metrics.counter(
+    "ai_gemini_calls_saved_total", "Gemini calls skipped because an image was handled locally", ("reason",)
+)
+DEADLINE_EXCEEDED = metrics.counter(
+    "ai_deadline_exceeded_total", "Stages skipped or cut short by the request deadline", ("stage", "reason")
+)
+GEMINI_HEDGES = metrics.counter(
+    "ai_gemini_hedges_total", "Slow Gemini calls raced against an alternate model, by outcome", ("outcome",)
+)
+IMAGE_BYTES = metrics.counter(
+    "ai_image_bytes_total", "Image bytes received and sent to Gemini after preprocessing", ("kind",)
+)
+
+
+class RequestTimings:
+    """Stage durations accumulated for one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+        # entry -> counter name -> value, rendered as desc="name=value ..."
+        self.details: Dict[str, Dict[str, int]] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_detail(self, entry: str, name: str, amount: int) -> None:
+        with self._lock:
+            values = self.details.setdefault(entry, {})
+            values[name] = values.get(name, 0) + amount
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        with self._lock:
+            entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+            for entry, values in self.details.items():
+                desc = " ".join(f"{name}={value}" for name, value in values.items())
+                entries.append(f'{entry};desc="{desc}"')
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """Timings of the request being handled, if any"""
+    return _current_timings.get()
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Add a measured duration to the current request and the stage histogram"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block as one stage (recorded even if it raises)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_tokens(model: str, prompt_tokens: Optional[int], reply_tokens: Optional[int]) -> None:
+    """Count Gemini token usage"""
+    if prompt_tokens:
+        GEMINI_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    if reply_tokens:
+        GEMINI_TOKENS.inc(reply_tokens, model=model, kind="reply")
+
+
+def record_retry(call: str, reason: str) -> None:
+    """Count a retried Gemini call ("rate_limit" or "error")"""
+    GEMINI_RETRIES.inc(call=call, reason=reason)
+
+
+def record_breaker_transition(model: str, state: str) -> None:
+    """Count a model circuit breaker entering a state ("open", "half_open" or "closed")"""
+    GEMINI_BREAKER_TRANSITIONS.inc(model=model, state=state)
+
+
+def record_job_queue_depth(depth: int) -> None:
+    JOB_QUEUE_DEPTH.set(depth)
+
+
+def record_job_finished(status: str) -> None:
+    """Count a finished analysis job ("succeeded" or "failed")"""
+    JOBS_FINISHED.inc(status=status)
+
+
+def record_prescreen(result: str, issues: List[str]) -> None:
+    """Count a pre-screened image ("passed", "flagged", "rejected" or "corrupt") and its failed checks"""
+    PRESCREEN_RESULTS.inc(result=result)
+    for issue in issues:
+        PRESCREEN_ISSUES.inc(issue=issue)
+
+
+def record_calls_saved(reason: str, calls: int = 1) -> None:
+    """Count Gemini calls that were not made (e.g. reason "prescreen")"""
+    GEMINI_CALLS_SAVED.inc(calls, reason=reason)
+
+
+def record_deadline_exceeded(stage: str, reason: str) -> None:
+    """Count a stage skipped or cut short because the request expired or was cancelled ("expired" or "cancelled")"""
+    DEADLINE_EXCEEDED.inc(stage=stage, reason=reason)
+
+
+def record_hedge(outcome: str) -> None:
+    """Count a hedging decision ("primary_won", "hedge_won", "both_failed" or "budget_exhausted")"""
+    GEMINI_HEDGES.inc(outcome=outcome)
+
+
+def record_image_bytes(original_bytes: int, sent_bytes: int) -> None:
+    """Count the bytes of one preprocessed image, process-wide and for the current request"""
+    IMAGE_BYTES.inc(original_bytes, kind="original")
+    IMAGE_BYTES.inc(sent_bytes, kind="sent")
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add_detail("image", "count", 1)
+        timings.add_detail("image", "original_bytes", original_bytes)
+        timings.add_detail("image", "sent_bytes", sent_bytes)
+        timings.add_detail("image", "saved_bytes", original_bytes - sent_bytes)
+
+
+def record_parse(call: str, mode: str, result: str) -> None:
+    """Count a parsed Gemini response (result "ok", "invalid_json" or "missing_field")"""
+    GEMINI_PARSES.inc(call=call, mode=mode, result=result)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that scopes RequestTimings to each request, adds the
+    Server-Timing header and observes the request duration histogram
+
+    For streaming responses the header and duration reflect the time until
+    the response started (i.e. the first chunk).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # Label by route template (/jobs/{job_id}); unmatched paths share one
+                # label so ids and scanners cannot blow up cardinality
+                route = scope.get("route")
+                path = getattr(route, "path", scope["path"]) if status != 404 else "unmatched"
+                REQUEST_SECONDS.observe(time.perf_counter() - timings.start,
+                                        method=scope["method"], path=path, status=status)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timings.reset(token)
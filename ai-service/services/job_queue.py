@@ -0,0 +1,277 @@
+"""
+In-process job queue for asynchronous image analysis.
+
+Submitting a job returns its id immediately; a fixed set of asyncio workers
+takes jobs from a bounded queue and runs the regular /predict pipeline (the
+blocking work still goes through the worker pool). Finished jobs are kept in
+memory for a TTL so they can be polled, and are also POSTed to a callback URL
+when one is configured, so callers never hold a connection open while the
+model runs. Queue wait times are recorded as the "job_wait" stage.
+
+Callbacks go to the configured default URL, or to a per-job https URL whose
+host is on the configured allowlist; anything else is rejected at submit
+time, so callers cannot make the service POST to arbitrary (e.g. internal)
+addresses. Redirects are not followed.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from services.instrumentation import record_job_finished, record_job_queue_depth, record_stage
+from services.logging_config import request_id_var
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised when max_queued jobs are already waiting"""
+
+
+class InvalidCallbackUrl(ValueError):
+    """Raised when a per-job callback URL is not https or its host is not allowed"""
+
+
+class JobFailed(Exception):
+    """Raised by a job runner with the error detail to report for the job"""
+
+    def __init__(self, detail: Dict, status_code: int = 500):
+        super().__init__(detail.get("message") or detail.get("error") or "Job failed")
+        self.detail = detail
+        self.status_code = status_code
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+
+
+class Job:
+    """One queued image analysis"""
+
+    def __init__(self, image_url: str, callback_url: Optional[str], request_id: str):
+        self.id = uuid.uuid4().hex
+        self.image_url = image_url
+        self.callback_url = callback_url
+        # Id of the submitting request, so the job's log lines can be traced back to it
+        self.request_id = request_id
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.prediction: Optional[Dict] = None
+        self.error: Optional[Dict] = None
+        self.error_status: Optional[int] = None
+        # None (no callback), "pending", "delivered" or "failed"
+        self.callback_status: Optional[str] = "pending" if callback_url else None
+
+    def to_dict(self) -> Dict:
+        """Poll / callback representation"""
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            "imageUrl": self.image_url,
+            "createdAt": _iso(self.created_at),
+            "startedAt": _iso(self.started_at),
+            "finishedAt": _iso(self.finished_at),
+            "waitMs": round((self.started_at - self.created_at) * 1000) if self.started_at else None,
+            "runMs": round((self.finished_at - self.started_at) * 1000) if self.finished_at else None,
+            "prediction": self.prediction,
+            "error": self.error,
+            "errorStatus": self.error_status,
+            "callbackStatus": self.callback_status,
+        }
+
+
+class JobQueue:
+    """Bounded asyncio job queue with a fixed number of workers"""
+
+    def __init__(self, runner: Callable[[Job], Awaitable[Dict]], workers: int = 4, max_queued: int = 100,
+                 result_ttl_seconds: float = 3600, max_jobs: int = 10000,
+                 default_callback_url: Optional[str] = None, callback_timeout: float = 5.0,
+                 callback_attempts: int = 3, callback_allowed_hosts: Optional[List[str]] = None):
+        """
+        Args:
+            runner: Coroutine producing the prediction for a job (raises JobFailed with an error detail)
+            workers: Jobs processed concurrently
+            max_queued: Jobs allowed to wait; further submissions are rejected
+            result_ttl_seconds: How long finished jobs can still be polled
+            max_jobs: Upper bound on jobs kept in memory (oldest finished jobs go first)
+            default_callback_url: Callback used when a job is submitted without one
+            callback_timeout: Timeout per callback POST, in seconds
+            callback_attempts: Callback POSTs before giving up (1s, 2s, ... between them)
+            callback_allowed_hosts: Hosts per-job https callback URLs may point to
+                (empty = only the default callback is used)
+        """
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_jobs = max_jobs
+        self.default_callback_url = default_callback_url
+        self.callback_timeout = callback_timeout
+        self.callback_attempts = max(1, callback_attempts)
+        self.callback_allowed_hosts = {host.lower() for host in callback_allowed_hosts or []}
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._callbacks = set()
+        self._running = 0
+        self._counts = {SUCCEEDED: 0, FAILED: 0, "rejected": 0}
+        self._recent_waits: deque = deque(maxlen=200)
+
+    def start(self) -> None:
+        """Start the workers (must be called from the running event loop)"""
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        record_job_queue_depth(0)
+
+    async def stop(self) -> None:
+        """Cancel the workers and pending callbacks; queued jobs are dropped"""
+        for task in self._tasks + list(self._callbacks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._callbacks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, image_url: str, callback_url: Optional[str] = None) -> Job:
+        """
+        Queue an analysis
+
+        Raises:
+            InvalidCallbackUrl: If callback_url is given but not allowed
+            JobQueueFull: If max_queued jobs are already waiting
+        """
+        if callback_url:
+            self.check_callback_url(callback_url)
+        self._evict()
+        if self._queue.qsize() >= self.max_queued:
+            self._counts["rejected"] += 1
+            raise JobQueueFull(f"Job queue is full ({self._queue.qsize()}/{self.max_queued} queued jobs)")
+        job = Job(image_url, callback_url or self.default_callback_url, request_id_var.get())
+        self._jobs[job.id] = job
+        self._queue.put_nowait(job)
+        record_job_queue_depth(self._queue.qsize())
+        return job
+
+    def check_callback_url(self, url: str) -> None:
+        """
+        Make sure a per-job callback URL may be used
+
+        Raises:
+            InvalidCallbackUrl: If the URL is not https or its host is not on the allowlist
+        """
+        if not self.callback_allowed_hosts:
+            raise InvalidCallbackUrl("Per-job callback URLs are not enabled on this service")
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        if parts.scheme != "https":
+            raise InvalidCallbackUrl("Callback URL must use https")
+        if host not in self.callback_allowed_hosts or parts.username or parts.password:
+            raise InvalidCallbackUrl(f"Callback host '{host}' is not allowed")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            record_job_queue_depth(self._queue.qsize())
+            token = request_id_var.set(job.request_id)
+            try:
+                await self._run(job)
+            finally:
+                request_id_var.reset(token)
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.started_at = time.time()
+        wait = job.started_at - job.created_at
+        self._recent_waits.append(wait)
+        record_stage("job_wait", wait)
+        job.status = RUNNING
+        self._running += 1
+        try:
+            job.prediction = await self.runner(job)
+            job.status = SUCCEEDED
+        except JobFailed as e:
+            job.error, job.error_status = e.detail, e.status_code
+            job.status = FAILED
+        except Exception as e:
+            logger.exception("❌ Job %s failed: %s", job.id, e)
+            job.error, job.error_status = {"error": "Analysis failed", "message": str(e)}, 500
+            job.status = FAILED
+        finally:
+            self._running -= 1
+        job.finished_at = time.time()
+        self._counts[job.status] += 1
+        record_job_finished(job.status)
+        logger.info("✅ Job %s %s (waited %.2fs, ran %.2fs)", job.id, job.status, wait,
+                    job.finished_at - job.started_at)
+        if job.callback_url:
+            task = asyncio.create_task(self._deliver_callback(job))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    async def _deliver_callback(self, job: Job) -> None:
+        """POST the finished job to its callback URL, retrying with backoff"""
+        payload = job.to_dict()
+        delay = 1.0
+        for attempt in range(1, self.callback_attempts + 1):
+            try:
+                response = await asyncio.to_thread(
+                    requests.post, job.callback_url, json=payload, timeout=self.callback_timeout,
+                    headers={"X-Request-ID": job.request_id}, allow_redirects=False,
+                )
+                if response.status_code < 300:
+                    job.callback_status = "delivered"
+                    return
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                error = str(e)
+            logger.warning("⚠️  Callback for job %s failed (attempt %d/%d): %s",
+                           job.id, attempt, self.callback_attempts, error)
+            if attempt < self.callback_attempts:
+                await asyncio.sleep(delay)
+                delay *= 2
+        job.callback_status = "failed"
+
+    def _evict(self) -> None:
+        """Drop finished jobs past their TTL, then the oldest finished ones over max_jobs"""
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at and now - job.finished_at > self.result_ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if len(self._jobs) >= self.max_jobs:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at]:
+                if len(self._jobs) < self.max_jobs:
+                    break
+                del self._jobs[job_id]
+
+    def stats(self) -> Dict:
+        """Queue depth, worker usage, outcome counts and recent queue wait times"""
+        waits = sorted(self._recent_waits)
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": self._running,
+            "max_queued": self.max_queued,
+            "jobs_stored": len(self._jobs),
+            "succeeded": self._counts[SUCCEEDED],
+            "failed": self._counts[FAILED],
+            "rejected": self._counts["rejected"],
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000) if waits else None,
+            "p95_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000) if waits else None,
+        }
@@ -0,0 +1,171 @@
+"""
+Local retrieval over the chatbot knowledge base.
+
+The knowledge text is split into overlapping chunks and indexed with BM25.
+Postings are stored as flat NumPy arrays (term offsets, chunk ids, weights),
+so scoring a question is a few array gathers, and the whole index can be
+saved to / loaded from a single .npz file. Only the top-k chunks for a
+question are sent to the chat model instead of the whole document.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+# Common words that carry no retrieval signal
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its
+me my of on or our so that the their them there these they this to was we what
+when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def chunk_text(text: str, chunk_chars: int = 1000, overlap_chars: int = 150) -> List[str]:
+    """
+    Split text into sentence-aligned chunks of roughly chunk_chars
+
+    Consecutive chunks share up to overlap_chars of trailing sentences so an
+    answer spanning a boundary is still retrievable.
+    """
+    sentences = [s.strip() for s in SENTENCE_BOUNDARY.split(text) if s.strip()]
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for sentence in sentences:
+        # Very long "sentences" (tables, lists without punctuation) are hard-split
+        while len(sentence) > chunk_chars:
+            head, sentence = sentence[:chunk_chars], sentence[chunk_chars:]
+            if current:
+                chunks.append(" ".join(current))
+                current, size = [], 0
+            chunks.append(head)
+        if current and size + len(sentence) > chunk_chars:
+            chunks.append(" ".join(current))
+            carried: List[str] = []
+            carried_size = 0
+            for previous in reversed(current):
+                if carried_size + len(previous) > overlap_chars:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            current, size = carried, carried_size
+        current.append(sentence)
+        size += len(sentence) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class KnowledgeIndex:
+    """BM25 index over knowledge chunks"""
+
+    def __init__(self, chunks: List[str], vocabulary: Dict[str, int], term_offsets: np.ndarray,
+                 chunk_ids: np.ndarray, weights: np.ndarray):
+        self.chunks = chunks
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.chunk_ids = chunk_ids
+        self.weights = weights
+
+    @classmethod
+    def build(cls, chunks: List[str], k1: float = 1.5, b: float = 0.75) -> "KnowledgeIndex":
+        """
+        Build the index
+
+        Args:
+            chunks: Knowledge text chunks
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalization
+        """
+        vocabulary: Dict[str, int] = {}
+        postings: List[Dict[int, int]] = []
+        lengths = np.zeros(len(chunks), dtype=np.float32)
+        for chunk_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            lengths[chunk_id] = len(tokens)
+            for token in tokens:
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append({})
+                postings[term_id][chunk_id] = postings[term_id].get(chunk_id, 0) + 1
+
+        avg_length = float(lengths.mean()) if len(chunks) else 0.0
+        term_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        for term_id, docs in enumerate(postings):
+            term_offsets[term_id + 1] = term_offsets[term_id] + len(docs)
+        chunk_ids = np.zeros(int(term_offsets[-1]), dtype=np.int32)
+        weights = np.zeros(int(term_offsets[-1]), dtype=np.float32)
+        n_chunks = len(chunks)
+        for term_id, docs in enumerate(postings):
+            start = term_offsets[term_id]
+            ids = np.fromiter(docs.keys(), dtype=np.int32, count=len(docs))
+            tf = np.fromiter(docs.values(), dtype=np.float32, count=len(docs))
+            idf = np.log(1 + (n_chunks - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1 - b + b * lengths[ids] / (avg_length or 1.0))
+            chunk_ids[start:start + len(docs)] = ids
+            weights[start:start + len(docs)] = idf * tf * (k1 + 1) / (tf + norm)
+        return cls(chunks, vocabulary, term_offsets, chunk_ids, weights)
+
+    def search(self, query: str, top_k: int = 4) -> List[Tuple[float, str]]:
+        """
+        Find the chunks most relevant to a question
+
+        Returns:
+            Up to top_k (score, chunk) pairs with a positive score, best first
+        """
+        if not self.chunks:
+            return []
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            np.add.at(scores, self.chunk_ids[start:end], self.weights[start:end])
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), self.chunks[i]) for i in best if scores[i] > 0]
+
+    def save(self, path: str) -> None:
+        """Write the index to a .npz file"""
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez(
+            path,
+            chunks=np.array(self.chunks, dtype=str),
+            terms=np.array(terms, dtype=str),
+            term_offsets=self.term_offsets,
+            chunk_ids=self.chunk_ids,
+            weights=self.weights,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["KnowledgeIndex"]:
+        """Read an index written by save(); None if the file is missing or unreadable"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                terms = data["terms"].tolist()
+                return cls(
+                    chunks=data["chunks"].tolist(),
+                    vocabulary={term: i for i, term in enumerate(terms)},
+                    term_offsets=data["term_offsets"],
+                    chunk_ids=data["chunk_ids"],
+                    weights=data["weights"],
+                )
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chunks": len(self.chunks),
+            "terms": len(self.vocabulary),
+            "characters": sum(len(c) for c in self.chunks),
+        }
@@ -0,0 +1,241 @@
+"""
+Precomputed chatbot knowledge artifact.
+
+Extracting text from the knowledge PDFs is the slowest part of startup and
+grows with the document set. The extracted, whitespace-normalized text and
+the BM25 index built from it are written once to an artifact directory:
+
+    manifest.json    every source PDF with size, mtime, SHA-256 and extracted length
+    index.npz        KnowledgeIndex arrays
+    documents.json   normalized text per document (only read in "full" mode)
+
+At startup the manifest is compared with the PDFs on disk (size + mtime; the
+hash is only recomputed when those differ) and the artifact is loaded as-is
+when nothing changed. PDFs without extractable text (e.g. scans) are recorded
+too, so they do not trigger a rebuild on every start, and paths inside the
+knowledge directory are stored relative to it, so the artifact survives the
+checkout moving. Build it ahead of deployment with:
+
+    python -m services.knowledge_store
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+from typing import Dict, List, Optional
+
+from pypdf import PdfReader
+
+from services.knowledge_index import KnowledgeIndex, chunk_text
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_VERSION = 2
+
+
+def extract_pdf_text(path: str) -> str:
+    """Whitespace-normalized text of every page of a PDF ("" on error)"""
+    try:
+        reader = PdfReader(path)
+        parts = []
+        for page in reader.pages:
+            text = re.sub(r"\s+", " ", page.extract_text() or "").strip()
+            if text:
+                parts.append(text)
+        return " ".join(parts)
+    except Exception as e:
+        logger.warning("⚠️  Failed to load knowledge PDF %s: %s", path, e)
+        return ""
+
+
+def discover_knowledge_paths(knowledge_dir: str, extra_path: Optional[str] = None) -> List[str]:
+    """All PDFs in knowledge_dir plus an optional extra PDF, sorted and de-duplicated"""
+    paths = glob.glob(os.path.join(knowledge_dir, "*.pdf")) + glob.glob(os.path.join(knowledge_dir, "*.PDF"))
+    if extra_path and os.path.isfile(extra_path):
+        paths.append(extra_path)
+    return sorted({os.path.abspath(p) for p in paths})
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_entry(path: str, key: str, chars: int) -> Dict:
+    stat = os.stat(path)
+    return {"path": key, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": _file_sha256(path),
+            "chars": chars}
+
+
+class KnowledgeBase:
+    """Loaded knowledge artifact"""
+
+    def __init__(self, index: KnowledgeIndex, artifact_dir: str, sources: List[Dict]):
+        self.index = index
+        self.artifact_dir = artifact_dir
+        self.sources = sources
+
+    def documents(self) -> List[Dict]:
+        """[{"name", "text"}] for every source document (read from disk on demand)"""
+        with open(os.path.join(self.artifact_dir, "documents.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @property
+    def document_count(self) -> int:
+        """Source documents that had text"""
+        return sum(1 for s in self.sources if s.get("chars"))
+
+    @property
+    def fingerprint(self) -> str:
+        """Changes whenever any source document changes"""
+        return hashlib.sha256("".join(s["sha256"] for s in self.sources).encode()).hexdigest()[:16]
+
+
+class KnowledgeStore:
+    """Builds and loads the knowledge artifact for a set of PDFs"""
+
+    def __init__(self, paths: List[str], artifact_dir: str, base_dir: Optional[str] = None,
+                 chunk_chars: int = 1000, overlap_chars: int = 150):
+        """
+        Args:
+            paths: Source PDF paths
+            artifact_dir: Directory holding the built artifact
+            base_dir: Knowledge directory; sources inside it are recorded by relative path
+            chunk_chars: Target chunk size for the retrieval index
+            overlap_chars: Overlap between consecutive chunks
+        """
+        self.paths = paths
+        self.artifact_dir = artifact_dir
+        self.base_dir = os.path.abspath(base_dir) if base_dir else None
+        self.chunk_chars = chunk_chars
+        self.overlap_chars = overlap_chars
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.artifact_dir, "manifest.json")
+
+    def _key(self, path: str) -> str:
+        """Manifest path of a source: relative to base_dir when inside it, else absolute"""
+        path = os.path.abspath(path)
+        if self.base_dir and os.path.commonpath([self.base_dir, path]) == self.base_dir:
+            return os.path.relpath(path, self.base_dir)
+        return path
+
+    def load(self) -> Optional[KnowledgeBase]:
+        """
+        Load the artifact, rebuilding it first if the sources changed
+
+        Returns:
+            KnowledgeBase, or None if there are no knowledge documents
+        """
+        if not self.paths:
+            return None
+        manifest = self._read_manifest()
+        if manifest is not None and self._is_current(manifest):
+            if not any(s.get("chars") for s in manifest["sources"]):
+                # Unchanged, and none of the PDFs has text
+                return None
+            index = KnowledgeIndex.load(os.path.join(self.artifact_dir, "index.npz"))
+            if index is not None:
+                return KnowledgeBase(index, self.artifact_dir, manifest["sources"])
+        return self.build()
+
+    def build(self) -> Optional[KnowledgeBase]:
+        """Extract all documents, index them and write the artifact"""
+        start = time.time()
+        documents, chunks, sources = [], [], []
+        for path in self.paths:
+            text = extract_pdf_text(path)
+            # Recorded even without text, so an image-only PDF does not look like a new source next time
+            sources.append(_source_entry(path, self._key(path), len(text)))
+            if not text:
+                logger.warning("⚠️  Knowledge PDF %s has no extractable text, skipping it", path)
+                continue
+            documents.append({"name": os.path.basename(path), "text": text})
+            chunks.extend(chunk_text(text, self.chunk_chars, self.overlap_chars))
+        index = KnowledgeIndex.build(chunks) if documents else None
+
+        # Write into a staging directory and swap it in so readers never see a partial artifact
+        staging_dir = f"{self.artifact_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        if index is not None:
+            index.save(os.path.join(staging_dir, "index.npz"))
+            with open(os.path.join(staging_dir, "documents.json"), "w", encoding="utf-8") as f:
+                json.dump(documents, f)
+        with open(os.path.join(staging_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(self._manifest(sources), f, indent=2)
+        shutil.rmtree(self.artifact_dir, ignore_errors=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.artifact_dir)), exist_ok=True)
+        os.replace(staging_dir, self.artifact_dir)
+
+        if index is None:
+            return None
+        logger.info(
+            "✅ Knowledge artifact built in %.2fs: %d documents, %d chunks -> %s",
+            time.time() - start, len(documents), len(chunks), self.artifact_dir,
+        )
+        return KnowledgeBase(index, self.artifact_dir, sources)
+
+    def _manifest(self, sources: List[Dict]) -> Dict:
+        return {
+            "version": ARTIFACT_VERSION,
+            "chunk_chars": self.chunk_chars,
+            "overlap_chars": self.overlap_chars,
+            "sources": sources,
+        }
+
+    def _read_manifest(self) -> Optional[Dict]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_current(self, manifest: Dict) -> bool:
+        """True if the manifest describes exactly the current sources"""
+        if (manifest.get("version") != ARTIFACT_VERSION
+                or manifest.get("chunk_chars") != self.chunk_chars
+                or manifest.get("overlap_chars") != self.overlap_chars):
+            return False
+        recorded = {s["path"]: s for s in manifest.get("sources", [])}
+        keys = {self._key(path): path for path in self.paths}
+        if set(recorded) != set(keys):
+            # A PDF was added or removed
+            return False
+        touched = False
+        for key, path in keys.items():
+            entry = recorded[key]
+            stat = os.stat(path)
+            if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+                continue
+            # Touched but possibly unchanged (e.g. re-copied): fall back to the content hash
+            if stat.st_size != entry["size"] or _file_sha256(path) != entry["sha256"]:
+                return False
+            entry["mtime_ns"] = stat.st_mtime_ns
+            touched = True
+        if touched:
+            with open(self.manifest_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+        return True
+
+
+if __name__ == "__main__":
+    # Offline build: python -m services.knowledge_store [knowledge_dir] [artifact_dir]
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    knowledge_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv("KNOWLEDGE_DIR") or os.path.join(service_dir, "knowledge")
+    artifact_dir = sys.argv[2] if len(sys.argv) > 2 else os.getenv("KNOWLEDGE_ARTIFACT_DIR") or os.path.join(service_dir, "cache", "knowledge")
+    store = KnowledgeStore(discover_knowledge_paths(knowledge_dir, os.getenv("KNOWLEDGE_PDF_PATH")), artifact_dir,
+                           base_dir=knowledge_dir)
+    if store.build() is None:
+        logger.error("⚠️  No knowledge PDFs with text found in %s", knowledge_dir)
+        sys.exit(1)
@@ -0,0 +1,284 @@
+"""
+Runtime Gemini model pool with per-model circuit breakers.
+
+Every analyzer call used to go to the one model picked at startup, so a
+degraded or quota-exhausted model cost each request up to three attempts with
+backoff sleeps. The pool holds the preferred model followed by fallbacks, each
+behind a circuit breaker fed with a rolling window of call outcomes (errors
+and calls slower than a threshold count as unhealthy). When too much of the
+window is unhealthy the breaker opens and calls go to the next model; after a
+cool-down a single probe call is let through (half-open), and its outcome
+closes the breaker or re-opens it for twice as long. A 429 opens the breaker
+for the delay the API suggests, and models whose daily budget in the quota
+scheduler is spent are skipped.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+from services.instrumentation import record_breaker_transition
+from services.rate_limiter import QuotaExceeded, QuotaScheduler, normalize_model_name
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+PERMIT_CALL = "call"
+PERMIT_PROBE = "probe"
+
+# Caused by the request or the API key, not the model: another model would fail the same way
+REQUEST_ERRORS = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.PermissionDenied,
+    google_exceptions.Unauthenticated,
+    google_exceptions.FailedPrecondition,
+)
+
+
+class ModelUnavailable(QuotaExceeded):
+    """Raised when no model in the pool can take a call (breakers open or daily quota spent)"""
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for 429 / quota errors from the API"""
+    message = str(error).lower()
+    return (isinstance(error, google_exceptions.ResourceExhausted)
+            or "429" in message or "quota" in message or "rate limit" in message)
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a rolling window of call outcomes"""
+
+    def __init__(self, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 15.0, open_seconds: float = 30.0, max_open_seconds: float = 600.0,
+                 on_transition: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            window: Number of recent calls the failure rate is computed over
+            min_calls: Calls needed in the window before the breaker may open
+            failure_rate: Share of unhealthy calls (errors + slow calls) that opens the breaker
+            slow_call_seconds: Successful calls slower than this count as unhealthy
+            open_seconds: Cool-down before the first half-open probe
+            max_open_seconds: Cap for the cool-down, which doubles after each failed probe
+            on_transition: Called with the new state on every state change
+        """
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.on_transition = on_transition
+        self.state = CLOSED
+        self.open_until = 0.0
+        self._cooldown = open_seconds
+        self._probe_in_flight = False
+        # True = healthy call
+        self._outcomes: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            if self.on_transition:
+                self.on_transition(state)
+
+    def _open(self, seconds: float) -> None:
+        self.open_until = max(self.open_until, time.monotonic() + seconds)
+        self._probe_in_flight = False
+        self._set_state(OPEN)
+
+    def try_acquire(self) -> Optional[str]:
+        """
+        Ask to send one call to this model
+
+        Returns:
+            PERMIT_CALL, PERMIT_PROBE (the single half-open trial call), or None if the breaker is open
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return PERMIT_CALL
+            if self.state == OPEN:
+                if time.monotonic() < self.open_until:
+                    return None
+                self._set_state(HALF_OPEN)
+            if self._probe_in_flight:
+                return None
+            self._probe_in_flight = True
+            return PERMIT_PROBE
+
+    def release(self, permit: str) -> None:
+        """Give back a permit whose call was never sent (e.g. shed by the quota scheduler)"""
+        if permit == PERMIT_PROBE:
+            with self._lock:
+                self._probe_in_flight = False
+
+    def record(self, permit: str, healthy: bool) -> None:
+        """Feed back the outcome of a call made with the given permit"""
+        with self._lock:
+            if permit == PERMIT_PROBE:
+                if healthy:
+                    self._probe_in_flight = False
+                    self._outcomes.clear()
+                    self._cooldown = self.open_seconds
+                    self._set_state(CLOSED)
+                else:
+                    self._cooldown = min(self._cooldown * 2, self.max_open_seconds)
+                    self._open(self._cooldown)
+                return
+            self._outcomes.append(healthy)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and self.unhealthy_ratio() >= self.failure_rate):
+                self._open(self._cooldown)
+
+    def trip(self, seconds: Optional[float] = None) -> None:
+        """Open immediately, e.g. after a 429 with a known retry delay"""
+        with self._lock:
+            self._open(seconds if seconds else self._cooldown)
+
+    def unhealthy_ratio(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def seconds_until_probe(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_until - time.monotonic())
+
+
+class PoolMember:
+    """One model in the pool with its breaker and call statistics"""
+
+    def __init__(self, name: str, model, breaker: CircuitBreaker):
+        self.name = name
+        self.model = model
+        self.breaker = breaker
+        self.calls = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.avg_latency: Optional[float] = None
+        # Successful call latencies, for percentile-based hedging
+        self.recent_latencies: deque = deque(maxlen=200)
+
+
+class ModelPool:
+    """Ordered Gemini models; calls go to the first model whose breaker and daily quota allow it"""
+
+    def __init__(self, model_names: List[str], model_factory: Callable[[str], object],
+                 scheduler: Optional[QuotaScheduler] = None, breaker_settings: Optional[Dict] = None,
+                 previous: Optional["ModelPool"] = None):
+        """
+        Args:
+            model_names: Model ids in preference order (duplicates are dropped)
+            model_factory: Builds a GenerativeModel for a model id
+            scheduler: Quota scheduler whose daily budgets decide which models are skipped
+            breaker_settings: CircuitBreaker keyword arguments shared by every model
+            previous: Pool being replaced; models it already holds keep their breaker
+                state, call statistics and latency history
+        """
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self.members: List[PoolMember] = []
+        kept = {m.name: m for m in previous.members} if previous else {}
+        for model_name in model_names:
+            name = normalize_model_name(model_name)
+            if not name or name in (m.name for m in self.members):
+                continue
+            if name in kept:
+                self.members.append(kept[name])
+                continue
+            breaker = CircuitBreaker(**(breaker_settings or {}), on_transition=self._transition_logger(name))
+            self.members.append(PoolMember(name, model_factory(model_name), breaker))
+        if not self.members:
+            raise ValueError("Model pool needs at least one model")
+
+    @staticmethod
+    def _transition_logger(name: str) -> Callable[[str], None]:
+        def log_transition(state: str) -> None:
+            record_breaker_transition(name, state)
+            if state == OPEN:
+                logger.warning("⚠️  Circuit breaker opened for %s, failing over", name)
+            else:
+                logger.info("🔌 Circuit breaker for %s is %s", name, state.replace("_", "-"))
+        return log_transition
+
+    @property
+    def primary(self) -> PoolMember:
+        return self.members[0]
+
+    def holds(self, model_names: List[str]) -> bool:
+        """True if the pool already has exactly these models, in this order"""
+        names = [normalize_model_name(name) for name in model_names]
+        return [m.name for m in self.members] == [name for name in dict.fromkeys(names) if name]
+
+    def candidates(self) -> List[PoolMember]:
+        """Members with daily quota left, in preference order (breakers are checked per call)"""
+        if not self.scheduler:
+            return list(self.members)
+        return [m for m in self.members if self.scheduler.has_daily_budget(m.name)]
+
+    def record_success(self, member: PoolMember, permit: str, seconds: float) -> None:
+        self._observe(member, seconds)
+        with self._lock:
+            member.recent_latencies.append(seconds)
+        member.breaker.record(permit, healthy=seconds < member.breaker.slow_call_seconds)
+
+    def latencies(self, member: PoolMember) -> List[float]:
+        """Recent successful call latencies of a member, oldest first"""
+        with self._lock:
+            return list(member.recent_latencies)
+
+    def record_failure(self, member: PoolMember, permit: str, error: Exception, seconds: float,
+                       retry_after: Optional[float] = None) -> None:
+        """
+        Count a failed call against the model
+
+        Request errors (bad input, bad key) do not count against the model's
+        health; rate limits open the breaker until retry_after.
+        """
+        self._observe(member, seconds)
+        if isinstance(error, REQUEST_ERRORS):
+            member.breaker.release(permit)
+            return
+        with self._lock:
+            member.failures += 1
+        if is_rate_limit_error(error):
+            with self._lock:
+                member.rate_limited += 1
+            member.breaker.trip(retry_after)
+            return
+        member.breaker.record(permit, healthy=False)
+
+    def _observe(self, member: PoolMember, seconds: float) -> None:
+        with self._lock:
+            member.calls += 1
+            member.avg_latency = seconds if member.avg_latency is None else 0.8 * member.avg_latency + 0.2 * seconds
+
+    def unavailable_error(self) -> ModelUnavailable:
+        """Error for a call no model could take, with the time until the first probe"""
+        message = "No Gemini model available (circuit breakers open or daily quota exhausted)"
+        waits = [m.breaker.seconds_until_probe() for m in self.members if m.breaker.state == OPEN]
+        if waits:
+            message += f", retry in {max(1.0, min(waits)):.0f}s"
+        return ModelUnavailable(message)
+
+    def stats(self) -> List[Dict]:
+        """Per-model breaker state and call statistics, in preference order"""
+        with self._lock:
+            return [{
+                "model": m.name,
+                "state": m.breaker.state,
+                "health": round(1 - m.breaker.unhealthy_ratio(), 2),
+                "reopens_in_seconds": round(m.breaker.seconds_until_probe(), 1) or None,
+                "calls": m.calls,
+                "failures": m.failures,
+                "rate_limited": m.rate_limited,
+                "avg_latency_ms": round(m.avg_latency * 1000) if m.avg_latency is not None else None,
+                "daily_budget_left": self.scheduler.has_daily_budget(m.name) if self.scheduler else None,
+            } for m in self.members]
@@ -0,0 +1,146 @@
+"""
+Cached Gemini model discovery.
+
+genai.list_models() is a network call that used to run on every boot. The
+resolved vision and chat model ids are now stored in a small JSON file with a
+TTL. Startup uses the cached ids (or the first preference when there is no
+cache yet) without listing, and a background thread refreshes the file when
+it is missing or stale. Requests call refresh_if_stale(), so a long-running
+process re-resolves the ids once the TTL has passed.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Wait before retrying a failed discovery (at most the TTL)
+RETRY_SECONDS = 300
+
+
+class ModelRegistry:
+    """Persists resolved model ids and refreshes them lazily"""
+
+    def __init__(self, cache_path: str, ttl_seconds: float = 86400):
+        """
+        Args:
+            cache_path: JSON file holding the last discovery result
+            ttl_seconds: Age after which the cached ids are refreshed in the background
+        """
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_seconds
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # When the ids in use were resolved, and when a refresh was last started
+        self._resolved_at = 0.0
+        self._last_attempt = 0.0
+
+    def load(self) -> Optional[Dict]:
+        """
+        Read the cached discovery result
+
+        Returns:
+            {"vision_model", "chat_model", "resolved_at"} or None if missing/unreadable
+        """
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not entry.get("vision_model"):
+            return None
+        self._resolved_at = float(entry.get("resolved_at", 0))
+        return entry
+
+    def is_fresh(self, entry: Optional[Dict]) -> bool:
+        """True if the entry exists and is younger than the TTL"""
+        return bool(entry) and time.time() - float(entry.get("resolved_at", 0)) < self.ttl_seconds
+
+    def save(self, vision_model: str, chat_model: Optional[str]) -> Dict:
+        """Write a discovery result atomically"""
+        entry = {"vision_model": vision_model, "chat_model": chat_model, "resolved_at": time.time()}
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.cache_path)
+        self._resolved_at = entry["resolved_at"]
+        return entry
+
+    def discover(self, select_vision_model: Callable[[List[str]], Optional[str]],
+                 chat_candidates: List[str]) -> Optional[Dict]:
+        """
+        List models (blocking network call), resolve and persist the ids
+
+        Args:
+            select_vision_model: Picks the vision model from the listed names
+            chat_candidates: Chat model ids in order of preference
+
+        Returns:
+            Saved entry, or None if no vision model could be resolved
+        """
+        available = [
+            model.name.split("/")[-1]
+            for model in genai.list_models()
+            if "generateContent" in model.supported_generation_methods
+        ]
+        vision_model = select_vision_model(available)
+        if not vision_model:
+            return None
+        chat_model = next((m for m in chat_candidates if m in available), None)
+        return self.save(vision_model, chat_model)
+
+    def refresh_in_background(self, select_vision_model: Callable[[List[str]], Optional[str]],
+                              chat_candidates: List[str], on_update: Callable[[Dict], None]) -> bool:
+        """
+        Run discover() on a daemon thread and pass the result to on_update
+
+        Does nothing if a refresh is already running.
+
+        Returns:
+            True if a refresh was started
+        """
+        def refresh():
+            start = time.time()
+            try:
+                entry = self.discover(select_vision_model, chat_candidates)
+            except Exception as e:
+                logger.warning("⚠️  Background model discovery failed: %s", e)
+                return
+            if entry:
+                logger.info(
+                    "✅ Model discovery refreshed in %.2fs: vision=%s, chat=%s",
+                    time.time() - start, entry["vision_model"], entry["chat_model"],
+                )
+                on_update(entry)
+
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return False
+            self._last_attempt = time.time()
+            self._refresh_thread = threading.Thread(target=refresh, name="model-discovery", daemon=True)
+            self._refresh_thread.start()
+        return True
+
+    def refresh_if_stale(self, select_vision_model: Callable[[List[str]], Optional[str]],
+                         chat_candidates: List[str], on_update: Callable[[Dict], None]) -> bool:
+        """
+        refresh_in_background() once the ids in use are older than the TTL
+
+        Cheap enough to call on every request; a failed refresh is retried
+        after RETRY_SECONDS (or the TTL, if shorter).
+
+        Returns:
+            True if a refresh was started
+        """
+        now = time.time()
+        if now - self._resolved_at < self.ttl_seconds:
+            return False
+        if now - self._last_attempt < min(RETRY_SECONDS, self.ttl_seconds):
+            return False
+        return self.refresh_in_background(select_vision_model, chat_candidates, on_update)
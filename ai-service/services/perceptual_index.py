@@ -0,0 +1,279 @@
+"""
+Perceptual hash index for near-duplicate images.
+
+The prediction cache is keyed by the SHA-256 of the image bytes, so the same
+photo re-encoded, resized or lightly cropped (common when a donor re-posts a
+donation) misses it and costs another Gemini analysis. Each analyzed image
+also gets a 64-bit difference hash (dHash: a 9x8 grayscale thumbnail, one bit
+per horizontally adjacent pixel pair), which barely changes under those
+edits, and lookups find the closest indexed hash within a Hamming distance
+threshold.
+
+Lookups use multi-index hashing: the 64 bits are split into threshold + 1
+bands, and by the pigeonhole principle any hash within the threshold matches
+at least one band exactly. Each band maps its value to a compact array of
+entry positions, so a lookup only compares the few candidates sharing a band
+(vectorized XOR + popcount over a uint64 array) instead of scanning the
+index; it stays well under a millisecond at millions of entries. Entries are
+kept in memory (about 100 bytes each plus the URL) and optionally in a SQLite
+file that is loaded at startup.
+"""
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+HASH_BITS = 64
+
+# Thumbnails with less gray-level spread than this carry no usable structure
+# (blank or uniform frames would all hash to 0 and "match" each other)
+MIN_THUMBNAIL_RANGE = 8
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(values)
+else:
+    _BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return _BYTE_BITS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def perceptual_hash(data: bytes) -> Optional[int]:
+    """
+    64-bit dHash of image bytes
+
+    Args:
+        data: Image file contents
+
+    Returns:
+        Hash as an unsigned int, or None if the image is too uniform to hash
+        meaningfully (or cannot be decoded)
+    """
+    try:
+        image = Image.open(BytesIO(data))
+        if image.format == "JPEG":
+            # Decoding at 1/8 scale is plenty for a 9x8 thumbnail
+            image.draft("L", (64, 64))
+        return perceptual_hash_image(ImageOps.exif_transpose(image))
+    except Exception:
+        return None
+
+
+def perceptual_hash_image(image: Image.Image) -> Optional[int]:
+    """
+    64-bit dHash of an already-decoded image
+
+    Lets callers that decode the image anyway (the analyzer decodes it for
+    the upload) hash it without decoding the file a second time.
+
+    Args:
+        image: Decoded, upright image of any size and mode
+
+    Returns:
+        Hash as an unsigned int, or None if the image is too uniform to hash meaningfully
+    """
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("L")
+    thumbnail = image.resize((9, 8), Image.BILINEAR, reducing_gap=2.0)
+    if thumbnail.mode != "L":
+        thumbnail = thumbnail.convert("L")
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    if int(pixels.max()) - int(pixels.min()) < MIN_THUMBNAIL_RANGE:
+        return None
+    bits = np.packbits((pixels[:, 1:] > pixels[:, :-1]).flatten())
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+class PerceptualMatch:
+    """Closest indexed image for a lookup"""
+
+    def __init__(self, distance: int, image_hash: str, image_url: Optional[str], created_at: float):
+        self.distance = distance
+        self.image_hash = image_hash
+        self.image_url = image_url
+        self.created_at = created_at
+
+    def as_flag(self) -> Dict:
+        """duplicateOf field of a prediction"""
+        return {
+            "imageUrl": self.image_url,
+            "distance": self.distance,
+            "firstSeenAt": datetime.fromtimestamp(self.created_at, timezone.utc).isoformat(timespec="seconds"),
+        }
+
+
+class PerceptualIndex:
+    """Multi-index Hamming search over 64-bit perceptual hashes"""
+
+    def __init__(self, threshold: int = 4, max_entries: int = 1_000_000, db_path: Optional[str] = None):
+        """
+        Create the index
+
+        Args:
+            threshold: Largest Hamming distance (out of 64 bits) treated as the same image
+            max_entries: Entries kept; the oldest 10% are dropped when the index is full
+            db_path: Optional SQLite file for a persistent backing store
+        """
+        if not 0 <= threshold < 16:
+            raise ValueError("Perceptual hash threshold must be between 0 and 15")
+        self.threshold = threshold
+        self.max_entries = max(10, max_entries)
+        self.db_path = db_path
+        # threshold + 1 bands of (almost) equal width covering all 64 bits
+        band_count = threshold + 1
+        widths = [HASH_BITS // band_count + (1 if i < HASH_BITS % band_count else 0) for i in range(band_count)]
+        self._bands = []
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self._bands.append((shift, (1 << width) - 1))
+        self._lock = threading.Lock()
+        self._hashes = np.zeros(1024, dtype=np.uint64)
+        self._created = np.zeros(1024, dtype=np.float64)
+        self._content: List[bytes] = []
+        self._urls: List[Optional[str]] = []
+        self._buckets: List[Dict[int, array]] = [{} for _ in self._bands]
+        self._counts = {"lookups": 0, "matches": 0, "reused": 0, "added": 0, "dropped": 0}
+        self._lookup_seconds = 0.0
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS perceptual_hashes ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, phash INTEGER NOT NULL, image_hash TEXT NOT NULL, "
+            "image_url TEXT, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_perceptual_created ON perceptual_hashes(created_at)")
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT phash, image_hash, image_url, created_at FROM perceptual_hashes ORDER BY id DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for phash, image_hash, image_url, created_at in reversed(rows):
+            self._append(phash % (1 << HASH_BITS), image_hash, image_url, created_at)
+
+    def _band_values(self, phash: int) -> List[int]:
+        return [(phash >> shift) & mask for shift, mask in self._bands]
+
+    def _append(self, phash: int, image_hash: str, image_url: Optional[str], created_at: float) -> None:
+        position = len(self._content)
+        if position == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros(position, dtype=np.uint64)])
+            self._created = np.concatenate([self._created, np.zeros(position, dtype=np.float64)])
+        self._hashes[position] = phash
+        self._created[position] = created_at
+        self._content.append(bytes.fromhex(image_hash))
+        self._urls.append(image_url)
+        for buckets, value in zip(self._buckets, self._band_values(phash)):
+            bucket = buckets.get(value)
+            if bucket is None:
+                bucket = buckets[value] = array("I")
+            bucket.append(position)
+
+    def lookup(self, phash: int) -> Optional[PerceptualMatch]:
+        """
+        Find the closest indexed image within the threshold
+
+        Args:
+            phash: perceptual_hash() or perceptual_hash_image() of the image
+
+        Returns:
+            The nearest match (earliest entry on ties), or None
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._counts["lookups"] += 1
+            groups = [buckets.get(value) for buckets, value in zip(self._buckets, self._band_values(phash))]
+            groups = [np.frombuffer(group, dtype=np.uint32) for group in groups if group]
+            match = None
+            if groups:
+                candidates = np.concatenate(groups) if len(groups) > 1 else groups[0]
+                distances = _popcount(self._hashes[candidates] ^ np.uint64(phash))
+                within = distances <= self.threshold
+                if within.any():
+                    candidates, distances = candidates[within], distances[within]
+                    best = np.lexsort((candidates, distances))[0]
+                    position = int(candidates[best])
+                    match = PerceptualMatch(int(distances[best]), self._content[position].hex(),
+                                            self._urls[position], float(self._created[position]))
+                    self._counts["matches"] += 1
+            self._lookup_seconds += time.perf_counter() - start
+        return match
+
+    def add(self, phash: int, image_hash: str, image_url: Optional[str] = None) -> None:
+        """Index an analyzed image"""
+        now = time.time()
+        with self._lock:
+            if len(self._content) >= self.max_entries:
+                self._drop_oldest(max(1, self.max_entries // 10))
+            self._append(phash, image_hash, image_url, now)
+            self._counts["added"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO perceptual_hashes (phash, image_hash, image_url, created_at) VALUES (?, ?, ?, ?)",
+                    (_to_signed(phash), image_hash, image_url, now),
+                )
+                self._db.commit()
+
+    def record_reuse(self) -> None:
+        """Count a lookup whose match's prediction was returned instead of calling Gemini"""
+        with self._lock:
+            self._counts["reused"] += 1
+
+    def _drop_oldest(self, count: int) -> None:
+        """Remove the oldest entries and rebuild the band buckets (amortized over max_entries / 10 adds)"""
+        size = len(self._content)
+        kept = size - count
+        self._hashes[:kept] = self._hashes[count:size]
+        self._created[:kept] = self._created[count:size]
+        cutoff = float(self._created[0]) if kept else time.time()
+        del self._content[:count]
+        del self._urls[:count]
+        self._buckets = [{} for _ in self._bands]
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            values = (self._hashes[:kept] >> np.uint64(shift)) & np.uint64(mask)
+            order = np.argsort(values, kind="stable")
+            unique, starts = np.unique(values[order], return_index=True)
+            for value, group in zip(unique.tolist(), np.split(order.astype(np.uint32), starts[1:])):
+                buckets[value] = array("I", group.tobytes())
+        self._counts["dropped"] += count
+        if self._db is not None:
+            self._db.execute("DELETE FROM perceptual_hashes WHERE created_at < ?", (cutoff,))
+
+    def stats(self) -> Dict:
+        """Size, lookup/match counts and average lookup time"""
+        with self._lock:
+            lookups = self._counts["lookups"]
+            return {
+                "entries": len(self._content),
+                "threshold": self.threshold,
+                "bands": len(self._bands),
+                **self._counts,
+                "avg_lookup_us": round(self._lookup_seconds / lookups * 1e6, 1) if lookups else None,
+                "persistent": self._db is not None,
+            }
+
+    def close(self) -> None:
+        """Close the SQLite backing store"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
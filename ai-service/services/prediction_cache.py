@@ -0,0 +1,204 @@
+"""
+Content-addressed cache for /predict results.
+
+Results are keyed by the SHA-256 of the downloaded image bytes, with the image
+URL as a first-level key so a repeated URL skips the download as well. Entries
+expire after a TTL and the in-memory store is a size-bounded LRU. An optional
+SQLite file keeps entries across restarts.
+"""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def hash_image_bytes(data: bytes) -> str:
+    """Content key for raw image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    """TTL + LRU cache of parsed analyze_image results"""
+
+    def __init__(self, ttl_seconds: float = 86400, max_entries: int = 1024, db_path: Optional[str] = None):
+        """
+        Create the cache
+
+        Args:
+            ttl_seconds: How long a result stays valid
+            max_entries: Maximum results kept (in memory and on disk)
+            db_path: Optional SQLite file for a persistent backing store
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # image hash -> (expires_at, result)
+        self._results: "OrderedDict[str, tuple]" = OrderedDict()
+        # image url -> (expires_at, image hash)
+        self._urls: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db = None
+        self.stats_counters = {"url_hits": 0, "hash_hits": 0, "misses": 0, "evictions": 0, "stores": 0}
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "image_hash TEXT PRIMARY KEY, result TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS image_urls ("
+            "url TEXT PRIMARY KEY, image_hash TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_predictions_access ON predictions(last_access)")
+        now = time.time()
+        self._db.execute("DELETE FROM predictions WHERE expires_at < ?", (now,))
+        self._db.execute("DELETE FROM image_urls WHERE expires_at < ?", (now,))
+        self._db.commit()
+
+    def get_by_url(self, image_url: str) -> Optional[Dict]:
+        """Look up a result by image URL (no download needed on a hit)"""
+        now = time.time()
+        with self._lock:
+            image_hash = self._lookup_url(image_url, now)
+            result = self._lookup_hash(image_hash, now) if image_hash else None
+            if result is not None:
+                self.stats_counters["url_hits"] += 1
+                return copy.deepcopy(result)
+        return None
+
+    def get(self, image_hash: str, image_url: Optional[str] = None) -> Optional[Dict]:
+        """
+        Look up a result by image content hash
+
+        Args:
+            image_hash: hash_image_bytes() of the downloaded image
+            image_url: If given and the lookup hits, the URL is linked to the hash
+        """
+        now = time.time()
+        with self._lock:
+            result = self._lookup_hash(image_hash, now)
+            if result is None:
+                self.stats_counters["misses"] += 1
+                return None
+            self.stats_counters["hash_hits"] += 1
+            if image_url:
+                self._store_url(image_url, image_hash, now + self.ttl_seconds)
+            return copy.deepcopy(result)
+
+    def put(self, image_hash: str, result: Dict, image_url: Optional[str] = None) -> None:
+        """Store a parsed analysis result"""
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        stored = copy.deepcopy(result)
+        with self._lock:
+            self._results[image_hash] = (expires_at, stored)
+            self._results.move_to_end(image_hash)
+            if image_url:
+                self._store_url(image_url, image_hash, expires_at)
+            self.stats_counters["stores"] += 1
+            self._evict_memory()
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions (image_hash, result, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (image_hash, json.dumps(stored), expires_at, now),
+                )
+                self._evict_disk()
+                self._db.commit()
+
+    def _lookup_url(self, image_url: str, now: float) -> Optional[str]:
+        entry = self._urls.get(image_url)
+        if entry is not None:
+            expires_at, image_hash = entry
+            if expires_at >= now:
+                self._urls.move_to_end(image_url)
+                return image_hash
+            del self._urls[image_url]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT image_hash, expires_at FROM image_urls WHERE url = ?", (image_url,)
+            ).fetchone()
+            if row and row[1] >= now:
+                self._urls[image_url] = (row[1], row[0])
+                return row[0]
+        return None
+
+    def _lookup_hash(self, image_hash: str, now: float) -> Optional[Dict]:
+        entry = self._results.get(image_hash)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at >= now:
+                self._results.move_to_end(image_hash)
+                return result
+            del self._results[image_hash]
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT result, expires_at FROM predictions WHERE image_hash = ?", (image_hash,)
+            ).fetchone()
+            if row and row[1] >= now:
+                result = json.loads(row[0])
+                self._results[image_hash] = (row[1], result)
+                self._evict_memory()
+                self._db.execute(
+                    "UPDATE predictions SET last_access = ? WHERE image_hash = ?", (now, image_hash)
+                )
+                self._db.commit()
+                return result
+        return None
+
+    def _store_url(self, image_url: str, image_hash: str, expires_at: float) -> None:
+        self._urls[image_url] = (expires_at, image_hash)
+        self._urls.move_to_end(image_url)
+        while len(self._urls) > self.max_entries * 2:
+            self._urls.popitem(last=False)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO image_urls (url, image_hash, expires_at) VALUES (?, ?, ?)",
+                (image_url, image_hash, expires_at),
+            )
+            self._db.commit()
+
+    def _evict_memory(self) -> None:
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+            self.stats_counters["evictions"] += 1
+
+    def _evict_disk(self) -> None:
+        count = self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM predictions WHERE image_hash IN "
+                "(SELECT image_hash FROM predictions ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            self._db.execute(
+                "DELETE FROM image_urls WHERE image_hash NOT IN (SELECT image_hash FROM predictions)"
+            )
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                **self.stats_counters,
+                "entries": len(self._results),
+                "persistent": self._db is not None,
+            }
+
+    def close(self) -> None:
+        """Close the SQLite backing store"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
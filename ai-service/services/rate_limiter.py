@@ -0,0 +1,208 @@
+"""
+Process-wide Gemini quota scheduler.
+
+Each model gets a token bucket sized to its requests-per-minute limit and a
+requests-per-day counter. Calls wait for a token (prediction calls ahead of
+chat calls) or are shed immediately when the expected wait is too long or the
+daily budget is spent, instead of being sent to the API only to come back as
+a 429.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+try:
+    from zoneinfo import ZoneInfo
+    # Gemini daily quotas reset at midnight Pacific time
+    QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+except Exception:
+    QUOTA_TIMEZONE = timezone.utc
+
+# Free tier (RPM, RPD) limits, matching the model preference list in GeminiFoodAnalyzer
+MODEL_LIMITS = {
+    "gemini-2.5-flash-lite": (15, 1000),
+    "gemini-2.5-flash": (10, 250),
+    "gemini-2.5-pro": (5, 100),
+    "gemini-1.5-flash-lite": (15, 1000),
+    "gemini-1.5-flash": (15, 1500),
+    "gemini-1.5-pro": (2, 50),
+}
+DEFAULT_LIMITS = (10, 250)
+
+PRIORITY_PREDICT = 0
+PRIORITY_CHAT = 1
+PRIORITY_NAMES = {PRIORITY_PREDICT: "predict", PRIORITY_CHAT: "chat"}
+
+
+class QuotaExceeded(Exception):
+    """Raised when a call is shed because the model's quota cannot serve it in time"""
+
+
+def normalize_model_name(model_name: str) -> str:
+    """'models/gemini-2.5-flash' -> 'gemini-2.5-flash'"""
+    return model_name.split("/")[-1]
+
+
+def parse_model_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parse limit overrides of the form "gemini-2.5-flash=1000/10000,gemini-2.5-pro=150/1000"
+    (model=RPM/RPD), e.g. for paid tiers
+    """
+    limits = {}
+    for entry in (spec or "").split(","):
+        if "=" not in entry:
+            continue
+        model, values = entry.split("=", 1)
+        rpm, _, rpd = values.partition("/")
+        limits[normalize_model_name(model.strip())] = (int(rpm), int(rpd or 0))
+    return limits
+
+
+class _ModelBudget:
+    def __init__(self, rpm: int, rpd: int):
+        self.rpm = max(1, rpm)
+        self.rpd = rpd  # 0 means no daily limit
+        self.tokens = float(self.rpm)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.day = None
+        self.used_today = 0
+        # Waiting callers as (priority, arrival sequence); the smallest goes next
+        self.queue = []
+        self.sequence = 0
+        self.shed = {PRIORITY_PREDICT: 0, PRIORITY_CHAT: 0}
+
+    @property
+    def rate(self) -> float:
+        return self.rpm / 60.0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(float(self.rpm), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        today = datetime.now(QUOTA_TIMEZONE).date()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+
+    def seconds_until_token(self, now: float, queue_ahead: int) -> float:
+        """Time until a token is free for a caller with queue_ahead callers in front"""
+        wait = max(0.0, (queue_ahead + 1 - self.tokens) / self.rate)
+        return max(wait, self.blocked_until - now)
+
+
+class QuotaScheduler:
+    """Token-bucket RPM/RPD scheduler shared by all Gemini calls in the process"""
+
+    def __init__(self, max_wait_seconds: float = 10.0, limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        """
+        Create the scheduler
+
+        Args:
+            max_wait_seconds: Longest a call may queue for a token before it is shed
+            limits: Per-model (RPM, RPD) overrides on top of MODEL_LIMITS
+        """
+        self.max_wait_seconds = max_wait_seconds
+        self.limits = dict(MODEL_LIMITS)
+        self.limits.update(limits or {})
+        self._cond = threading.Condition()
+        self._budgets: Dict[str, _ModelBudget] = {}
+
+    def _budget(self, model: str) -> _ModelBudget:
+        budget = self._budgets.get(model)
+        if budget is None:
+            rpm, rpd = self.limits.get(model, DEFAULT_LIMITS)
+            budget = self._budgets[model] = _ModelBudget(rpm, rpd)
+        return budget
+
+    def acquire(self, model_name: str, priority: int = PRIORITY_PREDICT, max_wait: Optional[float] = None) -> None:
+        """
+        Reserve one request against a model's quota, waiting if necessary
+
+        Args:
+            model_name: Gemini model id (with or without the "models/" prefix)
+            priority: PRIORITY_PREDICT or PRIORITY_CHAT; chat waits while predictions are queued
+            max_wait: Overrides max_wait_seconds for this call
+
+        Raises:
+            QuotaExceeded: If the daily budget is spent or the wait would exceed max_wait
+        """
+        model = normalize_model_name(model_name)
+        max_wait = self.max_wait_seconds if max_wait is None else max_wait
+        with self._cond:
+            budget = self._budget(model)
+            start = time.monotonic()
+            budget.sequence += 1
+            ticket = (priority, budget.sequence)
+            budget.queue.append(ticket)
+            budget.queue.sort()
+            try:
+                while True:
+                    now = time.monotonic()
+                    budget.refill(now)
+                    if budget.rpd and budget.used_today >= budget.rpd:
+                        budget.shed[priority] += 1
+                        raise QuotaExceeded(
+                            f"Daily quota exhausted for {model} ({budget.rpd} requests per day)"
+                        )
+                    # Higher-priority and earlier callers go first
+                    ahead = budget.queue.index(ticket)
+                    wait = budget.seconds_until_token(now, ahead)
+                    if ahead == 0 and wait <= 0:
+                        budget.tokens -= 1
+                        budget.used_today += 1
+                        return
+                    if now - start + wait > max_wait:
+                        budget.shed[priority] += 1
+                        raise QuotaExceeded(
+                            f"Rate limit: {model} quota ({budget.rpm} requests per minute) cannot serve "
+                            f"this {PRIORITY_NAMES.get(priority, 'request')} request, retry in {wait:.0f}s"
+                        )
+                    self._cond.wait(timeout=max(0.05, min(wait, max_wait)))
+            finally:
+                budget.queue.remove(ticket)
+                self._cond.notify_all()
+
+    def has_daily_budget(self, model_name: str) -> bool:
+        """True unless the model's requests-per-day budget is spent"""
+        model = normalize_model_name(model_name)
+        with self._cond:
+            budget = self._budget(model)
+            budget.refill(time.monotonic())
+            return not budget.rpd or budget.used_today < budget.rpd
+
+    def record_rate_limited(self, model_name: str, retry_after: Optional[float] = None) -> None:
+        """
+        Feed back a 429 from the API: empty the bucket and pause the model
+
+        Args:
+            model_name: Model that returned the 429
+            retry_after: Delay suggested by the API, in seconds
+        """
+        model = normalize_model_name(model_name)
+        with self._cond:
+            budget = self._budget(model)
+            budget.tokens = 0.0
+            budget.updated = time.monotonic()
+            if retry_after:
+                budget.blocked_until = max(budget.blocked_until, budget.updated + retry_after)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Dict]:
+        """Remaining per-minute and per-day budget for every model seen so far"""
+        with self._cond:
+            now = time.monotonic()
+            out = {}
+            for model, budget in self._budgets.items():
+                budget.refill(now)
+                out[model] = {
+                    "rpm_limit": budget.rpm,
+                    "rpd_limit": budget.rpd,
+                    "tokens_available": round(budget.tokens, 2),
+                    "requests_today": budget.used_today,
+                    "remaining_today": max(0, budget.rpd - budget.used_today) if budget.rpd else None,
+                    "waiting": {name: sum(1 for p, _ in budget.queue if p == priority)
+                                for priority, name in PRIORITY_NAMES.items()},
+                    "shed": {PRIORITY_NAMES[p]: n for p, n in budget.shed.items()},
+                }
+            return out
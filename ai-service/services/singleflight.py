@@ -0,0 +1,72 @@
+"""
+In-flight request coalescing ("singleflight").
+
+Concurrent callers asking for the same key share one execution: the first
+caller starts the work, later callers await the same task and receive its
+result or exception. Used so retry storms and duplicate submissions of the
+same image cost one download and one set of Gemini calls.
+
+The shared work runs under a SharedDeadline joined by every caller, so it is
+bounded by the latest caller deadline and only cancelled once all callers have
+disconnected, rather than by whichever caller happened to start it.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from services.deadline import SharedDeadline, current_deadline, deadline_var
+
+
+class SingleFlight:
+    """Coalesces concurrent async calls that share a key"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._deadlines: Dict[str, SharedDeadline] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn() once per key among concurrent callers
+
+        Args:
+            key: Identity of the work (e.g. image URL or content hash)
+            fn: Coroutine factory; only called by the first caller
+
+        Returns:
+            The shared result (exceptions are re-raised to every caller)
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            deadline = self._deadlines[key] = SharedDeadline()
+            # A separate task so one caller going away does not cancel the work for the others
+            task = asyncio.ensure_future(self._run(fn, deadline))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._done(k, t))
+        else:
+            self.coalesced += 1
+        self._deadlines[key].join(current_deadline())
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _run(fn: Callable[[], Awaitable[Any]], deadline: SharedDeadline) -> Any:
+        # The task has its own copy of the context: this only affects the shared work
+        deadline_var.set(deadline)
+        return await fn()
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._deadlines[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Executions started, callers that joined an in-flight execution, and current in-flight keys"""
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
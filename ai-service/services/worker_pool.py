@@ -0,0 +1,91 @@
+"""
+Bounded worker pool for running blocking Gemini and image download work
+off the asyncio event loop.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class WorkerPoolFull(Exception):
+    """Raised when the pool already holds its maximum amount of pending work"""
+
+
+class WorkerPool:
+    """Thread pool with a cap on queued + running jobs"""
+
+    def __init__(self, max_workers: int = 8, max_pending: int = 32, name: str = "ai-worker"):
+        """
+        Create the pool
+
+        Args:
+            max_workers: Number of threads executing blocking calls concurrently
+            max_pending: Maximum jobs allowed in the pool (running + waiting);
+                         further submissions are rejected instead of queueing forever
+            name: Thread name prefix
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run a blocking callable in the pool and await its result
+
+        The caller's contextvars are copied into the worker thread.
+
+        Raises:
+            WorkerPoolFull: If max_pending jobs are already in the pool
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise WorkerPoolFull(
+                    f"AI worker pool is full ({self._pending}/{self.max_pending} pending jobs)"
+                )
+            self._pending += 1
+
+        ctx = contextvars.copy_context()
+        future = self._executor.submit(ctx.run, functools.partial(self._call, fn), *args, **kwargs)
+        # Release the slot when the thread actually finishes, not when the
+        # awaiting coroutine goes away, so the cap reflects real thread usage
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Current pool occupancy and counters"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self) -> None:
+        """Stop accepting work and drop jobs that have not started"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
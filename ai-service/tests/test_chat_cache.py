@@ -0,0 +1,35 @@
+from services.chat_cache import ChatAnswerCache
+
+FINGERPRINT = "setup"
+
+
+def cache_with(message, reply="answer"):
+    cache = ChatAnswerCache()
+    cache.put(message, reply, FINGERPRINT)
+    return cache
+
+
+def test_rephrased_question_hits():
+    cache = cache_with("How do I donate food?")
+    assert cache.get("how do i donate food", FINGERPRINT) == "answer"
+    assert cache.get("How can I donate food?", FINGERPRINT) == "answer"
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_question_words_do_not_collide():
+    cache = cache_with("How do I donate food?")
+    for message in ("Where do I donate food?", "When do I donate food?", "Who do I donate food to?",
+                    "Why do I donate food?", "What do I donate food?"):
+        assert cache.get(message, FINGERPRINT) is None, message
+
+
+def test_question_words_do_not_collide_in_long_messages():
+    cache = cache_with("Where do I donate canned food and fresh vegetables from my restaurant kitchen?")
+    assert cache.get("When do I donate canned food and fresh vegetables from my restaurant kitchen?",
+                     FINGERPRINT) is None
+
+
+def test_negation_does_not_collide():
+    cache = cache_with("Why can I donate cooked food?")
+    assert cache.get("Why can't I donate cooked food?", FINGERPRINT) is None
+    assert cache.get("Why cannot I donate cooked food?", FINGERPRINT) is None
@@ -0,0 +1,51 @@
+import threading
+
+from services.hedging import HedgePolicy
+
+
+def test_queued_leg_cancelled_unsent():
+    policy = HedgePolicy(max_threads=1)
+    release = threading.Event()
+    policy._hedge_executor.submit(release.wait)
+    try:
+        leg = policy.start(lambda leg: leg.mark_sent(), is_hedge=True)
+        assert leg.cancel() is True
+        assert leg.future.cancelled()
+    finally:
+        release.set()
+        policy.shutdown()
+
+
+def test_leg_cancelled_before_sending_never_sends():
+    policy = HedgePolicy()
+    started, release = threading.Event(), threading.Event()
+
+    def call(leg):
+        started.set()
+        release.wait()
+        return leg.mark_sent()
+
+    leg = policy.start(call, is_hedge=True)
+    started.wait()
+    assert leg.cancel() is True
+    release.set()
+    assert leg.result() is False
+    assert leg.sent is False
+    policy.shutdown()
+
+
+def test_sent_leg_is_not_refundable():
+    policy = HedgePolicy()
+    leg = policy.start(lambda leg: leg.mark_sent(), is_hedge=True)
+    assert leg.result() is True
+    assert leg.cancel() is False
+    policy.shutdown()
+
+
+def test_refund_restores_the_budget():
+    policy = HedgePolicy(max_rate=0)
+    assert policy.try_spend()
+    assert not policy.try_spend()
+    policy.refund()
+    assert policy.try_spend()
+    assert policy.stats()["hedges"] == 1
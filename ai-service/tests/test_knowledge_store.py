@@ -0,0 +1,90 @@
+import json
+import os
+
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from services import knowledge_store
+from services.knowledge_store import KnowledgeStore
+
+
+def write_pdf(path, text=None):
+    """One-page PDF, blank or with a line of Helvetica text"""
+    writer = PdfWriter()
+    page = writer.add_blank_page(width=300, height=200)
+    if text is not None:
+        font = DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        })
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): writer._add_object(font)}),
+        })
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 12 Tf 20 100 Td ({text}) Tj ET".encode("latin-1"))
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def make_store(tmp_path, knowledge_dir):
+    paths = knowledge_store.discover_knowledge_paths(str(knowledge_dir), None)
+    return KnowledgeStore(paths, str(tmp_path / "artifact"), base_dir=str(knowledge_dir))
+
+
+def count_builds(monkeypatch):
+    calls = []
+    build = KnowledgeStore.build
+
+    def counting_build(self):
+        calls.append(self)
+        return build(self)
+
+    monkeypatch.setattr(KnowledgeStore, "build", counting_build)
+    return calls
+
+
+def test_textless_pdf_does_not_rebuild_on_second_load(tmp_path, monkeypatch):
+    knowledge_dir = tmp_path / "knowledge"
+    knowledge_dir.mkdir()
+    write_pdf(knowledge_dir / "guide.pdf", "Donate canned food at the pantry")
+    write_pdf(knowledge_dir / "scan.pdf")
+    builds = count_builds(monkeypatch)
+
+    first = make_store(tmp_path, knowledge_dir).load()
+    assert first is not None and first.document_count == 1
+    assert len(builds) == 1
+
+    second = make_store(tmp_path, knowledge_dir).load()
+    assert len(builds) == 1
+    assert second.fingerprint == first.fingerprint
+
+
+def test_only_textless_pdfs_are_not_rebuilt(tmp_path, monkeypatch):
+    knowledge_dir = tmp_path / "knowledge"
+    knowledge_dir.mkdir()
+    write_pdf(knowledge_dir / "scan.pdf")
+    builds = count_builds(monkeypatch)
+
+    assert make_store(tmp_path, knowledge_dir).load() is None
+    assert make_store(tmp_path, knowledge_dir).load() is None
+    assert len(builds) == 1
+
+
+def test_manifest_paths_are_relative_to_knowledge_dir(tmp_path, monkeypatch):
+    knowledge_dir = tmp_path / "knowledge"
+    knowledge_dir.mkdir()
+    write_pdf(knowledge_dir / "guide.pdf", "Donate canned food at the pantry")
+    make_store(tmp_path, knowledge_dir).load()
+
+    with open(tmp_path / "artifact" / "manifest.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert [s["path"] for s in manifest["sources"]] == ["guide.pdf"]
+
+    # The same artifact stays valid after the knowledge directory moves
+    moved = tmp_path / "moved"
+    os.rename(knowledge_dir, moved)
+    builds = count_builds(monkeypatch)
+    assert make_store(tmp_path, moved).load() is not None
+    assert builds == []
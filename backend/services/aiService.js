@@ -29,6 +29,8 @@ const analyzeFoodImage = async (imageUrl) => {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          // Lets the AI service skip retries and Gemini calls that would finish after we give up
+          'X-Request-Timeout-Ms': String(AI_SERVICE_TIMEOUT),
         },
         body: JSON.stringify({
           imageUrl: imageUrl,
@@ -76,6 +78,11 @@ const analyzeFoodImage = async (imageUrl) => {
           throw new Error(message || 'Invalid image content');
         }
         
+        // The AI service could not finish within our timeout
+        if (response.status === 504) {
+          throw new Error('AI service request timed out. Please try again.');
+        }
+        
         // Check for rate limit errors
         const errorMessage = errorData.detail?.message || errorData.message || '';
         if (response.status === 503 && (errorMessage.includes('quota') || errorMessage.includes('rate limit'))) {